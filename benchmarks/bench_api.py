@@ -0,0 +1,71 @@
+# Request throughput of the ASGI API, driven in-process without an HTTP server.
+#
+#   python benchmarks/bench_api.py --concurrency 64 --requests 5000
+#
+# Measures the application and its SQLite thread pool; put a real server
+# (uvicorn --workers N) in front and use an HTTP load generator for end-to-end numbers.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+async def call(app, method, path, query="", body=None, token=None):
+    payload = json.dumps(body).encode() if body is not None else b""
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path, "query_string": query.encode(), "headers": headers},
+              receive, send)
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+async def run(args):
+    import supermarket_api
+
+    status, result = await call(supermarket_api.app, "POST", "/users", body={"username": "bench", "password": "pw"})
+    user_id = result["data"]
+    status, session = await call(supermarket_api.app, "POST", "/login", body={"username": "bench", "password": "pw"})
+    mix = [
+        lambda: ("GET", "/products", f"q={random.randint(1, 50)}&limit=20", None),
+        lambda: ("GET", "/products", "category=foods&sort=price&limit=20", None),
+        lambda: ("GET", f"/products/{random.randint(1, 500)}", "", None),
+        lambda: ("POST", f"/users/{user_id}/wishlist", "", {"product_id": random.randint(1, 500)}),
+        lambda: ("GET", f"/users/{user_id}/cart", "", None),
+    ]
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            status, _ = await call(supermarket_api.app, *random.choice(mix)(), session["token"])
+            errors += status >= 500
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    print(f"requests={args.requests} concurrency={args.concurrency} elapsed={elapsed:.2f}s "
+          f"throughput={args.requests / elapsed:.0f}/s errors={errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process request throughput of the ASGI API.")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
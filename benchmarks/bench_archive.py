@@ -0,0 +1,121 @@
+# Archival of old orders and review texts: memory, file size and history reads.
+#
+#   python benchmarks/bench_archive.py --orders 500000 --reviews 200000 --keep-days 90
+#
+# Generates a year of orders (mostly Delivered) and reviews, then times order history
+# pages before archival, runs the archival job for everything older than --keep-days
+# with tracemalloc on to report its peak memory, VACUUMs, and times the same pages again:
+# recent pages come from SQLite alone, the deepest ones fill up from the archive.
+# Reports the database file size before and after and the archive size on disk.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_analytics  # noqa: E402
+import supermarket_archive  # noqa: E402
+import supermarket_db  # noqa: E402
+import supermarket_service  # noqa: E402
+
+WORDS = ["fresh", "great", "value", "quick", "delivery", "tasty", "cheap", "broken", "lovely", "again"]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def generate_dataset(pool, args, rng):
+    started = datetime.now() - timedelta(days=365)
+    with pool.connection() as conn:
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'customer')",
+                         [(f"user{i}@bench.test",) for i in range(args.users)])
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+        product_ids = [row[0] for row in conn.execute("SELECT id FROM products")]
+        cursor = conn.cursor()
+        for first in range(0, args.orders, 5000):
+            orders = []
+            for _ in range(first, min(first + 5000, args.orders)):
+                date = (started + timedelta(seconds=rng.randrange(365 * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+                orders.append((rng.choice(user_ids), date, rng.choice(("Delivered",) * 8 + ("Cancelled", "Shipped")),
+                               rng.randint(1000, 10 ** 7), date))
+            first_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM orders").fetchone()[0]
+            cursor.executemany("""INSERT INTO orders (user_id, order_date, status, total_kobo, status_changed_at)
+                                  VALUES (?, ?, ?, ?, ?)""", orders)
+            cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity, price_kobo) VALUES (?, ?, ?, ?)",
+                               [(first_id + index, product_id, rng.randint(1, 3), rng.randint(100, 10 ** 6))
+                                for index in range(len(orders)) for product_id in rng.sample(product_ids, rng.randint(1, 4))])
+        reviews = {(rng.choice(user_ids), rng.choice(product_ids)) for _ in range(args.reviews)}
+        conn.executemany("INSERT INTO product_ratings (user_id, product_id, rating, review, date) VALUES (?, ?, ?, ?, ?)",
+                         [(user_id, product_id, rng.randint(1, 5), " ".join(rng.choices(WORDS, k=30)),
+                           (started + timedelta(seconds=rng.randrange(365 * 86400))).strftime("%Y-%m-%d %H:%M:%S"))
+                          for user_id, product_id in reviews])
+        conn.commit()
+    return user_ids
+
+# Latency of the first and of the last history page for a sample of customers
+def time_history(user_ids, rng, samples):
+    first, last = [], []
+    for user_id in rng.sample(user_ids, samples):
+        started = time.perf_counter()
+        _, _, after = supermarket_service.fetch_order_history(user_id)
+        elapsed = time.perf_counter() - started
+        first.append(elapsed)
+        while after is not None:
+            started = time.perf_counter()
+            _, _, after = supermarket_service.fetch_order_history(user_id, after)
+            elapsed = time.perf_counter() - started
+        last.append(elapsed)
+    return first, last
+
+def main():
+    parser = argparse.ArgumentParser(description="Archival memory, file size and history latency.")
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--reviews", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--keep-days", type=int, default=90)
+    parser.add_argument("--samples", type=int, default=200, help="customers whose history is paged through")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["SUPERMARKET_ARCHIVE_DIR"] = os.path.join(tmp, "archive")
+        pool = supermarket_db.init_db()
+        user_ids = generate_dataset(pool, args, rng)
+        supermarket_analytics.refresh_sales_rollups()
+        with pool.connection() as conn:
+            conn.execute("VACUUM")
+        size_before = os.path.getsize(os.environ["SUPERMARKET_DB_PATH"])
+        first_before, last_before = time_history(user_ids, random.Random(args.seed), args.samples)
+
+        cutoff = (datetime.now() - timedelta(days=args.keep_days)).strftime("%Y-%m-%d")
+        tracemalloc.start()
+        started = time.perf_counter()
+        orders = supermarket_archive.archive_orders(cutoff)
+        reviews = supermarket_archive.archive_reviews(cutoff)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        with pool.connection() as conn:
+            conn.execute("VACUUM")
+        size_after = os.path.getsize(os.environ["SUPERMARKET_DB_PATH"])
+        first_after, last_after = time_history(user_ids, random.Random(args.seed), args.samples)
+
+        print(f"archived {orders} of {args.orders} orders and {reviews} review texts in {elapsed:.1f}s "
+              f"(traced), peak {peak / 2 ** 20:.1f}MB")
+        print(f"database {size_before / 2 ** 20:.1f}MB -> {size_after / 2 ** 20:.1f}MB after VACUUM; "
+              f"archive {directory_size(os.environ['SUPERMARKET_ARCHIVE_DIR']) / 2 ** 20:.1f}MB")
+        for name, before, after in (("first page", first_before, first_after), ("last page", last_before, last_after)):
+            print(f"{name:<11} p50 {percentile(before, 50) * 1000:6.2f}ms -> {percentile(after, 50) * 1000:6.2f}ms   "
+                  f"p95 {percentile(before, 95) * 1000:6.2f}ms -> {percentile(after, 95) * 1000:6.2f}ms")
+
+if __name__ == "__main__":
+    main()
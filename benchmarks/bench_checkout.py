@@ -0,0 +1,79 @@
+# Concurrent checkout throughput against a handful of hot SKUs.
+#
+#   python benchmarks/bench_checkout.py --threads 16 --orders 200 --hot 5 --stock 500
+#
+# Every simulated customer fills a cart with hot products and checks out through
+# supermarket_service.checkout_with_retry. Afterwards the run verifies that no
+# stock went negative and that sold units match the stock that disappeared.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_service  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent checkout throughput against hot SKUs.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--orders", type=int, default=200, help="checkouts per thread")
+    parser.add_argument("--hot", type=int, default=5, help="number of hot products")
+    parser.add_argument("--stock", type=int, default=500, help="starting stock of each hot product")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["SUPERMARKET_DB_POOL_SIZE"] = str(args.threads)
+        pool = supermarket_db.init_db()
+        hot = list(range(1, args.hot + 1))
+        customers = args.threads * args.orders
+
+        with pool.connection() as conn:
+            conn.executemany("UPDATE products SET stock = ? WHERE id = ?", [(args.stock, pid) for pid in hot])
+            conn.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'customer')",
+                             [(f"bench{i}",) for i in range(customers)])
+            user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'bench%' ORDER BY id")]
+            conn.executemany("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)",
+                             [(uid, pid, random.randint(1, 3))
+                              for uid in user_ids for pid in random.sample(hot, random.randint(1, len(hot)))])
+            conn.commit()
+
+        outcomes = {"placed": 0, "rejected": 0}
+        lock = threading.Lock()
+
+        def worker(batch):
+            for uid in batch:
+                try:
+                    supermarket_service.checkout_with_retry(uid)
+                    result = "placed"
+                except supermarket_service.CheckoutError:
+                    result = "rejected"
+                with lock:
+                    outcomes[result] += 1
+
+        threads = [threading.Thread(target=worker, args=(user_ids[i::args.threads],)) for i in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with pool.connection() as conn:
+            stock = dict(conn.execute(f"SELECT id, stock FROM products WHERE id IN ({','.join('?' * len(hot))})", hot))
+            sold = dict(conn.execute("SELECT product_id, SUM(quantity) FROM order_items GROUP BY product_id"))
+
+    print(f"threads={args.threads} checkouts={customers} elapsed={elapsed:.2f}s "
+          f"throughput={customers / elapsed:.0f}/s placed={outcomes['placed']} rejected={outcomes['rejected']}")
+    negative = [pid for pid, units in stock.items() if units < 0]
+    mismatched = [pid for pid in hot if args.stock - stock[pid] != sold.get(pid, 0)]
+    print(f"min stock={min(stock.values())} negative={negative} mismatched={mismatched}")
+    if negative or mismatched:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
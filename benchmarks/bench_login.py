@@ -0,0 +1,98 @@
+# Login throughput and its effect on everything else running in the process.
+#
+#   python benchmarks/bench_login.py --threads 32 --logins 20 --legacy 0.5
+#
+# Simulated users log in concurrently through supermarket_service.login while a
+# reader thread keeps running a cheap catalog query. Part of the accounts start
+# with legacy unsalted SHA-256 hashes and get upgraded on their first login.
+# Reports login p50/p95, the reader's p95 (to show the KDF pool is not starving
+# other work) and how many legacy hashes remain afterwards.
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_service  # noqa: E402
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent login throughput with salted scrypt hashes.")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--logins", type=int, default=20, help="logins per thread")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--legacy", type=float, default=0.5, help="share of accounts with legacy SHA-256 hashes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["SUPERMARKET_DB_POOL_SIZE"] = str(args.threads + 1)
+        pool = supermarket_db.init_db()
+        legacy = int(args.users * args.legacy)
+        modern = supermarket_service.hash_password("secret")
+        with pool.connection() as conn:
+            conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, 'customer')",
+                             [(f"bench{i}", hashlib.sha256(b"secret").hexdigest() if i < legacy else modern)
+                              for i in range(args.users)])
+            conn.commit()
+
+        login_times, reader_times = [], []
+        failures = {"rejected": 0, "busy": 0}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def worker():
+            for _ in range(args.logins):
+                started = time.perf_counter()
+                result = supermarket_service.login(f"bench{random.randrange(args.users)}", "secret")
+                elapsed = time.perf_counter() - started
+                with lock:
+                    login_times.append(elapsed)
+                    if not result.ok:
+                        failures["busy" if "Too many" in result.message else "rejected"] += 1
+
+        def reader():
+            while not done.is_set():
+                started = time.perf_counter()
+                supermarket_service.count_products(None, "All", 0.0, 1e9)
+                supermarket_service.catalog_cache().invalidate_searches()
+                reader_times.append(time.perf_counter() - started)
+                time.sleep(0.005)
+
+        background = threading.Thread(target=reader)
+        background.start()
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        background.join()
+
+        with pool.connection() as conn:
+            remaining = conn.execute("SELECT COUNT(*) FROM users WHERE password NOT LIKE 'scrypt$%'").fetchone()[0]
+
+    total = len(login_times)
+    print(f"threads={args.threads} logins={total} kdf_workers={supermarket_service.KDF_WORKERS} "
+          f"elapsed={elapsed:.2f}s throughput={total / elapsed:.0f}/s")
+    print(f"login p50={statistics.median(login_times) * 1000:.1f}ms p95={percentile(login_times, 95) * 1000:.1f}ms "
+          f"rejected={failures['rejected']} busy={failures['busy']}")
+    print(f"reader queries={len(reader_times)} p50={statistics.median(reader_times) * 1000:.2f}ms "
+          f"p95={percentile(reader_times, 95) * 1000:.2f}ms")
+    print(f"legacy hashes before={legacy} after={remaining}")
+    if failures["rejected"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
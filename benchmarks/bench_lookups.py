@@ -0,0 +1,86 @@
+# Lookup latency for cart, wishlist, order items and reviews as the tables grow.
+#
+#   python benchmarks/bench_lookups.py --sizes 10000 100000 1000000 10000000
+#
+# Each size gets a fresh database migrated with supermarket_db.migrate_db,
+# filled with synthetic rows, then probed with the same queries the app runs.
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+
+PRODUCTS = 500
+BATCH = 50_000
+
+LOOKUPS = {
+    "view_cart": ("""
+        SELECT p.id, p.name, p.price_kobo, c.quantity
+        FROM cart c JOIN products p ON c.product_id = p.id
+        WHERE c.user_id = ?""", "user"),
+    "wishlist_check": ("SELECT 1 FROM wishlist WHERE user_id = ? AND product_id = ?", "user_product"),
+    "order_items": ("""
+        SELECT p.name, oi.quantity, oi.price_kobo
+        FROM order_items oi JOIN products p ON oi.product_id = p.id
+        WHERE oi.order_id = ?""", "order"),
+    "product_reviews": ("""
+        SELECT r.rating, r.review, r.date FROM product_ratings r
+        WHERE r.product_id = ? ORDER BY r.date DESC LIMIT 20""", "product"),
+}
+
+def fill(conn, rows):
+    users = max(rows // 10, 1)
+    orders = max(rows // 4, 1)
+    cursor = conn.cursor()
+    for start in range(0, rows, BATCH):
+        count = min(BATCH, rows - start)
+        cursor.executemany("INSERT OR IGNORE INTO cart VALUES (?, ?, ?)",
+                           ((random.randrange(users), random.randrange(1, PRODUCTS + 1), 1) for _ in range(count)))
+        cursor.executemany("INSERT OR IGNORE INTO wishlist VALUES (?, ?)",
+                           ((random.randrange(users), random.randrange(1, PRODUCTS + 1)) for _ in range(count)))
+        cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity, price_kobo) VALUES (?, ?, ?, ?)",
+                           ((random.randrange(orders), random.randrange(1, PRODUCTS + 1), 1, 100000) for _ in range(count)))
+        cursor.executemany("INSERT OR IGNORE INTO product_ratings VALUES (?, ?, ?, ?, ?)",
+                           ((random.randrange(users), random.randrange(1, PRODUCTS + 1), 3, "ok",
+                             f"2024-01-{random.randint(1, 28):02d}") for _ in range(count)))
+        conn.commit()
+    return users, orders
+
+def probe(conn, sql, kind, users, orders, repeat):
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        if kind == "user":
+            params = (random.randrange(users),)
+        elif kind == "user_product":
+            params = (random.randrange(users), random.randrange(1, PRODUCTS + 1))
+        elif kind == "order":
+            params = (random.randrange(orders),)
+        else:
+            params = (random.randrange(1, PRODUCTS + 1),)
+        cursor.execute(sql, params).fetchall()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Lookup latency as the cart, wishlist, order_items and product_ratings tables grow.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=2_000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} " + " ".join(f"{name:>16}" for name in LOOKUPS) + "   (µs per lookup)")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+            supermarket_db.migrate_db(conn)
+            users, orders = fill(conn, size)
+            timings = [probe(conn, sql, kind, users, orders, args.repeat) for sql, kind in LOOKUPS.values()]
+            conn.close()
+        print(f"{size:>10} " + " ".join(f"{t:>16.1f}" for t in timings))
+
+if __name__ == "__main__":
+    main()
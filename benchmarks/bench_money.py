@@ -0,0 +1,99 @@
+# Cart totals with thousands of lines, and a randomized exactness check of kobo money.
+#
+#   python benchmarks/bench_money.py --lines 1000 5000 20000 --cases 500
+#
+# For each cart size the script fills one cart with that many distinct products at
+# random prices, then times get_cart_total (one SQL SUM) against summing the fetched
+# lines in Python, and times a full checkout. Before that, --cases random carts
+# check that the SQL total, the stored order total and the order lines all equal
+# the exact Decimal sum, and count how often the old float-Naira sum drifted.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_service  # noqa: E402
+
+def fill_cart(pool, user_id, products, rng):
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
+        conn.executemany("UPDATE products SET price_kobo = ?, stock = ? WHERE id = ?",
+                         [(rng.choice((rng.randint(1, 99), rng.randint(1, 10 ** 9))), 10 ** 6, pid) for pid in products])
+        quantities = [(user_id, pid, rng.randint(1, 50)) for pid in products]
+        conn.executemany("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)", quantities)
+        conn.commit()
+        prices = dict(conn.execute(f"SELECT id, price_kobo FROM products WHERE id IN ({', '.join('?' * len(products))})",
+                                   products))
+    return [(prices[pid], quantity) for _, pid, quantity in quantities]
+
+# Randomized carts: every total must match exact Decimal arithmetic to the kobo
+def check_exactness(pool, user_id, product_ids, cases, rng):
+    drifted = 0
+    for _ in range(cases):
+        products = rng.sample(product_ids, rng.randint(1, 40))
+        lines = fill_cart(pool, user_id, products, rng)
+        expected = sum(Decimal(price) * quantity for price, quantity in lines)
+        floats = 0.0
+        for price, quantity in lines:
+            floats += price / 100 * quantity
+        drifted += Decimal(repr(floats)) != expected / 100
+
+        cart_total = supermarket_service.get_cart_total(user_id)
+        order_id = supermarket_service.checkout_with_retry(user_id)
+        with pool.connection() as conn:
+            stored = conn.execute("SELECT total_kobo FROM orders WHERE id = ?", (order_id,)).fetchone()[0]
+            line_sum = conn.execute("SELECT SUM(price_kobo * quantity) FROM order_items WHERE order_id = ?",
+                                    (order_id,)).fetchone()[0]
+        if not (cart_total == stored == line_sum == expected) or not isinstance(stored, int):
+            raise AssertionError(f"order {order_id}: cart={cart_total} stored={stored} lines={line_sum} "
+                                 f"expected={expected}")
+    return drifted
+
+def main():
+    parser = argparse.ArgumentParser(description="Cart totals over large carts and exactness of kobo money.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--cases", type=int, default=300, help="random carts for the exactness check")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        pool = supermarket_db.init_db()
+        largest = max(args.lines)
+        with pool.connection() as conn:
+            conn.executemany("INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (?, 'other', 9, 0, 0)",
+                             [(f"bench product {i}",) for i in range(largest)])
+            conn.execute("INSERT INTO users (username, password, role) VALUES ('bench', 'x', 'customer')")
+            conn.commit()
+            product_ids = [row[0] for row in conn.execute("SELECT id FROM products ORDER BY id")]
+            user_id = conn.execute("SELECT id FROM users WHERE username = 'bench'").fetchone()[0]
+
+        drifted = check_exactness(pool, user_id, product_ids, args.cases, rng)
+        print(f"exactness: {args.cases} random carts matched to the kobo; float Naira sums drifted in {drifted}")
+
+        print(f"{'lines':>8}{'SQL SUM ms':>12}{'fetch+sum ms':>14}{'checkout ms':>13}")
+        for size in args.lines:
+            fill_cart(pool, user_id, rng.sample(product_ids, size), rng)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                total = supermarket_service.get_cart_total(user_id)
+            sql_ms = (time.perf_counter() - started) / args.repeat * 1000
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                fetched = sum(line[2] * line[3] for line in supermarket_service.get_cart(user_id))
+            fetch_ms = (time.perf_counter() - started) / args.repeat * 1000
+            assert fetched == total
+            started = time.perf_counter()
+            supermarket_service.checkout_with_retry(user_id)
+            checkout_ms = (time.perf_counter() - started) * 1000
+            print(f"{size:>8}{sql_ms:>12.2f}{fetch_ms:>14.2f}{checkout_ms:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Offline recommendation build over millions of order lines, and the lookup the views make.
+#
+#   python benchmarks/bench_recommendations.py --lines 2000000 --products 20000 --memory-mb 64 128 256
+#
+# Generates customers whose orders and wishlists draw mostly from a few product "aisles",
+# so related products genuinely co-occur. For each memory budget the script rebuilds
+# product_recommendations and reports the build time and the peak memory allocated during
+# a rebuild (tracemalloc, interaction arrays included), then times get_recommendations for
+# one product (product view) and for ten (a cart) and checks how many neighbours share the aisle.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_recommendations  # noqa: E402
+import supermarket_service  # noqa: E402
+
+AISLE_SIZE = 50
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+# Bulk-loads the dataset straight into SQLite; returns the product ids
+def generate_dataset(pool, args, rng):
+    with pool.connection() as conn:
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'customer')",
+                         [(f"user{i}@bench.test",) for i in range(args.users)])
+        conn.executemany("INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (?, 'other', 9, 100, 100)",
+                         [(f"bench product {i}",) for i in range(args.products)])
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+        product_ids = [row[0] for row in conn.execute("SELECT id FROM products ORDER BY id")]
+        aisles = [product_ids[i:i + AISLE_SIZE] for i in range(0, len(product_ids), AISLE_SIZE)]
+        favourites = {user_id: rng.sample(aisles, 2) for user_id in user_ids}
+
+        def basket(user_id):
+            return {rng.choice(rng.choice(favourites[user_id])) if rng.random() < 0.8 else rng.choice(product_ids)
+                    for _ in range(rng.randint(1, 8))}
+
+        written = 0
+        cursor = conn.cursor()
+        while written < args.lines:
+            orders = [(rng.choice(user_ids),) for _ in range(5000)]
+            first_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM orders").fetchone()[0]
+            cursor.executemany("""INSERT INTO orders (user_id, order_date, status, total_kobo)
+                                  VALUES (?, '2024-01-01 00:00:00', 'Delivered', 0)""", orders)
+            lines = [(first_id + index, product_id) for index, (user_id,) in enumerate(orders) for product_id in basket(user_id)]
+            cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity, price_kobo) VALUES (?, ?, 1, 100)",
+                               lines)
+            written += len(lines)
+        conn.executemany("INSERT OR IGNORE INTO wishlist (user_id, product_id) VALUES (?, ?)",
+                         [(user_id, product_id) for user_id in user_ids for product_id in basket(user_id)])
+        conn.commit()
+    return product_ids, written
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommendation build at scale and its lookup latency.")
+    parser.add_argument("--lines", type=int, default=2_000_000, help="order lines to generate")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--memory-mb", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        pool = supermarket_db.init_db()
+        started = time.perf_counter()
+        product_ids, lines = generate_dataset(pool, args, rng)
+        print(f"loaded {lines} order lines for {args.users} customers and {args.products} products "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        print(f"{'budget MB':>10}{'build s':>9}{'peak MB':>9}{'products':>10}{'rows':>10}")
+        for memory_mb in args.memory_mb:
+            started = time.perf_counter()
+            covered, written = supermarket_recommendations.build_recommendations(memory_mb=memory_mb)
+            elapsed = time.perf_counter() - started
+            # tracemalloc slows allocation down a lot, so the peak comes from a second, untimed build
+            tracemalloc.start()
+            supermarket_recommendations.build_recommendations(memory_mb=memory_mb)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{memory_mb:>10}{elapsed:>9.1f}{peak / 2 ** 20:>9.0f}{covered:>10}{written:>10}")
+
+        position = {product_id: index for index, product_id in enumerate(product_ids)}
+        for size in (1, 10):
+            samples, same_aisle, shown = [], 0, 0
+            for _ in range(args.lookups):
+                picked = rng.sample(product_ids, size)
+                started = time.perf_counter()
+                recommended = supermarket_service.get_recommendations(picked)
+                samples.append(time.perf_counter() - started)
+                aisles = {position[product_id] // AISLE_SIZE for product_id in picked}
+                same_aisle += sum(position[row[0]] // AISLE_SIZE in aisles for row in recommended)
+                shown += len(recommended)
+            print(f"lookup for {size:>2} products: p50 {percentile(samples, 50) * 1000:.2f}ms "
+                  f"p95 {percentile(samples, 95) * 1000:.2f}ms; {same_aisle / max(shown, 1):.0%} from the same aisle")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Session lookups and the expiry sweep with a large session table.
+#
+#   python benchmarks/bench_sessions.py --sessions 300000 --lookups 20000 --expired 0.5
+#
+# Bulk-loads --sessions rows for a few thousand users, a share of them already
+# expired, then times get_session (the one indexed lookup every rerun makes) for
+# random live tokens, the rotation path for tokens past the rotate interval, and
+# one sweep_sessions call that deletes the expired share in batches. Reports the
+# table size before and after and the longest single sweep batch, which bounds
+# how long writers can be held up.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_repository  # noqa: E402
+import supermarket_service  # noqa: E402
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def timed_lookups(tokens, count, rng):
+    samples = []
+    for _ in range(count):
+        token = rng.choice(tokens)
+        started = time.perf_counter()
+        session = supermarket_service.get_session(token)
+        samples.append(time.perf_counter() - started)
+        assert session is not None
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Session store lookups and sweeps at scale.")
+    parser.add_argument("--sessions", type=int, default=300000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--expired", type=float, default=0.5, help="share of sessions already expired")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        pool = supermarket_db.init_db()
+        now = time.time()
+        fresh, due = [], []
+        with pool.connection() as conn:
+            conn.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'customer')",
+                             [(f"user{i}@bench.test",) for i in range(args.users)])
+            user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+            rows = []
+            for i in range(args.sessions):
+                token = f"bench-token-{i}"
+                if rng.random() < args.expired:
+                    issued = now - supermarket_service.SESSION_TTL_SECONDS - rng.randrange(86400)
+                elif i % 2:
+                    issued = now - rng.randrange(supermarket_service.SESSION_ROTATE_SECONDS)
+                    fresh.append(token)
+                else:
+                    issued = now - supermarket_service.SESSION_ROTATE_SECONDS - rng.randrange(3600)
+                    due.append(token)
+                rows.append((supermarket_service.session_key(token), rng.choice(user_ids), issued,
+                             issued + supermarket_service.SESSION_TTL_SECONDS))
+            conn.executemany("INSERT INTO sessions (token_hash, user_id, issued_at, expires_at) VALUES (?, ?, ?, ?)",
+                             rows)
+            conn.commit()
+        print(f"loaded {args.sessions} sessions in {time.time() - now:.1f}s "
+              f"({len(fresh)} live, {len(due)} due for rotation)")
+
+        samples = timed_lookups(fresh, args.lookups, rng)
+        print(f"get_session          p50 {percentile(samples, 50) * 1e6:7.0f}µs  p95 {percentile(samples, 95) * 1e6:7.0f}µs")
+        samples = timed_lookups(due, min(args.lookups, len(due)) // 2, rng)
+        print(f"get_session+rotate   p50 {percentile(samples, 50) * 1e6:7.0f}µs  p95 {percentile(samples, 95) * 1e6:7.0f}µs")
+
+        repository = supermarket_repository.repository()
+        batches = []
+        swept = 0
+        started = time.perf_counter()
+        while True:
+            batch_started = time.perf_counter()
+            deleted = repository.sweep_sessions(time.time(), supermarket_service.SESSION_SWEEP_BATCH)
+            batches.append(time.perf_counter() - batch_started)
+            swept += deleted
+            if deleted < supermarket_service.SESSION_SWEEP_BATCH:
+                break
+        elapsed = time.perf_counter() - started
+        with pool.connection() as conn:
+            remaining = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        print(f"sweep                {swept} expired in {elapsed:.2f}s over {len(batches)} batches, "
+              f"longest batch {max(batches) * 1000:.1f}ms; {remaining} sessions left")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Mixed read/write load under each storage profile.
+#
+#   python benchmarks/bench_storage.py --readers 8 --writers 4 --seconds 5
+#
+# Readers run catalog searches and cart views, writers add to cart and check out,
+# all through supermarket_db's connection pool for the profile under test.
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_repository  # noqa: E402
+import supermarket_service  # noqa: E402
+
+def run_profile(profile, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        config = supermarket_db.storage_config(profile=profile, path=os.path.join(tmp, "bench.db"),
+                                                   pool_size=args.readers + args.writers)
+        pool = supermarket_db.ConnectionPool(config)
+        with pool.connection() as conn:
+            supermarket_db.migrate_db(conn)
+            conn.execute("UPDATE products SET stock = 1000000")
+            conn.executemany("INSERT INTO users (username, password, role) VALUES (?, 'x', 'customer')",
+                             [(f"bench{i}",) for i in range(args.writers * 10)])
+            conn.commit()
+        repository = supermarket_repository.SQLiteRepository(pool)
+
+        counts = {"reads": 0, "writes": 0, "busy": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.seconds
+
+        def reader():
+            done = 0
+            while time.perf_counter() < deadline:
+                with pool.connection() as conn:
+                    sql, params, _ = supermarket_repository.build_product_search(str(random.randint(1, 50)))
+                    conn.execute("SELECT p.id, p.name, p.price_kobo" + sql + " LIMIT 20", params).fetchall()
+                    conn.execute("SELECT product_id, quantity FROM cart WHERE user_id = ?",
+                                 (random.randint(1, args.writers * 10),)).fetchall()
+                done += 1
+            with lock:
+                counts["reads"] += done
+
+        def writer(index):
+            done = busy = 0
+            while time.perf_counter() < deadline:
+                user_id = index * 10 + random.randint(1, 10)
+                with pool.connection() as conn:
+                    try:
+                        conn.execute("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, 1) "
+                                     "ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + 1",
+                                     (user_id, random.randint(1, 500)))
+                        conn.commit()
+                    except sqlite3.OperationalError:
+                        busy += 1
+                        continue
+                try:
+                    repository.checkout(user_id, supermarket_service.order_confirmation)
+                    done += 1
+                except supermarket_repository.StoreBusyError:
+                    busy += 1
+            with lock:
+                counts["writes"] += done
+                counts["busy"] += busy
+
+        threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed read/write load under each storage profile.")
+    parser.add_argument("--profiles", nargs="+", default=list(supermarket_db.STORAGE_PROFILES))
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'profile':>10} {'reads/s':>10} {'checkouts/s':>12} {'busy':>6}")
+    for profile in args.profiles:
+        counts = run_profile(profile, args)
+        print(f"{profile:>10} {counts['reads'] / args.seconds:>10.0f} "
+              f"{counts['writes'] / args.seconds:>12.0f} {counts['busy']:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# Mixed-workload benchmark over every data path the UI uses.
+#
+#   python benchmarks/bench_suite.py --users 2000 --products 20000 --orders 50000 --reviews 50000 \
+#       --threads 8 --seconds 30 --output results.json --compare baseline.json
+#
+# Builds a synthetic dataset of the requested size in a temporary database, then
+# drives supermarket_service (the same calls supermarket_system.py makes, without
+# Streamlit) from concurrent threads with a weighted operation mix. Reports count,
+# errors, throughput and p50/p95/p99 latency per operation; --output saves them as
+# JSON and --compare prints the p95 change against an earlier run. Order emails go to
+# a local SMTP sink (smtp_sink.py), so the outbox worker runs but nothing is mailed.
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_db  # noqa: E402
+import supermarket_service  # noqa: E402
+from smtp_sink import local_smtp  # noqa: E402
+
+WORDS = ["fresh", "organic", "rice", "bread", "milk", "cheese", "juice", "soap", "phone", "cable",
+         "shirt", "socks", "sandal", "collar", "biscuit", "chocolate", "coffee", "tea", "pepper", "yam"]
+
+# Relative weight of each operation in the mix
+OPERATION_WEIGHTS = {
+    "search_text": 20, "search_filtered": 15, "browse_page": 15, "count_products": 5,
+    "get_product": 10, "product_reviews": 8, "rating_summary": 5, "order_history": 8,
+    "view_cart": 5, "add_to_cart": 4, "place_order": 2, "rate_product": 2, "login": 1,
+    "bulk_transition": 1,
+}
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+# Bulk-loads users, products, orders (with items) and reviews straight into SQLite
+def generate_dataset(pool, args, rng):
+    password = supermarket_service.hash_password("secret")
+    names = list(supermarket_db.categories)
+    started = datetime.now() - timedelta(days=365)
+    with pool.connection() as conn:
+        conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, 'customer')",
+                         [(f"user{i}@bench.test", password) for i in range(args.users)])
+        conn.executemany("INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (?, ?, ?, ?, ?)",
+                         [(f"{' '.join(rng.sample(WORDS, 3))} {i}", category, supermarket_db.categories[category],
+                           rng.randint(500, 100000) * 100 + rng.randrange(100), rng.randint(1000, 5000))
+                          for i, category in ((i, rng.choice(names)) for i in range(args.products))])
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+        products = conn.execute("SELECT id, price_kobo FROM products").fetchall()
+
+        for first in range(0, args.orders, 5000):
+            batch = range(first, min(first + 5000, args.orders))
+            lines = {}
+            orders = []
+            for _ in batch:
+                picked = rng.sample(products, rng.randint(1, 5))
+                lines_for_order = [(pid, rng.randint(1, 3), price) for pid, price in picked]
+                date = started + timedelta(seconds=rng.randrange(365 * 86400))
+                orders.append((rng.choice(user_ids), date.strftime("%Y-%m-%d %H:%M:%S"), "Processing",
+                               sum(q * price for _, q, price in lines_for_order)))
+                lines[len(orders) - 1] = lines_for_order
+            cursor = conn.cursor()
+            first_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM orders").fetchone()[0]
+            cursor.executemany("INSERT INTO orders (user_id, order_date, status, total_kobo) VALUES (?, ?, ?, ?)",
+                               orders)
+            cursor.executemany("INSERT INTO order_items (order_id, product_id, quantity, price_kobo) VALUES (?, ?, ?, ?)",
+                               [(first_id + index, pid, quantity, price)
+                                for index, order_lines in lines.items() for pid, quantity, price in order_lines])
+
+        reviews = {(rng.choice(user_ids), rng.choice(products)[0]) for _ in range(args.reviews)}
+        conn.executemany("""
+            INSERT INTO product_ratings (user_id, product_id, rating, review, date) VALUES (?, ?, ?, ?, ?)""",
+                         [(uid, pid, rng.randint(1, 5), " ".join(rng.sample(WORDS, 6)),
+                           (started + timedelta(seconds=rng.randrange(365 * 86400))).strftime("%Y-%m-%d %H:%M:%S"))
+                          for uid, pid in reviews])
+        conn.commit()
+        product_ids = [pid for pid, _ in products]
+    return user_ids, product_ids
+
+class Workload:
+    def __init__(self, user_ids, product_ids, rng):
+        self.user_ids = user_ids
+        self.product_ids = product_ids
+        self.rng = rng
+
+    def search_text(self):
+        supermarket_service.search_products_page(" ".join(self.rng.sample(WORDS, self.rng.randint(1, 2))),
+                                                 sort="relevance")
+
+    def search_filtered(self):
+        low = self.rng.randint(500, 80000) * 100
+        supermarket_service.search_products_page(self.rng.choice(WORDS), self.rng.choice(list(supermarket_db.categories)),
+                                                 low, low + 2000000, sort="price")
+
+    def browse_page(self):
+        # A few pages deep through the unfiltered catalogue, as the pager would walk it
+        after = None
+        for _ in range(self.rng.randint(1, 5)):
+            _, after = supermarket_service.search_products_page(None, after=after)
+            if after is None:
+                break
+
+    def count_products(self):
+        supermarket_service.count_products(self.rng.choice(WORDS), self.rng.choice(list(supermarket_db.categories)))
+
+    def get_product(self):
+        supermarket_service.get_product(self.rng.choice(self.product_ids))
+
+    def product_reviews(self):
+        supermarket_service.get_product_reviews(self.rng.choice(self.product_ids))
+
+    def rating_summary(self):
+        supermarket_service.get_rating_summary(self.rng.choice(self.product_ids))
+
+    def order_history(self):
+        supermarket_service.fetch_order_history(self.rng.choice(self.user_ids))
+
+    def view_cart(self):
+        supermarket_service.get_cart(self.rng.choice(self.user_ids))
+
+    def add_to_cart(self):
+        supermarket_service.add_to_cart(self.rng.choice(self.user_ids), self.rng.choice(self.product_ids), 1)
+
+    def place_order(self):
+        user_id = self.rng.choice(self.user_ids)
+        for product_id in self.rng.sample(self.product_ids, self.rng.randint(1, 3)):
+            supermarket_service.add_to_cart(user_id, product_id, 1)
+        return supermarket_service.place_order(user_id)
+
+    def rate_product(self):
+        return supermarket_service.rate_product(self.rng.choice(self.user_ids), self.rng.choice(self.product_ids),
+                                                self.rng.randint(1, 5), "benchmark review")
+
+    # Admin moving a batch of the oldest orders one step along the lifecycle
+    def bulk_transition(self):
+        status = self.rng.choice(("Processing", "Packed"))
+        orders, _ = supermarket_service.get_orders_by_status(status, limit=200)
+        return supermarket_service.transition_orders([order[0] for order in orders],
+                                                     supermarket_service.ORDER_TRANSITIONS[status][0])
+
+    def login(self):
+        return supermarket_service.login(f"user{self.rng.randrange(len(self.user_ids))}@bench.test", "secret")
+
+def run_workload(user_ids, product_ids, args):
+    names = list(OPERATION_WEIGHTS)
+    weights = [OPERATION_WEIGHTS[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        workload = Workload(user_ids, product_ids, rng)
+        local = {name: [] for name in names}
+        failed = {name: 0 for name in names}
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                result = getattr(workload, name)()
+                ok = getattr(result, "status", None) != "error"
+            except Exception:
+                ok = False
+            local[name].append(time.perf_counter() - started)
+            failed[name] += not ok
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += failed[name]
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    operations = {}
+    for name in names:
+        ordered = sorted(samples[name])
+        operations[name] = {
+            "count": len(ordered), "errors": errors[name],
+            "throughput": len(ordered) / elapsed,
+            "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+            "p50_ms": percentile(ordered, 50) * 1000,
+            "p95_ms": percentile(ordered, 95) * 1000,
+            "p99_ms": percentile(ordered, 99) * 1000,
+        }
+    return elapsed, operations
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-workload benchmark over the supermarket data paths.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-cache", action="store_true", help="disable the catalog cache to measure raw queries")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare p95 latencies with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, local_smtp() as sink:
+        os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["SUPERMARKET_DB_POOL_SIZE"] = str(args.threads)
+        if args.no_cache:
+            supermarket_service.CATALOG_CACHE_SIZE = 0
+        pool = supermarket_db.init_db()
+        started = time.perf_counter()
+        user_ids, product_ids = generate_dataset(pool, args, random.Random(args.seed))
+        load_seconds = time.perf_counter() - started
+        elapsed, operations = run_workload(user_ids, product_ids, args)
+        emails = len(sink.received)
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "sqlite": supermarket_db.sqlite3.sqlite_version,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "load_seconds": load_seconds, "elapsed_seconds": elapsed, "operations": operations,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["operations"]
+
+    print(f"dataset users={args.users} products={args.products} orders={args.orders} reviews={args.reviews} "
+          f"loaded in {load_seconds:.1f}s; threads={args.threads} elapsed={elapsed:.1f}s; {emails} emails to the sink")
+    print(f"{'operation':<16}{'count':>8}{'err':>5}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          + (f"{'p95 vs base':>13}" if baseline else ""))
+    for name, stats in operations.items():
+        line = (f"{name:<16}{stats['count']:>8}{stats['errors']:>5}{stats['throughput']:>9.0f}"
+                f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+        if baseline and baseline.get(name, {}).get("p95_ms"):
+            line += f"{(stats['p95_ms'] / baseline[name]['p95_ms'] - 1) * 100:>+12.0f}%"
+        print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
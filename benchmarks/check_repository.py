@@ -0,0 +1,260 @@
+# Runs one behavioural check list through supermarket_service against each storage backend.
+#
+#   python benchmarks/check_repository.py
+#   SUPERMARKET_PG_DSN=postgresql://localhost/supermarket_check python benchmarks/check_repository.py --backends sqlite postgres
+#
+# SQLite runs on a temporary file. PostgreSQL runs on the scratch database named by
+# SUPERMARKET_PG_DSN (the checks create their own users and products, so it need not be
+# empty, but the archival check moves every finished order and review text in it to a
+# temporary directory). Without a DSN a throwaway server is started from the pgserver
+# package (pip install pgserver), which bundles the PostgreSQL binaries. Every check must
+# give the same result on every backend; the script exits non-zero on the first mismatch
+# and times each backend's run.
+import argparse
+import logging
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_archive  # noqa: E402
+import supermarket_db  # noqa: E402
+import supermarket_recommendations  # noqa: E402
+import supermarket_repository  # noqa: E402
+import supermarket_service as service  # noqa: E402
+from smtp_sink import local_smtp  # noqa: E402
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+def run_checks():
+    run = secrets.token_hex(4)
+    user_id = service.register_user(f"check-{run}", "secret", "customer").data
+    other_id = service.register_user(f"other-{run}", "secret", "customer").data
+    check(not service.register_user(f"check-{run}", "x", "customer").ok, "duplicate username accepted")
+    check(service.login(f"check-{run}", "secret").data["user_id"] == user_id, "login failed")
+    check(not service.login(f"check-{run}", "wrong").ok, "wrong password accepted")
+
+    # Sessions: lookup, rotation with a grace period, logout and the expiry sweep
+    token = service.login(f"check-{run}", "secret").data["token"]
+    check(service.get_session(token) == (user_id, "customer", token), "session lookup")
+    repository = supermarket_repository.repository()
+    key = service.session_key(token)
+    now = time.time()
+    check(repository.rotate_session(key, service.session_key("rotated"), user_id, now, now + 60, now + 5), "rotate")
+    check(not repository.rotate_session(key, service.session_key("again"), user_id, now, now + 60, now + 5),
+          "session rotated twice")
+    check(service.get_session("rotated")[:2] == (user_id, "customer"), "rotated token")
+    check(service.get_session(token) is not None, "old token lost its grace period")
+    service.logout("rotated")
+    check(service.get_session("rotated") is None, "logout")
+    repository.create_session(service.session_key(f"expired-{run}"), user_id, now - 120, now - 60)
+    check(service.get_session(f"expired-{run}") is None, "expired session accepted")
+    check(service.sweep_sessions(batch_size=1) >= 1, "sweep")
+    check(repository.find_session(service.session_key(f"expired-{run}")) is None, "expired session kept")
+
+    # Products, search and keyset paging
+    word = f"zq{run}"
+    product_ids = [service.add_product(f"{word} item {i}", "foods", 1000 * (i + 1) + 1, 5).data for i in range(25)]
+    product = service.get_product(product_ids[0])
+    check(product == (product_ids[0], f"{word} item 0", "foods", 1, 1001, 5, 0, 0), f"product row {product}")
+    check(service.update_product(product_ids[0], f"{word} item 0", "foods", 999, 6).ok, "update failed")
+    check(service.get_product(product_ids[0])[4:6] == (999, 6), "update not visible")
+    check(not service.update_product(-1, "missing", "foods", 1, 1).ok, "update of a missing product")
+    check(not service.remove_product(-1).ok, "removal of a missing product")
+    check(service.count_products(word[:-3]) == 25, "prefix search count")
+    check(service.count_products(word, "foods", 2000, 10000) == 8, "filtered count")
+    check(service.count_products(word, "drinks") == 0, "category filter")
+    for sort in ("relevance", "id", "name", "price"):
+        seen, after = [], None
+        while True:
+            page, after = service.search_products_page(word, sort=sort, descending=sort == "price", after=after, limit=7)
+            seen += [row[0] for row in page]
+            if after is None:
+                break
+        check(sorted(seen) == sorted(product_ids), f"paging by {sort} lost or repeated rows")
+    prices = [row[3] for row in service.search_products_page(word, sort="price", limit=25)[0]]
+    check(prices == sorted(prices), "price order")
+
+    # Cart and wishlist
+    service.add_to_cart(user_id, product_ids[1], 2)
+    service.add_to_cart(user_id, product_ids[1], 1)
+    service.add_to_cart(user_id, product_ids[2], 1)
+    check(sorted(service.get_cart(user_id)) == [(product_ids[1], f"{word} item 1", 2001, 3),
+                                                (product_ids[2], f"{word} item 2", 3001, 1)], "cart lines")
+    check(service.get_cart_total(user_id) == 3 * 2001 + 3001, "cart total")
+    check(isinstance(service.get_cart_total(user_id), int), "cart total is not int")
+    check(not service.add_to_cart(user_id, product_ids[3], 6).ok, "over-stock add accepted")
+    check(not service.add_to_cart(user_id, product_ids[3], 0).ok, "zero quantity accepted")
+    check(not service.add_to_cart(user_id, product_ids[3], -3).ok, "negative quantity accepted")
+    check(service.add_to_wishlist(user_id, product_ids[4]).ok, "wishlist add")
+    check(service.add_to_wishlist(user_id, product_ids[4]).status == "warning", "wishlist duplicate")
+    check(service.get_wishlist(user_id) == [(product_ids[4], f"{word} item 4", 5001)], "wishlist rows")
+    service.remove_from_wishlist(user_id, product_ids[4])
+    check(service.get_wishlist(user_id) == [], "wishlist remove")
+
+    # Checkout: short stock leaves everything untouched, success takes stock and empties the cart
+    service.add_to_cart(other_id, product_ids[0], 4)
+    service.add_to_cart(other_id, product_ids[2], 5)
+    service.update_product(product_ids[2], f"{word} item 2", "foods", 3001, 1)
+    result = service.place_order(other_id)
+    check(result.message == f"Insufficient stock for {word} item 2. Available: 1, Requested: 5.", result.message)
+    check(service.get_product(product_ids[2])[5] == 1 and service.get_product(product_ids[0])[5] == 6,
+          "failed checkout changed stock")
+    service.remove_from_cart(other_id, product_ids[2])
+    service.remove_from_cart(other_id, product_ids[0])
+    check(not service.place_order(other_id).ok, "empty cart checkout accepted")
+    order_id = service.place_order(user_id).data
+    check(service.get_cart(user_id) == [], "cart not cleared")
+    check((service.get_product(product_ids[1])[5], service.get_product(product_ids[2])[5]) == (2, 0), "stock not taken")
+    orders, items, _ = service.fetch_order_history(user_id)
+    check(orders == [(order_id, orders[0][1], "Processing", 3 * 2001 + 3001)], f"order row {orders}")
+    check(sorted(items[order_id]) == [(f"{word} item 1", 3, 2001), (f"{word} item 2", 1, 3001)], "order items")
+
+    # Lifecycle
+    check(service.transition_orders([order_id], "Shipped").status == "warning", "illegal transition moved")
+    check(service.transition_orders([order_id], "Packed").data == [order_id], "transition")
+    check(not service.cancel_order(other_id, order_id).ok, "cancelled someone else's order")
+    check(service.cancel_order(user_id, order_id).ok, "cancel")
+    check((service.get_product(product_ids[1])[5], service.get_product(product_ids[2])[5]) == (5, 1), "cancel restock")
+    events = [event[:2] for event in service.get_order_events(order_id)]
+    check(events == [(None, "Processing"), ("Processing", "Packed"), ("Packed", "Cancelled")], f"events {events}")
+    check(len(service.get_order_events(order_id, user_id)) == 3, "owner's events")
+    check(service.get_order_events(order_id, other_id) == [], "events of someone else's order")
+    check(service.count_orders_by_status()["Cancelled"] >= 1, "status counts")
+    cancelled, _ = service.get_orders_by_status("Cancelled", limit=10000)
+    check(order_id in [order[0] for order in cancelled], "orders by status")
+
+    # Ratings
+    service.rate_product(user_id, product_ids[5], 2, "meh")
+    service.rate_product(user_id, product_ids[5], 5, "great")
+    service.rate_product(other_id, product_ids[5], 4, "good")
+    check(service.get_rating_summary(product_ids[5]) == (2, 4.5, [0, 0, 0, 1, 1]), "rating summary")
+    check(service.get_product(product_ids[5])[6:] == (2, 9), "rating columns on product row")
+    first, after = service.get_product_reviews(product_ids[5], limit=1)
+    second, last = service.get_product_reviews(product_ids[5], after=after, limit=1)
+    check(sorted(review[1] for review in first + second) == ["good", "great"] and last is None, "review paging")
+
+    # Recommendations: products two customers both wanted are linked
+    for customer in (user_id, other_id):
+        service.add_to_wishlist(customer, product_ids[6])
+        service.add_to_wishlist(customer, product_ids[7])
+    supermarket_recommendations.build_recommendations()
+    recommended = [row[0] for row in service.get_recommendations([product_ids[6]])]
+    check(product_ids[7] in recommended and product_ids[6] not in recommended, f"recommendations {recommended}")
+    check(service.get_recommendations([]) == [], "recommendations for nothing")
+
+    # Archival: the cancelled order and the review texts move to files and read back the same
+    before = (service.fetch_order_history(user_id), service.get_product_reviews(product_ids[5], limit=10))
+    if repository.backend == "sqlite":
+        import supermarket_analytics
+        supermarket_analytics.refresh_sales_rollups()
+    tomorrow = time.strftime("%Y-%m-%d", time.localtime(time.time() + 86400))
+    check(supermarket_archive.archive_orders(tomorrow) >= 1, "nothing archived")
+    check(supermarket_archive.archive_reviews(tomorrow) >= 2, "review texts not archived")
+    check(repository.existing_orders([order_id]) == [], "archived order still stored")
+    after = (service.fetch_order_history(user_id), service.get_product_reviews(product_ids[5], limit=10))
+    check(after == before, f"archived reads {after} != {before}")
+    check(len(service.get_order_events(order_id)) == 3, "archival dropped order events")
+
+    # Email outbox: claimed messages are leased until recorded
+    depth, _ = repository.email_queue_counts(service.EMAIL_MAX_ATTEMPTS)
+    repository.queue_emails([(f"check-{run}@example.test", "subject", "body")])
+    check(repository.email_queue_counts(service.EMAIL_MAX_ATTEMPTS)[0] == depth + 1, "queue depth")
+    claimed = [row for row in repository.claim_emails(time.time(), service.EMAIL_MAX_ATTEMPTS, 1000, 60)
+               if row[1] == f"check-{run}@example.test"]
+    check(len(claimed) == 1, "claim")
+    check(not [row for row in repository.claim_emails(time.time(), service.EMAIL_MAX_ATTEMPTS, 1000, 60)
+               if row[1] == f"check-{run}@example.test"], "leased message claimed twice")
+    repository.record_emails([(time.time(), claimed[0][0])], [])
+    check(repository.email_queue_counts(service.EMAIL_MAX_ATTEMPTS)[0] <= depth, "sent message still queued")
+    check_email_worker(repository, run)
+
+# The outbox worker against a local SMTP sink: sends, backoff for refused recipients, and
+# messages handed back unattempted when the server goes away mid-batch
+def check_email_worker(repository, run):
+    mine = [f"check-{run}-{name}@example.test" for name in ("a", "refused", "b", "down-a", "down-b")]
+    pending = []
+
+    # Only this run's messages count; other rows in a shared scratch database are sent too
+    def claim_mine(now):
+        claimed = repository.claim_emails(now, service.EMAIL_MAX_ATTEMPTS, 10000, 60)
+        return {row[1]: row for row in claimed if row[1] in mine}
+
+    # The failures below are expected; keep the worker's warnings out of the output
+    service.logger.setLevel(logging.ERROR)
+    try:
+        with local_smtp() as sink:
+            worker = service.EmailWorker()
+            repository.queue_emails([(recipient, "subject", "body") for recipient in mine[:3]])
+            while worker.process_batch():
+                pass
+            check(sorted(recipient for recipient in sink.received if recipient in mine) == [mine[0], mine[2]],
+                  f"sink received {sink.received}")
+            check(worker.sent >= 2 and worker.failed >= 1, "worker counters")
+            check(mine[1] not in claim_mine(time.time()), "refused recipient retried before its backoff")
+            retry = claim_mine(time.time() + service.EMAIL_RETRY_BASE_SECONDS + 1)
+            check(mine[1] in retry and retry[mine[1]][5] == 1,
+                  "refused recipient not queued for retry with one attempt")
+            pending.append(retry[mine[1]][0])
+
+            # The server goes away with the worker's session open: the first message fails and
+            # counts an attempt, the other goes back due now without one
+            repository.queue_emails([(recipient, "subject", "body") for recipient in mine[3:]])
+            sink.stop()
+            worker.process_batch()
+            due = claim_mine(time.time())
+            later = claim_mine(time.time() + service.EMAIL_RETRY_BASE_SECONDS + 1)
+            pending += [row[0] for row in (*due.values(), *later.values())]
+            check(len(due) == 1 and list(due.values())[0][5] == 0, f"unattempted message not released: {due}")
+            check(len(later) == 1 and list(later.values())[0][5] == 1, f"failed message not backed off: {later}")
+    finally:
+        service.logger.setLevel(logging.NOTSET)
+        # Leave nothing of this run queued in a shared scratch database
+        repository.record_emails([(time.time(), message_id) for message_id in pending], [])
+
+# A throwaway PostgreSQL server in `directory`; returns its handle and a DSN
+def embedded_postgres(directory):
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("postgres: set SUPERMARKET_PG_DSN to a scratch database or pip install pgserver")
+    server = pgserver.get_server(directory, cleanup_mode="stop")
+    return server, server.get_uri()
+
+def main():
+    parser = argparse.ArgumentParser(description="Same behavioural checks against each storage backend.")
+    parser.add_argument("--backends", nargs="+", default=["sqlite"], choices=["sqlite", "postgres"])
+    args = parser.parse_args()
+
+    failed = False
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["SUPERMARKET_DB_BACKEND"] = backend
+            os.environ["SUPERMARKET_DB_PATH"] = os.path.join(tmp, "check.db")
+            os.environ["SUPERMARKET_ARCHIVE_DIR"] = os.path.join(tmp, "archive")
+            server = None
+            if backend == "postgres" and not os.environ.get("SUPERMARKET_PG_DSN"):
+                server, os.environ["SUPERMARKET_PG_DSN"] = embedded_postgres(os.path.join(tmp, "pgdata"))
+            for resource in (supermarket_db.init_db, supermarket_repository.repository, service.catalog_cache):
+                resource.clear()
+            started = time.perf_counter()
+            try:
+                run_checks()
+                print(f"{backend:<10} ok in {time.perf_counter() - started:.2f}s")
+            except AssertionError as e:
+                print(f"{backend:<10} FAILED: {e}")
+                failed = True
+            finally:
+                if server is not None:
+                    supermarket_repository.repository().pool.close()
+                    server.cleanup()
+                    del os.environ["SUPERMARKET_PG_DSN"]
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
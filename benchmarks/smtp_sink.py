@@ -0,0 +1,87 @@
+# A local SMTP server for benchmarks and checks, so the email outbox worker really sends
+# (one session, real replies and failures) without any mail leaving the machine.
+#
+#   with local_smtp() as sink:
+#       ...  # supermarket_service sends to sink; sink.received lists the recipients
+import contextlib
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import supermarket_service  # noqa: E402
+
+# Minimal local SMTP server for the outbox worker: keeps what it receives and refuses
+# recipients containing "refused". stop() drops open sessions too, like a host going down.
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPSession)
+        self.received = []
+        self.sessions = set()
+        self.running = True
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.shutdown()
+            self.server_close()
+        for session in list(self.sessions):
+            try:
+                session.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class SMTPSession(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.sessions.add(self.request)
+        recipients = []
+        self.reply("220 sink ready")
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 sink")
+            elif command.startswith("RCPT TO:"):
+                refused = "REFUSED" in command
+                if not refused:
+                    recipients.append(line.decode().strip()[9:].strip("<>"))
+                self.reply("550 no such user" if refused else "250 ok")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                self.server.received += recipients
+                recipients = []
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                break
+            else:  # MAIL, RSET, NOOP
+                recipients = [] if command.startswith(("MAIL", "RSET")) else recipients
+                self.reply("250 ok")
+        self.server.sessions.discard(self.request)
+
+    def reply(self, text):
+        self.wfile.write(text.encode() + b"\r\n")
+
+# Points supermarket_service's SMTP settings at a fresh sink for the duration
+@contextlib.contextmanager
+def local_smtp():
+    sink = SMTPSink()
+    settings = {"SMTP_SERVER": "127.0.0.1", "SMTP_PORT": sink.server_address[1], "SMTP_STARTTLS": False,
+                "SENDER_PASSWORD": ""}
+    saved = {name: getattr(supermarket_service, name) for name in settings}
+    for name, value in settings.items():
+        setattr(supermarket_service, name, value)
+    try:
+        yield sink
+    finally:
+        sink.stop()
+        for name, value in saved.items():
+            setattr(supermarket_service, name, value)
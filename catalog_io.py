@@ -0,0 +1,160 @@
+# Bulk product import/export for the supermarket database.
+#
+#   python catalog_io.py import supplier_catalog.csv --upsert
+#   python catalog_io.py export products.jsonl
+#
+# Files are CSV or JSON Lines (chosen by extension) with name, category, price
+# (in Naira, stored as integer kobo) and stock fields. Rows are streamed, validated against the category map and
+# written with executemany in chunked transactions. Running app processes pick
+# up imported changes when their catalog cache entries expire. SQLite backend only.
+import argparse
+import csv
+import json
+import sys
+import time
+
+import supermarket_db
+from supermarket_db import categories
+from supermarket_service import from_kobo, require_sqlite, to_kobo
+
+IMPORT_CHUNK_SIZE = 10_000
+EXPORT_FIELDS = ["id", "name", "category", "iso_number", "price", "stock"]
+EXPORT_COLUMNS = ["id", "name", "category", "iso_number", "price_kobo", "stock"]
+
+def file_format(path):
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+# Yields (line number, record) without loading the whole file. JSON Lines records are the
+# raw line; validate_record parses it, so a malformed line is rejected like any bad row.
+def read_records(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        if file_format(path) == "jsonl":
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line
+        else:
+            for line_number, record in enumerate(csv.DictReader(f), start=2):
+                yield line_number, record
+
+# Returns (name, category, iso_number, price_kobo, stock) or raises ValueError
+def validate_record(record):
+    if isinstance(record, str):
+        record = json.loads(record)  # JSONDecodeError is a ValueError
+        if not isinstance(record, dict):
+            raise ValueError("not a JSON object")
+    name = str(record.get("name") or "").strip()
+    if not name:
+        raise ValueError("missing name")
+    category = str(record.get("category") or "").strip().lower()
+    if category not in categories:
+        raise ValueError(f"unknown category {category!r}")
+    try:
+        price_kobo = to_kobo(record.get("price"))
+    except ArithmeticError:
+        raise ValueError(f"invalid price {record.get('price')!r}")
+    stock = int(record.get("stock"))
+    if price_kobo < 0 or stock < 0:
+        raise ValueError("price and stock must not be negative")
+    return name, category, categories[category], price_kobo, stock
+
+def write_chunk(conn, rows, upsert):
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        inserts, updates = rows, []
+        if upsert:
+            # Later rows win when a name appears twice in the same chunk
+            by_name = {row[0]: row for row in rows}
+            names = list(by_name)
+            existing = {}
+            for start in range(0, len(names), 500):
+                batch = names[start:start + 500]
+                cursor.execute(f"SELECT name, id FROM products WHERE name IN ({', '.join('?' * len(batch))})", batch)
+                existing.update(cursor.fetchall())
+            inserts = [row for name, row in by_name.items() if name not in existing]
+            updates = [row[1:] + (existing[name],) for name, row in by_name.items() if name in existing]
+        cursor.executemany("""
+            INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (?, ?, ?, ?, ?)
+        """, inserts)
+        cursor.executemany("""
+            UPDATE products SET category = ?, iso_number = ?, price_kobo = ?, stock = ? WHERE id = ?
+        """, updates)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(inserts), len(updates)
+
+def import_products(path, upsert=False, chunk_size=IMPORT_CHUNK_SIZE):
+    require_sqlite("Catalog import")
+    started = time.perf_counter()
+    inserted = updated = rejected = 0
+    chunk = []
+    with supermarket_db.get_db() as conn:
+        for line_number, record in read_records(path):
+            try:
+                chunk.append(validate_record(record))
+            except (TypeError, ValueError) as e:
+                rejected += 1
+                if rejected <= 20:
+                    print(f"line {line_number}: {e}", file=sys.stderr)
+                continue
+            if len(chunk) >= chunk_size:
+                added, changed = write_chunk(conn, chunk, upsert)
+                inserted, updated, chunk = inserted + added, updated + changed, []
+        if chunk:
+            added, changed = write_chunk(conn, chunk, upsert)
+            inserted, updated = inserted + added, updated + changed
+    elapsed = time.perf_counter() - started
+    rate = (inserted + updated) / elapsed if elapsed else 0
+    print(f"inserted={inserted} updated={updated} rejected={rejected} in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    return inserted, updated, rejected
+
+def export_products(path, fetch_size=IMPORT_CHUNK_SIZE):
+    require_sqlite("Catalog export")
+    started = time.perf_counter()
+    exported = 0
+    with supermarket_db.get_db() as conn, open(path, "w", newline="", encoding="utf-8") as f:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM products ORDER BY id")
+        writer = csv.writer(f) if file_format(path) == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_FIELDS)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            rows = [row[:4] + (from_kobo(row[4]),) + row[5:] for row in rows]
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(EXPORT_FIELDS, row)), default=float) + "\n" for row in rows)
+            exported += len(rows)
+    elapsed = time.perf_counter() - started
+    rate = exported / elapsed if elapsed else 0
+    print(f"exported={exported} in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    return exported
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk product import/export.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="load products from a CSV or JSONL file")
+    importer.add_argument("path")
+    importer.add_argument("--upsert", action="store_true", help="update products whose name already exists")
+    importer.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    exporter = commands.add_parser("export", help="write all products to a CSV or JSONL file")
+    exporter.add_argument("path")
+    args = parser.parse_args()
+
+    try:
+        require_sqlite("catalog_io")
+    except RuntimeError as e:
+        parser.error(str(e))
+    supermarket_db.init_db()
+    if args.command == "import":
+        import_products(args.path, args.upsert, args.chunk_size)
+    else:
+        export_products(args.path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Sales analytics for the admin dashboard.
+#
+# Daily rollups (totals, per category, per product) are advanced incrementally from
+# orders newer than a stored watermark, so a refresh only reads new order lines.
+# Ad-hoc date ranges are aggregated over the rollups with pandas instead of order_items.
+# Revenue is integer kobo.
+import pandas as pd
+
+from supermarket_db import get_db
+
+LOW_STOCK_THRESHOLD = 5
+
+# Folds orders past the watermark into the rollups; returns how many orders were added.
+# Cancelled orders are skipped here, and taken back out by a trigger if cancelled later.
+def refresh_sales_rollups():
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            watermark = cursor.execute("SELECT value FROM analytics_state WHERE name = 'rollup_order_id'").fetchone()[0]
+            latest = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+            if latest <= watermark:
+                conn.rollback()
+                return 0
+            new_orders = """
+                SELECT o.id AS order_id, substr(o.order_date, 1, 10) AS day, oi.product_id,
+                       COALESCE(p.category, 'other') AS category, COALESCE(p.iso_number, 9) AS iso_number,
+                       oi.quantity, oi.price_kobo * oi.quantity AS revenue_kobo
+                FROM orders o
+                JOIN order_items oi ON oi.order_id = o.id
+                LEFT JOIN products p ON p.id = oi.product_id
+                WHERE o.id > ? AND o.id <= ? AND o.status != 'Cancelled'"""
+            window = (watermark, latest)
+            cursor.execute(f"""
+                INSERT INTO sales_daily_totals (day, orders, units, revenue_kobo)
+                SELECT day, COUNT(DISTINCT order_id), SUM(quantity), SUM(revenue_kobo) FROM ({new_orders}) GROUP BY day
+                ON CONFLICT (day) DO UPDATE SET orders = orders + excluded.orders,
+                    units = units + excluded.units, revenue_kobo = revenue_kobo + excluded.revenue_kobo
+            """, window)
+            cursor.execute(f"""
+                INSERT INTO sales_daily_category (day, category, iso_number, orders, units, revenue_kobo)
+                SELECT day, category, MAX(iso_number), COUNT(DISTINCT order_id), SUM(quantity), SUM(revenue_kobo)
+                FROM ({new_orders}) GROUP BY day, category
+                ON CONFLICT (day, category) DO UPDATE SET orders = orders + excluded.orders,
+                    units = units + excluded.units, revenue_kobo = revenue_kobo + excluded.revenue_kobo
+            """, window)
+            cursor.execute(f"""
+                INSERT INTO sales_daily_product (day, product_id, units, revenue_kobo)
+                SELECT day, product_id, SUM(quantity), SUM(revenue_kobo) FROM ({new_orders}) GROUP BY day, product_id
+                ON CONFLICT (day, product_id) DO UPDATE SET
+                    units = units + excluded.units, revenue_kobo = revenue_kobo + excluded.revenue_kobo
+            """, window)
+            cursor.execute("SELECT COUNT(*) FROM orders WHERE id > ? AND id <= ? AND status != 'Cancelled'", window)
+            added = cursor.fetchone()[0]
+            cursor.execute("UPDATE analytics_state SET value = ? WHERE name = 'rollup_order_id'", (latest,))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return added
+
+def read_frame(sql_query, params):
+    with get_db() as conn:
+        return pd.read_sql_query(sql_query, conn, params=params)
+
+# Revenue, orders and units per day for [start, end] (ISO dates, inclusive)
+def daily_sales(start, end):
+    frame = read_frame("SELECT day, orders, units, revenue_kobo FROM sales_daily_totals WHERE day BETWEEN ? AND ? ORDER BY day",
+                       (start, end))
+    return frame.set_index("day")
+
+def sales_by_category(start, end):
+    frame = read_frame("""
+        SELECT category, iso_number, orders, units, revenue_kobo FROM sales_daily_category
+        WHERE day BETWEEN ? AND ?""", (start, end))
+    return (frame.groupby(["category", "iso_number"], as_index=False)[["orders", "units", "revenue_kobo"]].sum()
+            .sort_values("revenue_kobo", ascending=False))
+
+def top_products(start, end, limit=10):
+    frame = read_frame("SELECT product_id, units, revenue_kobo FROM sales_daily_product WHERE day BETWEEN ? AND ?",
+                       (start, end))
+    if frame.empty:
+        return frame.assign(name=pd.Series(dtype=str))[["product_id", "name", "units", "revenue_kobo"]]
+    totals = frame.groupby("product_id", as_index=False)[["units", "revenue_kobo"]].sum().nlargest(limit, "units")
+    ids = [int(product_id) for product_id in totals["product_id"]]
+    names = read_frame(f"SELECT id AS product_id, name FROM products WHERE id IN ({', '.join('?' * len(ids))})", ids)
+    return totals.merge(names, on="product_id", how="left")[["product_id", "name", "units", "revenue_kobo"]]
+
+def low_stock(threshold=LOW_STOCK_THRESHOLD, limit=50):
+    return read_frame("""
+        SELECT id, name, category, stock FROM products WHERE stock <= ? ORDER BY stock, id LIMIT ?""",
+                      (threshold, limit))
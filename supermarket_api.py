@@ -0,0 +1,365 @@
+# Async HTTP/JSON API over supermarket_service, for POS terminals and load testing.
+# Amounts are integer kobo (₦1 = 100 kobo) in *_kobo fields and parameters.
+#
+#   uvicorn supermarket_api:app --workers 4
+#
+# Plain ASGI with no framework dependency. SQLite calls run on a bounded thread
+# pool so the event loop never blocks; each worker process has its own pool.
+# Password hashing is awaited on the service's KDF pool instead, so a burst of
+# logins never ties up the database threads while scrypt runs.
+#
+# POST /login returns a session token; routes that act for a user need it as
+# "Authorization: Bearer <token>", and /users/{id}/... paths only accept the caller's
+# own id. When the session is rotated the response carries the replacement in an
+# X-Session-Token header, which the client should use from then on.
+import asyncio
+import functools
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import supermarket_service as service
+from supermarket_profiling import query_stats
+from supermarket_repository import repository
+
+API_DB_THREADS = int(os.environ.get("SUPERMARKET_API_DB_THREADS", "8"))
+executor = ThreadPoolExecutor(max_workers=API_DB_THREADS, thread_name_prefix="api-db")
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+routes = []
+
+# auth is None for public routes, "user" for any signed-in caller and "admin" for admins only
+def route(method, pattern, auth=None):
+    def register(handler):
+        routes.append((method, re.compile(f"^{pattern}$"), handler, auth))
+        return handler
+    return register
+
+async def run_db(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+
+# Raises service.LoginBusyError at once when the KDF queue is full
+async def run_kdf(func, *args):
+    return await asyncio.wrap_future(service.submit_kdf(func, *args))
+
+def result_response(result, created_status=200):
+    status = {"success": created_status, "warning": 200}.get(result.status, 400)
+    return status, {"status": result.status, "message": result.message, "data": result.data}
+
+def product_json(product):
+    return {"id": product[0], "name": product[1], "category": product[2], "price_kobo": product[3], "stock": product[4],
+            "rating_count": product[5], "average_rating": product[6]}
+
+def query_value(request, name, convert=str, default=None):
+    values = request["query"].get(name)
+    return convert(values[0]) if values else default
+
+# JSON body fields are checked, not coerced: 2.7 is not a quantity and an object is not a review
+def text(value):
+    if not isinstance(value, str):
+        raise ValueError(f"expected a string, got {json.dumps(value)}")
+    return value
+
+def whole_number(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"expected a whole number, got {json.dumps(value)}")
+    return value
+
+def array(value):
+    if not isinstance(value, list):
+        raise ValueError(f"expected an array, got {json.dumps(value)}")
+    return value
+
+# A field without a default is required
+def body_value(request, name, convert=text, default=None):
+    if name not in request["body"]:
+        if default is None:
+            raise HTTPError(400, f"Missing field: {name}")
+        return default
+    try:
+        return convert(request["body"][name])
+    except ValueError as e:
+        raise HTTPError(400, f"Invalid {name}: {e}")
+
+def bearer_token(scope):
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token.strip():
+                return token.strip()
+    return None
+
+# The caller's (user_id, role, token) for a route that needs a session; the token differs
+# from the presented one when the session was just rotated
+async def authorize(token, auth):
+    session = await run_db(service.get_session, token)
+    if session is None:
+        raise HTTPError(401, "Login required.")
+    if auth == "admin" and session[1] != "admin":
+        raise HTTPError(403, "Admins only.")
+    return session
+
+# Keyset cursors travel as the JSON-encoded "next" value of the previous page
+def cursor_value(request):
+    after = query_value(request, "after")
+    return tuple(json.loads(after)) if after else None
+
+# service.register_user and service.authenticate, with the KDF awaited rather than run on a DB thread
+async def create_user(username, password, role):
+    try:
+        hashed_password = await run_kdf(service.hash_password, password)
+    except service.LoginBusyError as e:
+        return service.Result("error", str(e))
+    return await run_db(service.save_user, username, hashed_password, role)
+
+async def authenticate(username, password):
+    user = await run_db(repository().find_user, username)
+    stored = user[2] if user else service.dummy_password_hash()
+    matches, needs_rehash = await run_kdf(service.verify_password, password, stored)
+    if not user or not matches:
+        return None
+    if needs_rehash:
+        hashed_password = await run_kdf(service.hash_password, password)
+        await run_db(repository().replace_password_hash, user[0], user[2], hashed_password)
+    return user[0], user[1]
+
+# Public sign-up always creates a customer
+@route("POST", "/users")
+async def register(request):
+    result = await create_user(body_value(request, "username"), body_value(request, "password"), "customer")
+    return result_response(result, 201)
+
+# Admins create accounts of either role: {"username": ..., "password": ..., "role": "admin"}
+@route("POST", "/admin/users", auth="admin")
+async def register_account(request):
+    role = body_value(request, "role")
+    if role not in ("customer", "admin"):
+        raise HTTPError(400, f"Unknown role: {role}")
+    result = await create_user(body_value(request, "username"), body_value(request, "password"), role)
+    return result_response(result, 201)
+
+@route("POST", "/login")
+async def login(request):
+    try:
+        user = await authenticate(body_value(request, "username"), body_value(request, "password"))
+    except service.LoginBusyError as e:
+        raise HTTPError(401, str(e))
+    if not user:
+        raise HTTPError(401, "Incorrect username or password.")
+    token = await run_db(service.create_session, user[0])
+    return 200, {"token": token, "user_id": user[0], "role": user[1]}
+
+# Ends the session the token belongs to, including its replacement if it was rotated
+@route("POST", "/logout", auth="user")
+async def logout(request):
+    for token in {request["token"], request["session"][2]}:
+        await run_db(service.logout, token)
+    return 200, {"status": "success", "message": "Logged out successfully."}
+
+@route("GET", "/products")
+async def list_products(request):
+    args = (query_value(request, "q", default=""), query_value(request, "category"),
+            query_value(request, "min_price_kobo", int), query_value(request, "max_price_kobo", int))
+    sort = query_value(request, "sort", default="id")
+    if sort not in service.PRODUCT_SORTS:
+        raise HTTPError(400, f"Unknown sort: {sort}")
+    limit = max(1, min(query_value(request, "limit", int, service.PRODUCT_PAGE_SIZE), 100))
+    products, next_cursor = await run_db(service.search_products_page, *args, sort,
+                                         query_value(request, "desc", default="0") == "1",
+                                         cursor_value(request), limit)
+    total = await run_db(service.count_products, *args)
+    return 200, {"products": [product_json(p) for p in products], "next": next_cursor, "total": total}
+
+@route("GET", r"/products/(?P<product_id>\d+)")
+async def get_product(request):
+    product = await run_db(service.get_product, int(request["params"]["product_id"]))
+    if not product:
+        raise HTTPError(404, "Product not found.")
+    return 200, {"id": product[0], "name": product[1], "category": product[2],
+                 "iso_number": product[3], "price_kobo": product[4], "stock": product[5],
+                 "rating_count": product[6], "average_rating": product[7] / product[6] if product[6] else None}
+
+@route("GET", r"/products/(?P<product_id>\d+)/reviews")
+async def list_reviews(request):
+    product_id = int(request["params"]["product_id"])
+    count, average, stars = await run_db(service.get_rating_summary, product_id)
+    reviews, next_cursor = await run_db(service.get_product_reviews, product_id, cursor_value(request))
+    return 200, {"rating_count": count, "average_rating": average if count else None, "stars": stars,
+                 "reviews": [{"rating": r[0], "review": r[1], "date": r[2], "username": r[3]} for r in reviews],
+                 "next": next_cursor}
+
+@route("POST", r"/products/(?P<product_id>\d+)/reviews", auth="user")
+async def add_review(request):
+    result = await run_db(service.rate_product, request["session"][0],
+                          int(request["params"]["product_id"]), body_value(request, "rating", whole_number),
+                          body_value(request, "review", default=""))
+    return result_response(result, 201)
+
+@route("GET", r"/users/(?P<user_id>\d+)/cart", auth="user")
+async def view_cart(request):
+    user_id = int(request["params"]["user_id"])
+    items = await run_db(service.get_cart, user_id)
+    total = await run_db(service.get_cart_total, user_id)
+    return 200, {"items": [{"product_id": i[0], "name": i[1], "price_kobo": i[2], "quantity": i[3]} for i in items],
+                 "total_kobo": total}
+
+@route("POST", r"/users/(?P<user_id>\d+)/cart", auth="user")
+async def add_to_cart(request):
+    result = await run_db(service.add_to_cart, int(request["params"]["user_id"]),
+                          body_value(request, "product_id", whole_number),
+                          body_value(request, "quantity", whole_number))
+    return result_response(result)
+
+@route("DELETE", r"/users/(?P<user_id>\d+)/cart/(?P<product_id>\d+)", auth="user")
+async def remove_from_cart(request):
+    result = await run_db(service.remove_from_cart, int(request["params"]["user_id"]),
+                          int(request["params"]["product_id"]))
+    return result_response(result)
+
+@route("GET", r"/users/(?P<user_id>\d+)/wishlist", auth="user")
+async def view_wishlist(request):
+    items = await run_db(service.get_wishlist, int(request["params"]["user_id"]))
+    return 200, {"items": [{"product_id": i[0], "name": i[1], "price_kobo": i[2]} for i in items]}
+
+@route("POST", r"/users/(?P<user_id>\d+)/wishlist", auth="user")
+async def add_to_wishlist(request):
+    result = await run_db(service.add_to_wishlist, int(request["params"]["user_id"]),
+                          body_value(request, "product_id", whole_number))
+    return result_response(result)
+
+@route("DELETE", r"/users/(?P<user_id>\d+)/wishlist/(?P<product_id>\d+)", auth="user")
+async def remove_from_wishlist(request):
+    result = await run_db(service.remove_from_wishlist, int(request["params"]["user_id"]),
+                          int(request["params"]["product_id"]))
+    return result_response(result)
+
+@route("POST", r"/users/(?P<user_id>\d+)/orders", auth="user")
+async def place_order(request):
+    result = await run_db(service.place_order, int(request["params"]["user_id"]))
+    return result_response(result, 201)
+
+@route("GET", r"/users/(?P<user_id>\d+)/orders", auth="user")
+async def order_history(request):
+    orders, items, next_cursor = await run_db(service.fetch_order_history, int(request["params"]["user_id"]),
+                                              cursor_value(request))
+    return 200, {"orders": [{"id": o[0], "order_date": o[1], "status": o[2], "total_kobo": o[3],
+                             "items": [{"name": i[0], "quantity": i[1], "price_kobo": i[2]} for i in items[o[0]]]}
+                            for o in orders],
+                 "next": next_cursor}
+
+@route("POST", r"/users/(?P<user_id>\d+)/orders/(?P<order_id>\d+)/cancel", auth="user")
+async def cancel_order(request):
+    result = await run_db(service.cancel_order, int(request["params"]["user_id"]), int(request["params"]["order_id"]))
+    return result_response(result)
+
+# Bulk status change: {"order_ids": [...], "status": "Shipped"}
+@route("POST", "/orders/transitions", auth="admin")
+async def transition_orders(request):
+    try:
+        order_ids = [whole_number(order_id) for order_id in body_value(request, "order_ids", array)]
+    except ValueError as e:
+        raise HTTPError(400, f"Invalid order_ids: {e}")
+    result = await run_db(service.transition_orders, order_ids, body_value(request, "status"))
+    return result_response(result)
+
+# Admins see any order's trail, customers only their own
+@route("GET", r"/orders/(?P<order_id>\d+)/events", auth="user")
+async def order_events(request):
+    user_id, role, _ = request["session"]
+    events = await run_db(service.get_order_events, int(request["params"]["order_id"]),
+                          None if role == "admin" else user_id)
+    if not events:
+        raise HTTPError(404, "Order not found.")
+    return 200, {"events": [{"from": e[0], "to": e[1], "at": e[2]} for e in events]}
+
+# Prometheus scrape target for per-function SQL timings
+@route("GET", "/metrics")
+async def metrics(request):
+    return 200, query_stats.prometheus()
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+# Handlers return a JSON-serialisable payload, or a str sent as plain text
+async def send_response(send, status, payload, headers=()):
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), b"text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body, content_type = json.dumps(payload).encode(), b"application/json"
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode()),
+                            *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await run_db(repository)
+            # Hashed once here so an unknown username never pays for it on the event loop
+            await run_kdf(service.dummy_password_hash)
+            await run_db(service.start_email_worker)
+            await run_db(service.start_reorder_worker)
+            await run_db(service.start_session_sweeper)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    allowed = False
+    for method, pattern, handler, auth in routes:
+        match = pattern.match(scope["path"])
+        if not match:
+            continue
+        allowed = True
+        if method == scope["method"]:
+            break
+    else:
+        status, message = (405, "Method not allowed.") if allowed else (404, "Not found.")
+        return await send_response(send, status, {"status": "error", "message": message})
+
+    headers = []
+    try:
+        body = await read_body(receive)
+        request = {"params": match.groupdict(),
+                   "query": parse_qs(scope.get("query_string", b"").decode()),
+                   "body": json.loads(body) if body else {},
+                   "token": bearer_token(scope), "session": None}
+        if auth:
+            request["session"] = await authorize(request["token"], auth)
+            # A path that names a user only ever acts for that user
+            if "user_id" in request["params"] and int(request["params"]["user_id"]) != request["session"][0]:
+                raise HTTPError(403, "This account belongs to another user.")
+            if request["session"][2] != request["token"]:
+                headers.append((b"x-session-token", request["session"][2].encode()))
+        if not isinstance(request["body"], dict):
+            raise HTTPError(400, "Request body must be a JSON object.")
+        status, payload = await handler(request)
+    except HTTPError as e:
+        status, payload = e.status, {"status": "error", "message": e.message}
+        if e.status == 401:
+            headers.append((b"www-authenticate", b"Bearer"))
+    except (ValueError, TypeError) as e:
+        status, payload = 400, {"status": "error", "message": f"Bad request: {e}"}
+    await send_response(send, status, payload, headers)
@@ -0,0 +1,229 @@
+# Archival of old orders and review texts to compressed files, and lazy reads back.
+#
+#   python supermarket_archive.py --days 365
+#   python supermarket_archive.py --before 2024-01-01 --vacuum
+#
+# Orders placed before the cutoff that can no longer change (Delivered or Cancelled) move,
+# with their lines, into gzip-compressed JSON Lines files under SUPERMARKET_ARCHIVE_DIR,
+# partitioned by customer, so one customer's history is one file per run. Review texts
+# written before the cutoff move the same way, partitioned by product; the rating itself
+# stays, since the rating summary, the one-rating-per-customer rule and the recommendations
+# use it. Order events stay in the database as the audit log.
+#
+# Rows are streamed in chunks, so memory stays bounded whatever the table size. A run is
+# written under a temporary name and renamed into place before anything is deleted, and
+# readers skip archived orders that are still stored, so an interrupted run leaves nothing
+# missing or shown twice.
+import argparse
+import functools
+import gzip
+import json
+import os
+import shutil
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from supermarket_db import get_db
+from supermarket_repository import repository
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_PARTITIONS = 64
+ARCHIVE_CHUNK_SIZE = 5000
+ARCHIVE_DAYS = 365
+
+def archive_dir():
+    return os.environ.get("SUPERMARKET_ARCHIVE_DIR", ARCHIVE_DIR)
+
+# Published runs of one kind ("orders" or "reviews"), oldest first
+def archive_runs(kind):
+    root = os.path.join(archive_dir(), kind)
+    try:
+        names = sorted(os.listdir(root))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(root, name) for name in names if not name.endswith(".tmp")]
+
+# Runs never change once published
+@functools.lru_cache(maxsize=None)
+def run_manifest(run):
+    with open(os.path.join(run, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def partition_path(run, partition):
+    return os.path.join(run, f"part-{partition:03d}.jsonl.gz")
+
+# Records of one partition across all runs whose line contains `marker`. The marker is a
+# cheap substring test on the raw line, so only likely matches are parsed.
+def read_partition(kind, partition, marker):
+    for run in archive_runs(kind):
+        path = partition_path(run, partition)
+        if not os.path.exists(path):
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if marker in line:
+                    yield json.loads(line)
+
+# Writes one run's partitions under a temporary directory until publish() renames it into
+# place. Only one archival job should run at a time.
+class ArchiveRun:
+    def __init__(self, kind, cutoff):
+        root = os.path.join(archive_dir(), kind)
+        os.makedirs(root, exist_ok=True)
+        # Leftovers of interrupted runs were never published, and nothing was deleted for them
+        for name in os.listdir(root):
+            if name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(root, name))
+        self.path = os.path.join(root, f"{cutoff[:10]}-{time.time_ns()}")
+        self.staging = self.path + ".tmp"
+        os.makedirs(self.staging)
+        self.cutoff = cutoff
+        self.files = {}
+
+    def write(self, partition, record):
+        if partition not in self.files:
+            raw = open(partition_path(self.staging, partition), "wb")
+            self.files[partition] = (raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6))
+        self.files[partition][1].write((json.dumps(record, separators=(",", ":")) + "\n").encode())
+
+    def publish(self, **manifest):
+        for raw, compressed in self.files.values():
+            compressed.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+            raw.close()
+        with open(os.path.join(self.staging, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"cutoff": self.cutoff, **manifest}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(self.staging, self.path)
+
+    def discard(self):
+        for raw, compressed in self.files.values():
+            compressed.close()
+            raw.close()
+        shutil.rmtree(self.staging)
+
+# Moves orders placed before `cutoff` to a new run; returns how many
+def archive_orders(cutoff, chunk_size=ARCHIVE_CHUNK_SIZE):
+    repo = repository()
+    run = ArchiveRun("orders", cutoff)
+    # Ids to delete once the run is safely in place, 8 bytes each
+    archived = array("q")
+    newest = ""
+    after_id = 0
+    try:
+        while True:
+            orders = repo.archivable_orders(cutoff, after_id, chunk_size)
+            if not orders:
+                break
+            items = repo.order_items([order[0] for order in orders])
+            for order_id, user_id, order_date, status, total_kobo in orders:
+                # The field order matters: read_partition finds a customer by the "user_id" prefix
+                run.write(user_id % ARCHIVE_PARTITIONS, {
+                    "user_id": user_id, "id": order_id, "order_date": order_date, "status": status,
+                    "total_kobo": total_kobo, "items": items[order_id]})
+                newest = max(newest, order_date)
+            archived.extend(order[0] for order in orders)
+            after_id = orders[-1][0]
+        if not archived:
+            run.discard()
+            return 0
+        run.publish(orders=len(archived), newest=newest)
+    except BaseException:
+        if os.path.exists(run.staging):
+            run.discard()
+        raise
+    for start in range(0, len(archived), chunk_size):
+        repo.delete_orders(archived[start:start + chunk_size].tolist())
+    return len(archived)
+
+# Moves the texts of reviews written before `cutoff` to a new run; returns how many
+def archive_reviews(cutoff, chunk_size=ARCHIVE_CHUNK_SIZE):
+    repo = repository()
+    run = ArchiveRun("reviews", cutoff)
+    archived = array("q")
+    after_key = 0
+    try:
+        while True:
+            reviews = repo.archivable_reviews(cutoff, after_key, chunk_size)
+            if not reviews:
+                break
+            for _, product_id, username, date, review in reviews:
+                run.write(product_id % ARCHIVE_PARTITIONS, {
+                    "product_id": product_id, "username": username, "date": date, "review": review})
+            archived.extend(review[0] for review in reviews)
+            after_key = reviews[-1][0]
+        if not archived:
+            run.discard()
+            return 0
+        run.publish(reviews=len(archived))
+    except BaseException:
+        if os.path.exists(run.staging):
+            run.discard()
+        raise
+    for start in range(0, len(archived), chunk_size):
+        repo.clear_reviews(archived[start:start + chunk_size].tolist(), cutoff)
+    return len(archived)
+
+# Date of the newest archived order, or None; pages of newer orders never read the archive
+def newest_archived_order():
+    return max((run_manifest(run)["newest"] for run in archive_runs("orders")), default=None)
+
+# Archived orders of one customer: up to `limit` (id, order_date, status, total_kobo) rows,
+# newest first after the (order_date, id) cursor `after`, and {order_id: [(name, quantity, price_kobo)]}
+def archived_order_page(user_id, after, limit):
+    found = {}
+    for record in read_partition("orders", user_id % ARCHIVE_PARTITIONS, f'{{"user_id":{user_id},'):
+        if after is None or (record["order_date"], record["id"]) < tuple(after):
+            found[record["id"]] = record
+    candidates = sorted(found.values(), key=lambda record: (record["order_date"], record["id"]), reverse=True)
+    page = []
+    # An interrupted run can leave orders both archived and stored; the stored copy wins
+    for start in range(0, len(candidates), limit):
+        chunk = candidates[start:start + limit]
+        stored = set(repository().existing_orders([record["id"] for record in chunk]))
+        page += [record for record in chunk if record["id"] not in stored]
+        if len(page) >= limit:
+            break
+    page = page[:limit]
+    return ([(record["id"], record["order_date"], record["status"], record["total_kobo"]) for record in page],
+            {record["id"]: [tuple(item) for item in record["items"]] for record in page})
+
+# {(username, date): review} for a product's archived review texts
+def archived_review_texts(product_id):
+    return {(record["username"], record["date"]): record["review"]
+            for record in read_partition("reviews", product_id % ARCHIVE_PARTITIONS, f'{{"product_id":{product_id},')}
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old orders and review texts to compressed files.")
+    cutoff = parser.add_mutually_exclusive_group()
+    cutoff.add_argument("--before", help="archive what is older than this date (YYYY-MM-DD)")
+    cutoff.add_argument("--days", type=int, default=ARCHIVE_DAYS, help="archive what is older than this many days")
+    parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE)
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rewrite the SQLite file afterwards to give freed pages back (blocks writers meanwhile)")
+    args = parser.parse_args()
+    before = args.before or (datetime.now() - timedelta(days=args.days)).strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(before, "%Y-%m-%d")
+    except ValueError:
+        parser.error(f"--before must be YYYY-MM-DD, not {before!r}")
+
+    repo = repository()
+    if repo.backend == "sqlite":
+        # Only orders already in the sales rollups are archived, so bring those up to date
+        import supermarket_analytics
+        supermarket_analytics.refresh_sales_rollups()
+    started = time.perf_counter()
+    orders = archive_orders(before, args.chunk_size)
+    reviews = archive_reviews(before, args.chunk_size)
+    print(f"archived {orders} orders and {reviews} review texts from before {before} "
+          f"in {time.perf_counter() - started:.1f}s")
+    if args.vacuum and repo.backend == "sqlite":
+        with get_db() as conn:
+            conn.execute("VACUUM")
+
+if __name__ == "__main__":
+    main()
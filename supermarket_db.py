@@ -0,0 +1,532 @@
+# Storage layer: configuration, connection pool and schema migrations.
+# Imported modules survive Streamlit reruns, so everything here is created once per process.
+import functools
+import os
+import queue
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from supermarket_profiling import connection_factory
+
+# Define categories with ISO numbers
+categories = {
+    'foods': 1, 'groceries': 2, 'electronics': 3, 'clothes': 4,
+    'accessories': 5, 'pets': 6, 'drinks': 7, 'shoes': 8,
+    'other': 9, 'stuff': 10
+}
+
+# Process-wide, thread-safe memoization for shared resources (pool, caches, workers)
+def shared_resource(func):
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(func)
+    def wrapper():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(func())
+        return instance[0]
+
+    wrapper.clear = instance.clear
+    return wrapper
+
+# Storage profiles: PRAGMA sets applied to every pooled connection.
+# "wal" lets readers run alongside the checkout writer and only fsyncs at checkpoints;
+# "durable" keeps WAL concurrency but fsyncs every commit; "rollback" is SQLite's stock behaviour.
+STORAGE_PROFILES = {
+    "wal": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -64000,
+            "mmap_size": 268435456, "temp_store": "MEMORY", "busy_timeout": 5000},
+    "durable": {"journal_mode": "WAL", "synchronous": "FULL", "cache_size": -64000,
+                "mmap_size": 268435456, "temp_store": "MEMORY", "busy_timeout": 5000},
+    "rollback": {"journal_mode": "DELETE", "synchronous": "FULL", "cache_size": -2000,
+                 "mmap_size": 0, "temp_store": "DEFAULT", "busy_timeout": 5000},
+}
+STORAGE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout")
+DB_PATH = "supermarket.db"
+DB_POOL_SIZE = 5
+DB_PROFILE = "wal"
+
+# Resolves the storage configuration: profile defaults, then SUPERMARKET_DB_* environment
+# variables (e.g. SUPERMARKET_DB_PROFILE=durable, SUPERMARKET_DB_CACHE_SIZE=-128000), then overrides
+def storage_config(**overrides):
+    profile = overrides.pop("profile", None) or os.environ.get("SUPERMARKET_DB_PROFILE", DB_PROFILE)
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile}")
+    config = {"path": os.environ.get("SUPERMARKET_DB_PATH", DB_PATH),
+              "pool_size": int(os.environ.get("SUPERMARKET_DB_POOL_SIZE", DB_POOL_SIZE)),
+              "profile": profile}
+    config.update(STORAGE_PROFILES[profile])
+    for pragma in STORAGE_PRAGMAS:
+        value = os.environ.get(f"SUPERMARKET_DB_{pragma.upper()}")
+        if value is not None:
+            config[pragma] = value
+    config.update(overrides)
+    return config
+
+def connect_db(config):
+    conn = sqlite3.connect(config["path"], timeout=int(config["busy_timeout"]) / 1000, check_same_thread=False,
+                           factory=connection_factory())
+    for pragma in STORAGE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {config[pragma]}")
+    return conn
+
+# Thread-safe pool of SQLite connections shared by every session and request
+class ConnectionPool:
+    def __init__(self, config):
+        self.config = config
+        self._connections = queue.LifoQueue()
+        for _ in range(config["pool_size"]):
+            self._connections.put(connect_db(config))
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            # Never hand a half-finished transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+            self._connections.put(conn)
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+def migration_base_schema(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT UNIQUE NOT NULL,
+                        password TEXT NOT NULL,
+                        role TEXT NOT NULL)''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS products (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT,
+                        category TEXT,
+                        iso_number INTEGER,
+                        price REAL,
+                        stock INTEGER)''')
+    
+    cursor.execute('SELECT COUNT(*) FROM products')
+    if cursor.fetchone()[0] == 0:
+        seed = []
+        for i in range(1, 501):
+            category = random.choice(list(categories.keys()))
+            seed.append((f"Product {i}", category, categories[category], random.randint(500, 100000), random.randint(5, 10)))
+        cursor.executemany('''
+            INSERT INTO products (name, category, iso_number, price, stock)
+            VALUES (?, ?, ?, ?, ?)
+        ''', seed)
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS cart (
+                        user_id INTEGER,
+                        product_id INTEGER,
+                        quantity INTEGER,
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS wishlist (
+                        user_id INTEGER,
+                        product_id INTEGER,
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        order_date TEXT,
+                        status TEXT,
+                        total_amount REAL,
+                        FOREIGN KEY(user_id) REFERENCES users(id))''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS order_items (
+                        order_id INTEGER,
+                        product_id INTEGER,
+                        quantity INTEGER,
+                        price REAL,
+                        FOREIGN KEY(order_id) REFERENCES orders(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS product_ratings (
+                        user_id INTEGER,
+                        product_id INTEGER,
+                        rating INTEGER,
+                        review TEXT,
+                        date TEXT,
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+
+# Composite keys for cart/wishlist and indexes matching the per-user and per-product lookups
+def migration_lookup_indexes(cursor):
+    cursor.execute('''CREATE TABLE cart_new (
+                        user_id INTEGER NOT NULL,
+                        product_id INTEGER NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        PRIMARY KEY (user_id, product_id),
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id)) WITHOUT ROWID''')
+    # Fold duplicate rows left behind by the old SELECT-then-INSERT code
+    cursor.execute('''INSERT INTO cart_new (user_id, product_id, quantity)
+                      SELECT user_id, product_id, SUM(quantity) FROM cart
+                      WHERE user_id IS NOT NULL AND product_id IS NOT NULL
+                      GROUP BY user_id, product_id''')
+    cursor.execute("DROP TABLE cart")
+    cursor.execute("ALTER TABLE cart_new RENAME TO cart")
+
+    cursor.execute('''CREATE TABLE wishlist_new (
+                        user_id INTEGER NOT NULL,
+                        product_id INTEGER NOT NULL,
+                        PRIMARY KEY (user_id, product_id),
+                        FOREIGN KEY(user_id) REFERENCES users(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id)) WITHOUT ROWID''')
+    cursor.execute('''INSERT INTO wishlist_new (user_id, product_id)
+                      SELECT DISTINCT user_id, product_id FROM wishlist
+                      WHERE user_id IS NOT NULL AND product_id IS NOT NULL''')
+    cursor.execute("DROP TABLE wishlist")
+    cursor.execute("ALTER TABLE wishlist_new RENAME TO wishlist")
+
+    # Covers the order-history item lookup without touching the table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id, product_id, quantity, price)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items (product_id)")
+    # Serves view_product_reviews already sorted by date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_ratings_product ON product_ratings (product_id, date)")
+
+# FTS5 index over product names, kept in sync with the products table by triggers
+def migration_product_search(cursor):
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                        name,
+                        content='products',
+                        content_rowid='id',
+                        prefix='1 2 3')''')
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                        INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products BEGIN
+                        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                        INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+                      END''')
+
+    # Category and price filters, with or without a text query
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)")
+
+# Order history is read per user, newest first
+def migration_order_history_index(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders (user_id, order_date, id)")
+
+# Outbox drained by EmailWorker
+def migration_email_outbox(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS email_outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        recipient TEXT NOT NULL,
+                        subject TEXT NOT NULL,
+                        body TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at REAL NOT NULL,
+                        sent_at REAL,
+                        last_error TEXT)''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_pending ON email_outbox (next_attempt_at) WHERE sent_at IS NULL")
+
+# Bulk import matches existing products by name
+def migration_product_name_index(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)")
+
+# One rating per user per product, and a per-product summary maintained by triggers
+def migration_rating_summary(cursor):
+    # Keep only the newest rating each user left on a product
+    cursor.execute('''DELETE FROM product_ratings WHERE rowid NOT IN (
+                        SELECT MAX(rowid) FROM product_ratings GROUP BY user_id, product_id)''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_product_ratings_user_product ON product_ratings (user_id, product_id)")
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS product_rating_summary (
+                        product_id INTEGER PRIMARY KEY,
+                        rating_count INTEGER NOT NULL DEFAULT 0,
+                        rating_sum INTEGER NOT NULL DEFAULT 0,
+                        stars_1 INTEGER NOT NULL DEFAULT 0,
+                        stars_2 INTEGER NOT NULL DEFAULT 0,
+                        stars_3 INTEGER NOT NULL DEFAULT 0,
+                        stars_4 INTEGER NOT NULL DEFAULT 0,
+                        stars_5 INTEGER NOT NULL DEFAULT 0,
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+    cursor.execute('''INSERT INTO product_rating_summary
+                      SELECT product_id, COUNT(*), SUM(rating), SUM(rating = 1), SUM(rating = 2),
+                             SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+                      FROM product_ratings GROUP BY product_id''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS product_ratings_summary_insert AFTER INSERT ON product_ratings BEGIN
+                        INSERT INTO product_rating_summary (product_id) VALUES (new.product_id)
+                            ON CONFLICT (product_id) DO NOTHING;
+                        UPDATE product_rating_summary SET
+                            rating_count = rating_count + 1,
+                            rating_sum = rating_sum + new.rating,
+                            stars_1 = stars_1 + (new.rating = 1), stars_2 = stars_2 + (new.rating = 2),
+                            stars_3 = stars_3 + (new.rating = 3), stars_4 = stars_4 + (new.rating = 4),
+                            stars_5 = stars_5 + (new.rating = 5)
+                        WHERE product_id = new.product_id;
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS product_ratings_summary_update AFTER UPDATE OF rating ON product_ratings BEGIN
+                        UPDATE product_rating_summary SET
+                            rating_sum = rating_sum - old.rating + new.rating,
+                            stars_1 = stars_1 - (old.rating = 1) + (new.rating = 1),
+                            stars_2 = stars_2 - (old.rating = 2) + (new.rating = 2),
+                            stars_3 = stars_3 - (old.rating = 3) + (new.rating = 3),
+                            stars_4 = stars_4 - (old.rating = 4) + (new.rating = 4),
+                            stars_5 = stars_5 - (old.rating = 5) + (new.rating = 5)
+                        WHERE product_id = new.product_id;
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS product_ratings_summary_delete AFTER DELETE ON product_ratings BEGIN
+                        UPDATE product_rating_summary SET
+                            rating_count = rating_count - 1,
+                            rating_sum = rating_sum - old.rating,
+                            stars_1 = stars_1 - (old.rating = 1), stars_2 = stars_2 - (old.rating = 2),
+                            stars_3 = stars_3 - (old.rating = 3), stars_4 = stars_4 - (old.rating = 4),
+                            stars_5 = stars_5 - (old.rating = 5)
+                        WHERE product_id = old.product_id;
+                      END''')
+
+# Daily sales rollups, filled incrementally from orders past the stored watermark
+def migration_sales_rollups(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sales_daily_totals (
+                        day TEXT PRIMARY KEY,
+                        orders INTEGER NOT NULL DEFAULT 0,
+                        units INTEGER NOT NULL DEFAULT 0,
+                        revenue REAL NOT NULL DEFAULT 0)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sales_daily_category (
+                        day TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        iso_number INTEGER NOT NULL,
+                        orders INTEGER NOT NULL DEFAULT 0,
+                        units INTEGER NOT NULL DEFAULT 0,
+                        revenue REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, category)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sales_daily_product (
+                        day TEXT NOT NULL,
+                        product_id INTEGER NOT NULL,
+                        units INTEGER NOT NULL DEFAULT 0,
+                        revenue REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, product_id)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS analytics_state (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL)''')
+    cursor.execute("INSERT OR IGNORE INTO analytics_state (name, value) VALUES ('rollup_order_id', 0)")
+    # Low-stock report
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_stock ON products (stock)")
+
+# Reorder points per product; a trigger queues SKUs whose stock drops through theirs
+def migration_reorder_queue(cursor):
+    cursor.execute("ALTER TABLE products ADD COLUMN reorder_point INTEGER NOT NULL DEFAULT 3")
+    cursor.execute("ALTER TABLE products ADD COLUMN reorder_quantity INTEGER NOT NULL DEFAULT 20")
+    cursor.execute("ALTER TABLE products ADD COLUMN supplier TEXT NOT NULL DEFAULT 'default'")
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reorder_queue (
+                        product_id INTEGER PRIMARY KEY,
+                        stock INTEGER NOT NULL,
+                        queued_at TEXT NOT NULL,
+                        FOREIGN KEY(product_id) REFERENCES products(id))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS purchase_orders (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        supplier TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        created_at TEXT NOT NULL,
+                        received_at TEXT)''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchase_orders_status ON purchase_orders (status, id)")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS purchase_order_lines (
+                        purchase_order_id INTEGER NOT NULL,
+                        product_id INTEGER NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        PRIMARY KEY (purchase_order_id, product_id),
+                        FOREIGN KEY(purchase_order_id) REFERENCES purchase_orders(id),
+                        FOREIGN KEY(product_id) REFERENCES products(id)) WITHOUT ROWID''')
+
+    # Runs inside whatever transaction decrements the stock
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_reorder AFTER UPDATE OF stock ON products
+                      WHEN new.stock < old.stock AND new.stock <= new.reorder_point AND old.stock > new.reorder_point
+                      BEGIN
+                        INSERT OR IGNORE INTO reorder_queue (product_id, stock, queued_at)
+                        VALUES (new.id, new.stock, datetime('now', 'localtime'));
+                      END''')
+
+# Order lifecycle: indexed status with its change time, and an append-only event log.
+# Triggers write the events, put stock back on cancellation and take cancelled orders
+# that were already folded into the sales rollups back out of them.
+def migration_order_lifecycle(cursor):
+    cursor.execute("ALTER TABLE orders ADD COLUMN status_changed_at TEXT")
+    cursor.execute("UPDATE orders SET status_changed_at = order_date")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, status_changed_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (order_date)")
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS order_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        order_id INTEGER NOT NULL,
+                        from_status TEXT,
+                        to_status TEXT NOT NULL,
+                        at TEXT NOT NULL,
+                        FOREIGN KEY(order_id) REFERENCES orders(id))''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (order_id, id)")
+    cursor.execute('''INSERT INTO order_events (order_id, from_status, to_status, at)
+                      SELECT id, NULL, status, order_date FROM orders ORDER BY id''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS order_events_no_update BEFORE UPDATE ON order_events
+                      BEGIN SELECT RAISE(ABORT, 'order_events is append-only'); END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS order_events_no_delete BEFORE DELETE ON order_events
+                      BEGIN SELECT RAISE(ABORT, 'order_events is append-only'); END''')
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_event_insert AFTER INSERT ON orders
+                      BEGIN
+                        INSERT INTO order_events (order_id, from_status, to_status, at)
+                        VALUES (new.id, NULL, new.status, COALESCE(new.status_changed_at, new.order_date));
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_event_update AFTER UPDATE OF status ON orders
+                      WHEN new.status IS NOT old.status
+                      BEGIN
+                        INSERT INTO order_events (order_id, from_status, to_status, at)
+                        VALUES (new.id, old.status, new.status, new.status_changed_at);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_cancel AFTER UPDATE OF status ON orders
+                      WHEN new.status = 'Cancelled' AND old.status IS NOT 'Cancelled'
+                      BEGIN
+                        UPDATE products SET stock = products.stock + s.quantity
+                        FROM (SELECT product_id, SUM(quantity) AS quantity FROM order_items
+                              WHERE order_id = new.id GROUP BY product_id) AS s
+                        WHERE products.id = s.product_id;
+
+                        UPDATE sales_daily_totals SET orders = sales_daily_totals.orders - 1, units = sales_daily_totals.units - s.units,
+                            revenue = sales_daily_totals.revenue - s.revenue
+                        FROM (SELECT SUM(quantity) AS units, SUM(price * quantity) AS revenue FROM order_items
+                              WHERE order_id = new.id) AS s
+                        WHERE sales_daily_totals.day = substr(new.order_date, 1, 10)
+                          AND new.id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id');
+                        UPDATE sales_daily_category SET orders = sales_daily_category.orders - 1, units = sales_daily_category.units - s.units,
+                            revenue = sales_daily_category.revenue - s.revenue
+                        FROM (SELECT COALESCE(p.category, 'other') AS category, SUM(oi.quantity) AS units,
+                                     SUM(oi.price * oi.quantity) AS revenue
+                              FROM order_items oi LEFT JOIN products p ON p.id = oi.product_id
+                              WHERE oi.order_id = new.id GROUP BY 1) AS s
+                        WHERE sales_daily_category.day = substr(new.order_date, 1, 10) AND sales_daily_category.category = s.category
+                          AND new.id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id');
+                        UPDATE sales_daily_product SET units = sales_daily_product.units - s.units,
+                            revenue = sales_daily_product.revenue - s.revenue
+                        FROM (SELECT product_id, SUM(quantity) AS units, SUM(price * quantity) AS revenue
+                              FROM order_items WHERE order_id = new.id GROUP BY product_id) AS s
+                        WHERE sales_daily_product.day = substr(new.order_date, 1, 10) AND sales_daily_product.product_id = s.product_id
+                          AND new.id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id');
+                      END''')
+
+# Money as integer kobo (₦1 = 100 kobo): REAL columns are rounded once into *_kobo
+# columns and dropped, with the indexes and trigger that used them rebuilt on the new ones
+def migration_money_kobo(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS orders_cancel")
+    cursor.execute("DROP INDEX IF EXISTS idx_products_category_price")
+    cursor.execute("DROP INDEX IF EXISTS idx_products_price")
+    cursor.execute("DROP INDEX IF EXISTS idx_order_items_order")
+
+    for table, old, new in (("products", "price", "price_kobo"), ("order_items", "price", "price_kobo"),
+                            ("orders", "total_amount", "total_kobo"), ("sales_daily_totals", "revenue", "revenue_kobo"),
+                            ("sales_daily_category", "revenue", "revenue_kobo"),
+                            ("sales_daily_product", "revenue", "revenue_kobo")):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {new} INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f"UPDATE {table} SET {new} = CAST(ROUND(COALESCE({old}, 0) * 100) AS INTEGER)")
+        cursor.execute(f"ALTER TABLE {table} DROP COLUMN {old}")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category, price_kobo)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price_kobo)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id, product_id, quantity, price_kobo)")
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS orders_cancel AFTER UPDATE OF status ON orders
+                      WHEN new.status = 'Cancelled' AND old.status IS NOT 'Cancelled'
+                      BEGIN
+                        UPDATE products SET stock = products.stock + s.quantity
+                        FROM (SELECT product_id, SUM(quantity) AS quantity FROM order_items
+                              WHERE order_id = new.id GROUP BY product_id) AS s
+                        WHERE products.id = s.product_id;
+
+                        UPDATE sales_daily_totals SET orders = sales_daily_totals.orders - 1, units = sales_daily_totals.units - s.units,
+                            revenue_kobo = sales_daily_totals.revenue_kobo - s.revenue_kobo
+                        FROM (SELECT SUM(quantity) AS units, SUM(price_kobo * quantity) AS revenue_kobo FROM order_items
+                              WHERE order_id = new.id) AS s
+                        WHERE sales_daily_totals.day = substr(new.order_date, 1, 10)
+                          AND new.id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id');
+                        UPDATE sales_daily_category SET orders = sales_daily_category.orders - 1, units = sales_daily_category.units - s.units,
+                            revenue_kobo = sales_daily_category.revenue_kobo - s.revenue_kobo
+                        FROM (SELECT COALESCE(p.category, 'other') AS category, SUM(oi.quantity) AS units,
+                                     SUM(oi.price_kobo * oi.quantity) AS revenue_kobo
+                              FROM order_items oi LEFT JOIN products p ON p.id = oi.product_id
+                              WHERE oi.order_id = new.id GROUP BY 1) AS s
+                        WHERE sales_daily_category.day = substr(new.order_date, 1, 10) AND sales_daily_category.category = s.category
+                          AND new.id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id');
+                        UPDATE sales_daily_product SET units = sales_daily_product.units - s.units,
+                            revenue_kobo = sales_daily_product.revenue_kobo - s.revenue_kobo
+                        FROM (SELECT product_id, SUM(quantity) AS units, SUM(price_kobo * quantity) AS revenue_kobo
+                              FROM order_items WHERE order_id = new.id GROUP BY product_id) AS s
+                        WHERE sales_daily_product.day = substr(new.order_date, 1, 10) AND sales_daily_product.product_id = s.product_id
+                          AND new.id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id');
+                      END''')
+
+# Server-side login sessions, keyed by a truncated hash of the token so the table never holds
+# usable tokens; the expiry index serves the batched sweep
+def migration_sessions(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                        token_hash BLOB PRIMARY KEY,
+                        user_id INTEGER NOT NULL,
+                        issued_at REAL NOT NULL,
+                        expires_at REAL NOT NULL,
+                        FOREIGN KEY(user_id) REFERENCES users(id)) WITHOUT ROWID''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+# Top-K "customers also bought" neighbours per product, rebuilt offline by
+# supermarket_recommendations.py; the key keeps each product's list in one contiguous range
+def migration_product_recommendations(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS product_recommendations (
+                        product_id INTEGER NOT NULL,
+                        rank INTEGER NOT NULL,
+                        recommended_id INTEGER NOT NULL,
+                        score REAL NOT NULL,
+                        PRIMARY KEY (product_id, rank)) WITHOUT ROWID''')
+
+MIGRATIONS = [
+    migration_base_schema,
+    migration_lookup_indexes,
+    migration_product_search,
+    migration_order_history_index,
+    migration_email_outbox,
+    migration_product_name_index,
+    migration_rating_summary,
+    migration_sales_rollups,
+    migration_reorder_queue,
+    migration_order_lifecycle,
+    migration_money_kobo,
+    migration_sessions,
+    migration_product_recommendations,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate_db(conn):
+    cursor = conn.cursor()
+    # BEGIN IMMEDIATE serializes processes that start up at the same time
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        current = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            MIGRATIONS[version - 1](cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Runs the migrations once per process and returns the shared pool
+@shared_resource
+def init_db():
+    pool = ConnectionPool(storage_config())
+    with pool.connection() as conn:
+        migrate_db(conn)
+    return pool
+
+# Borrow a pooled connection: `with get_db() as conn: ...`
+def get_db():
+    return init_db().connection()
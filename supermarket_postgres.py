@@ -0,0 +1,688 @@
+# PostgreSQL backend for supermarket_repository, so several app nodes can share one database.
+#
+#   SUPERMARKET_DB_BACKEND=postgres SUPERMARKET_PG_DSN=postgresql://shop@db/supermarket streamlit run supermarket_system.py
+#
+# Needs psycopg 3 and psycopg_pool (pip install "psycopg[binary,pool]"). Connections come
+# from a psycopg_pool pool of SUPERMARKET_DB_POOL_SIZE per process. The schema mirrors the
+# SQLite one: product search uses a generated tsvector with a GIN index instead of FTS5,
+# and plpgsql triggers keep the rating summary, the order event log and cancellation
+# restocks exactly as the SQLite triggers do.
+import os
+import random
+import time
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+from supermarket_db import DB_POOL_SIZE, categories
+from supermarket_repository import ARCHIVABLE_STATUSES, CheckoutError, INTERACTIONS_QUERY, Repository, StoreBusyError, search_terms, timestamp
+
+PG_DSN = "postgresql://localhost/supermarket"
+PG_POOL_TIMEOUT = 30
+# Arbitrary key for the advisory lock that serializes nodes migrating at the same time
+PG_MIGRATION_LOCK = 7_210_452
+
+def postgres_config(**overrides):
+    config = {"dsn": os.environ.get("SUPERMARKET_PG_DSN", PG_DSN),
+              "pool_size": int(os.environ.get("SUPERMARKET_DB_POOL_SIZE", DB_POOL_SIZE))}
+    config.update(overrides)
+    return config
+
+# Schema migrations, applied in order and tracked in schema_version
+def pg_migration_base_schema(cursor):
+    cursor.execute('''CREATE TABLE users (
+                        id BIGSERIAL PRIMARY KEY,
+                        username TEXT UNIQUE NOT NULL,
+                        password TEXT NOT NULL,
+                        role TEXT NOT NULL)''')
+    cursor.execute('''CREATE TABLE products (
+                        id BIGSERIAL PRIMARY KEY,
+                        name TEXT,
+                        category TEXT,
+                        iso_number INTEGER,
+                        price_kobo BIGINT NOT NULL DEFAULT 0,
+                        stock INTEGER,
+                        search TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED)''')
+    cursor.execute("CREATE INDEX idx_products_search ON products USING GIN (search)")
+    cursor.execute("CREATE INDEX idx_products_category_price ON products (category, price_kobo)")
+    cursor.execute("CREATE INDEX idx_products_price ON products (price_kobo)")
+    cursor.execute("CREATE INDEX idx_products_name ON products (name)")
+    seed = []
+    for i in range(1, 501):
+        category = random.choice(list(categories.keys()))
+        seed.append((f"Product {i}", category, categories[category], random.randint(500, 100000) * 100, random.randint(5, 10)))
+    cursor.executemany("INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (%s, %s, %s, %s, %s)", seed)
+
+    cursor.execute('''CREATE TABLE cart (
+                        user_id BIGINT NOT NULL REFERENCES users(id),
+                        product_id BIGINT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                        quantity INTEGER NOT NULL,
+                        PRIMARY KEY (user_id, product_id))''')
+    cursor.execute('''CREATE TABLE wishlist (
+                        user_id BIGINT NOT NULL REFERENCES users(id),
+                        product_id BIGINT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                        PRIMARY KEY (user_id, product_id))''')
+
+    # Order lines and ratings outlive the product they name, as on SQLite
+    cursor.execute('''CREATE TABLE orders (
+                        id BIGSERIAL PRIMARY KEY,
+                        user_id BIGINT REFERENCES users(id),
+                        order_date TEXT,
+                        status TEXT,
+                        total_kobo BIGINT NOT NULL DEFAULT 0,
+                        status_changed_at TEXT)''')
+    cursor.execute("CREATE INDEX idx_orders_user_date ON orders (user_id, order_date, id)")
+    cursor.execute("CREATE INDEX idx_orders_status ON orders (status, status_changed_at, id)")
+    cursor.execute("CREATE INDEX idx_orders_date ON orders (order_date)")
+    cursor.execute('''CREATE TABLE order_items (
+                        order_id BIGINT NOT NULL REFERENCES orders(id),
+                        product_id BIGINT,
+                        quantity INTEGER,
+                        price_kobo BIGINT NOT NULL DEFAULT 0)''')
+    cursor.execute("CREATE INDEX idx_order_items_order ON order_items (order_id, product_id, quantity, price_kobo)")
+    cursor.execute("CREATE INDEX idx_order_items_product ON order_items (product_id)")
+    cursor.execute('''CREATE TABLE order_events (
+                        id BIGSERIAL PRIMARY KEY,
+                        order_id BIGINT NOT NULL REFERENCES orders(id),
+                        from_status TEXT,
+                        to_status TEXT NOT NULL,
+                        at TEXT NOT NULL)''')
+    cursor.execute("CREATE INDEX idx_order_events_order ON order_events (order_id, id)")
+
+    cursor.execute('''CREATE TABLE product_ratings (
+                        id BIGSERIAL PRIMARY KEY,
+                        user_id BIGINT REFERENCES users(id),
+                        product_id BIGINT,
+                        rating INTEGER,
+                        review TEXT,
+                        date TEXT,
+                        UNIQUE (user_id, product_id))''')
+    cursor.execute("CREATE INDEX idx_product_ratings_product ON product_ratings (product_id, date, id)")
+    cursor.execute('''CREATE TABLE product_rating_summary (
+                        product_id BIGINT PRIMARY KEY,
+                        rating_count INTEGER NOT NULL DEFAULT 0,
+                        rating_sum INTEGER NOT NULL DEFAULT 0,
+                        stars_1 INTEGER NOT NULL DEFAULT 0,
+                        stars_2 INTEGER NOT NULL DEFAULT 0,
+                        stars_3 INTEGER NOT NULL DEFAULT 0,
+                        stars_4 INTEGER NOT NULL DEFAULT 0,
+                        stars_5 INTEGER NOT NULL DEFAULT 0)''')
+
+    cursor.execute('''CREATE TABLE email_outbox (
+                        id BIGSERIAL PRIMARY KEY,
+                        recipient TEXT NOT NULL,
+                        subject TEXT NOT NULL,
+                        body TEXT NOT NULL,
+                        created_at DOUBLE PRECISION NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at DOUBLE PRECISION NOT NULL,
+                        sent_at DOUBLE PRECISION,
+                        last_error TEXT)''')
+    cursor.execute("CREATE INDEX idx_email_outbox_pending ON email_outbox (next_attempt_at) WHERE sent_at IS NULL")
+
+# The same bookkeeping the SQLite migrations do with triggers
+def pg_migration_triggers(cursor):
+    # An update counts as removing the old rating and adding the new one
+    cursor.execute('''CREATE FUNCTION product_ratings_summary() RETURNS trigger AS $$
+                      BEGIN
+                        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                          UPDATE product_rating_summary SET
+                              rating_count = rating_count - 1,
+                              rating_sum = rating_sum - OLD.rating,
+                              stars_1 = stars_1 - (OLD.rating = 1)::int, stars_2 = stars_2 - (OLD.rating = 2)::int,
+                              stars_3 = stars_3 - (OLD.rating = 3)::int, stars_4 = stars_4 - (OLD.rating = 4)::int,
+                              stars_5 = stars_5 - (OLD.rating = 5)::int
+                          WHERE product_id = OLD.product_id;
+                        END IF;
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                          INSERT INTO product_rating_summary AS s
+                              (product_id, rating_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+                          VALUES (NEW.product_id, 1, NEW.rating, (NEW.rating = 1)::int, (NEW.rating = 2)::int,
+                                  (NEW.rating = 3)::int, (NEW.rating = 4)::int, (NEW.rating = 5)::int)
+                          ON CONFLICT (product_id) DO UPDATE SET
+                              rating_count = s.rating_count + 1,
+                              rating_sum = s.rating_sum + excluded.rating_sum,
+                              stars_1 = s.stars_1 + excluded.stars_1, stars_2 = s.stars_2 + excluded.stars_2,
+                              stars_3 = s.stars_3 + excluded.stars_3, stars_4 = s.stars_4 + excluded.stars_4,
+                              stars_5 = s.stars_5 + excluded.stars_5;
+                        END IF;
+                        RETURN NULL;
+                      END $$ LANGUAGE plpgsql''')
+    cursor.execute('''CREATE TRIGGER product_ratings_summary AFTER INSERT OR DELETE OR UPDATE OF rating ON product_ratings
+                      FOR EACH ROW EXECUTE FUNCTION product_ratings_summary()''')
+
+    cursor.execute('''CREATE FUNCTION order_events_append_only() RETURNS trigger AS $$
+                      BEGIN
+                        RAISE EXCEPTION 'order_events is append-only';
+                      END $$ LANGUAGE plpgsql''')
+    cursor.execute('''CREATE TRIGGER order_events_append_only BEFORE UPDATE OR DELETE ON order_events
+                      FOR EACH ROW EXECUTE FUNCTION order_events_append_only()''')
+
+    cursor.execute('''CREATE FUNCTION orders_status_event() RETURNS trigger AS $$
+                      BEGIN
+                        IF TG_OP = 'INSERT' THEN
+                          INSERT INTO order_events (order_id, from_status, to_status, at)
+                          VALUES (NEW.id, NULL, NEW.status, COALESCE(NEW.status_changed_at, NEW.order_date));
+                        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+                          INSERT INTO order_events (order_id, from_status, to_status, at)
+                          VALUES (NEW.id, OLD.status, NEW.status, NEW.status_changed_at);
+                          IF NEW.status = 'Cancelled' THEN
+                            UPDATE products SET stock = products.stock + s.quantity
+                            FROM (SELECT product_id, SUM(quantity) AS quantity FROM order_items
+                                  WHERE order_id = NEW.id GROUP BY product_id) AS s
+                            WHERE products.id = s.product_id;
+                          END IF;
+                        END IF;
+                        RETURN NULL;
+                      END $$ LANGUAGE plpgsql''')
+    cursor.execute('''CREATE TRIGGER orders_status_event AFTER INSERT OR UPDATE OF status ON orders
+                      FOR EACH ROW EXECUTE FUNCTION orders_status_event()''')
+
+def pg_migration_sessions(cursor):
+    cursor.execute('''CREATE TABLE sessions (
+                        token_hash BYTEA PRIMARY KEY,
+                        user_id BIGINT NOT NULL REFERENCES users(id),
+                        issued_at DOUBLE PRECISION NOT NULL,
+                        expires_at DOUBLE PRECISION NOT NULL)''')
+    cursor.execute("CREATE INDEX idx_sessions_expires ON sessions (expires_at)")
+
+def pg_migration_product_recommendations(cursor):
+    cursor.execute('''CREATE TABLE product_recommendations (
+                        product_id BIGINT NOT NULL,
+                        rank SMALLINT NOT NULL,
+                        recommended_id BIGINT NOT NULL,
+                        score REAL NOT NULL,
+                        PRIMARY KEY (product_id, rank))''')
+
+# Archived orders leave the database while their events stay as the audit log
+def pg_migration_archivable_orders(cursor):
+    cursor.execute("ALTER TABLE order_events DROP CONSTRAINT order_events_order_id_fkey")
+
+PG_MIGRATIONS = [
+    pg_migration_base_schema,
+    pg_migration_triggers,
+    pg_migration_sessions,
+    pg_migration_product_recommendations,
+    pg_migration_archivable_orders,
+]
+
+def migrate_postgres(conn):
+    with conn.transaction():
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PG_MIGRATION_LOCK,))
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        cursor.execute("SELECT version FROM schema_version")
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO schema_version (version) VALUES (0)")
+        current = row[0] if row else 0
+        for version in range(current + 1, len(PG_MIGRATIONS) + 1):
+            PG_MIGRATIONS[version - 1](cursor)
+            cursor.execute("UPDATE schema_version SET version = %s", (version,))
+
+# Product rows are (id, name, category, iso_number, price_kobo, stock, rating_count, rating_sum)
+PRODUCT_COLUMNS = """p.id, p.name, p.category, p.iso_number, p.price_kobo, p.stock,
+    COALESCE(rs.rating_count, 0), COALESCE(rs.rating_sum, 0)"""
+RATING_JOIN = "\n        LEFT JOIN product_rating_summary rs ON rs.product_id = p.id"
+# ts_rank grows with relevance, so it is negated to sort ascending like FTS5's bm25 rank.
+# It is a real; as float8 the value handed out in page cursors compares back exactly.
+PRODUCT_SORT_COLUMNS = {"relevance": "-ts_rank(p.search, q)::float8", "id": "p.id", "name": "p.name", "price": "p.price_kobo"}
+BUSY_ERRORS = (psycopg.errors.SerializationFailure, psycopg.errors.DeadlockDetected, psycopg.errors.LockNotAvailable)
+
+# Prefix query over the same terms as FTS5: "choc bar" -> choc:* & bar:*
+def search_tsquery(query):
+    return " & ".join(f"{term}:*" for term in search_terms(query))
+
+def build_product_search(query, category=None, min_price=None, max_price=None, joins=""):
+    match = search_tsquery(query)
+    if match:
+        sql_query = f"""
+        FROM products p
+        CROSS JOIN to_tsquery('simple', %s) AS q{joins}
+        WHERE p.search @@ q"""
+        params = (match,)
+    else:
+        sql_query = f" FROM products p{joins} WHERE TRUE"
+        params = ()
+
+    if category and category != "All":
+        sql_query += " AND p.category = %s"
+        params += (category,)
+
+    if min_price:
+        sql_query += " AND p.price_kobo >= %s"
+        params += (min_price,)
+
+    if max_price:
+        sql_query += " AND p.price_kobo <= %s"
+        params += (max_price,)
+
+    return sql_query, params, bool(match)
+
+# A shared PostgreSQL server. Each pooled connection commits when its block exits cleanly
+# and rolls back when it raises.
+class PostgresRepository(Repository):
+    backend = "postgres"
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = ConnectionPool(config["dsn"], min_size=1, max_size=config["pool_size"],
+                                   timeout=PG_POOL_TIMEOUT, open=True)
+        with self.pool.connection() as conn:
+            migrate_postgres(conn)
+
+    def create_user(self, username, password_hash, role):
+        with self.pool.connection() as conn:
+            row = conn.execute("""
+                INSERT INTO users (username, password, role) VALUES (%s, %s, %s)
+                ON CONFLICT (username) DO NOTHING RETURNING id
+            """, (username, password_hash, role)).fetchone()
+        return row[0] if row else None
+
+    def find_user(self, username):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT id, role, password FROM users WHERE username = %s", (username,)).fetchone()
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s", (new_hash, user_id, old_hash))
+
+    def create_session(self, token_hash, user_id, issued_at, expires_at):
+        with self.pool.connection() as conn:
+            conn.execute("INSERT INTO sessions (token_hash, user_id, issued_at, expires_at) VALUES (%s, %s, %s, %s)",
+                         (token_hash, user_id, issued_at, expires_at))
+
+    def find_session(self, token_hash):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                SELECT s.user_id, u.role, s.issued_at, s.expires_at
+                FROM sessions s JOIN users u ON u.id = s.user_id
+                WHERE s.token_hash = %s
+            """, (token_hash,)).fetchone()
+
+    def rotate_session(self, old_hash, new_hash, user_id, issued_at, expires_at, grace_until):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("UPDATE sessions SET expires_at = %s WHERE token_hash = %s AND expires_at > %s",
+                                  (grace_until, old_hash, grace_until))
+            rotated = cursor.rowcount > 0
+            if rotated:
+                conn.execute("INSERT INTO sessions (token_hash, user_id, issued_at, expires_at) VALUES (%s, %s, %s, %s)",
+                             (new_hash, user_id, issued_at, expires_at))
+        return rotated
+
+    def delete_session(self, token_hash):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE token_hash = %s", (token_hash,))
+
+    def sweep_sessions(self, now, limit):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                DELETE FROM sessions WHERE token_hash IN (
+                    SELECT token_hash FROM sessions WHERE expires_at < %s LIMIT %s)
+            """, (now, limit)).rowcount
+
+    def get_products(self, product_ids):
+        with self.pool.connection() as conn:
+            return conn.execute(f"""
+            SELECT {PRODUCT_COLUMNS}
+            FROM products p{RATING_JOIN}
+            WHERE p.id = ANY(%s)
+            """, (list(product_ids),)).fetchall()
+
+    def add_product(self, name, category, iso_number, price_kobo, stock):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            """, (name, category, iso_number, price_kobo, stock)).fetchone()[0]
+
+    def update_product(self, product_id, name, category, iso_number, price_kobo, stock):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                UPDATE products SET name = %s, category = %s, iso_number = %s, price_kobo = %s, stock = %s WHERE id = %s
+            """, (name, category, iso_number, price_kobo, stock, product_id))
+        return cursor.rowcount > 0
+
+    def remove_product(self, product_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("DELETE FROM products WHERE id = %s", (product_id,))
+        return cursor.rowcount > 0
+
+    def products_page(self, query, category, min_price, max_price, sort, descending, after, limit):
+        sql_query, params, has_match = build_product_search(query, category, min_price, max_price, RATING_JOIN)
+        if sort == "relevance" and not has_match:
+            sort = "id"
+        sort_column = PRODUCT_SORT_COLUMNS[sort]
+        direction = "DESC" if descending else "ASC"
+
+        if after is not None:
+            sql_query += f" AND ({sort_column}, p.id) {'<' if descending else '>'} (%s, %s)"
+            params += tuple(after)
+        sql_query = f"SELECT {PRODUCT_COLUMNS}, {sort_column}" + sql_query
+        sql_query += f" ORDER BY {sort_column} {direction}, p.id {direction} LIMIT %s"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            return conn.execute(sql_query, params).fetchall()
+
+    def count_products(self, query, category, min_price, max_price):
+        sql_query, params, _ = build_product_search(query, category, min_price, max_price)
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*)" + sql_query, params).fetchone()[0]
+
+    def add_to_cart(self, user_id, product_id, quantity):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO cart (user_id, product_id, quantity) VALUES (%s, %s, %s)
+                ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = cart.quantity + excluded.quantity
+            """, (user_id, product_id, quantity))
+
+    def get_cart(self, user_id):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            SELECT p.id, p.name, p.price_kobo, c.quantity
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = %s
+            """, (user_id,)).fetchall()
+
+    # SUM over BIGINT is NUMERIC in PostgreSQL; cast back so totals stay int
+    def get_cart_total(self, user_id):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            SELECT COALESCE(SUM(p.price_kobo * c.quantity), 0)::BIGINT
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = %s
+            """, (user_id,)).fetchone()[0]
+
+    def remove_from_cart(self, user_id, product_id):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM cart WHERE user_id = %s AND product_id = %s", (user_id, product_id))
+
+    def add_to_wishlist(self, user_id, product_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                INSERT INTO wishlist (user_id, product_id) VALUES (%s, %s) ON CONFLICT DO NOTHING
+            """, (user_id, product_id))
+        return cursor.rowcount > 0
+
+    def get_wishlist(self, user_id):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            SELECT p.id, p.name, p.price_kobo
+            FROM wishlist w
+            JOIN products p ON w.product_id = p.id
+            WHERE w.user_id = %s
+            """, (user_id,)).fetchall()
+
+    def remove_from_wishlist(self, user_id, product_id):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM wishlist WHERE user_id = %s AND product_id = %s", (user_id, product_id))
+
+    # The cart's product rows are locked in id order, so concurrent checkouts of the same
+    # products queue behind each other instead of deadlocking, and the stock read under the
+    # lock is what gets decremented
+    def checkout(self, user_id, confirmation):
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                SELECT p.id, p.name, p.price_kobo, c.quantity, p.stock
+                FROM cart c
+                JOIN products p ON c.product_id = p.id
+                WHERE c.user_id = %s
+                ORDER BY p.id
+                FOR UPDATE OF p, c
+                """, (user_id,))
+                rows = cursor.fetchall()
+                if not rows:
+                    raise CheckoutError("Your cart is empty.")
+                for product_id, name, _, quantity, available in rows:
+                    if available < quantity:
+                        raise CheckoutError(f"Insufficient stock for {name}. Available: {available}, Requested: {quantity}.")
+                items = [row[:4] for row in rows]
+                cursor.executemany("UPDATE products SET stock = stock - %s WHERE id = %s",
+                                   [(item[3], item[0]) for item in items])
+
+                order_date = timestamp()
+                cursor.execute("""
+                    INSERT INTO orders (user_id, order_date, status, total_kobo, status_changed_at)
+                    SELECT %s, %s, 'Processing', SUM(p.price_kobo * c.quantity), %s
+                    FROM cart c
+                    JOIN products p ON c.product_id = p.id
+                    WHERE c.user_id = %s
+                    RETURNING id, total_kobo
+                """, (user_id, order_date, order_date, user_id))
+                order_id, total_kobo = cursor.fetchone()
+                cursor.execute("""
+                    INSERT INTO order_items (order_id, product_id, quantity, price_kobo)
+                    SELECT %s, p.id, c.quantity, p.price_kobo
+                    FROM cart c
+                    JOIN products p ON c.product_id = p.id
+                    WHERE c.user_id = %s
+                """, (order_id, user_id))
+                cursor.execute("DELETE FROM cart WHERE user_id = %s", (user_id,))
+
+                cursor.execute("SELECT username FROM users WHERE id = %s", (user_id,))
+                user = cursor.fetchone()
+                notified = bool(user and "@" in user[0])
+                if notified:
+                    self._queue_emails(cursor, [(user[0], *confirmation(order_id, total_kobo, items))])
+        except BUSY_ERRORS as e:
+            raise StoreBusyError(str(e)) from e
+        return order_id, items, notified
+
+    def order_page(self, user_id, after, limit):
+        sql_query = "SELECT id, order_date, status, total_kobo FROM orders WHERE user_id = %s"
+        params = (user_id,)
+        if after is not None:
+            sql_query += " AND (order_date, id) < (%s, %s)"
+            params += tuple(after)
+        sql_query += " ORDER BY order_date DESC, id DESC LIMIT %s"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            return conn.execute(sql_query, params).fetchall()
+
+    def order_items(self, order_ids):
+        items = {order_id: [] for order_id in order_ids}
+        if not items:
+            return items
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+            SELECT oi.order_id, p.name, oi.quantity, oi.price_kobo
+            FROM order_items oi
+            JOIN products p ON oi.product_id = p.id
+            WHERE oi.order_id = ANY(%s)
+            """, (list(items),)).fetchall()
+        for row in rows:
+            items[row[0]].append(row[1:])
+        return items
+
+    # One statement for the whole batch; the orders_status_event trigger logs and restocks
+    def transition_orders(self, order_ids, status, sources, user_id, notification):
+        sql_query = """
+            UPDATE orders SET status = %s, status_changed_at = %s
+            WHERE id = ANY(%s) AND status = ANY(%s)"""
+        params = (status, timestamp(), list(order_ids), list(sources))
+        # Customers may only move their own orders
+        if user_id is not None:
+            sql_query += " AND user_id = %s"
+            params += (user_id,)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query + " RETURNING id", params)
+            moved = [row[0] for row in cursor.fetchall()]
+            products = []
+            if moved and status == "Cancelled":
+                cursor.execute("SELECT DISTINCT product_id FROM order_items WHERE order_id = ANY(%s)", (moved,))
+                products = [row[0] for row in cursor.fetchall()]
+            messages = []
+            if moved:
+                cursor.execute("""
+                    SELECT o.id, u.username FROM orders o JOIN users u ON u.id = o.user_id
+                    WHERE o.id = ANY(%s) AND u.username LIKE '%%@%%'""", (moved,))
+                messages = [(username, *notification(order_id)) for order_id, username in cursor.fetchall()]
+            if messages:
+                self._queue_emails(cursor, messages)
+        return moved, products, bool(messages)
+
+    def count_orders_by_status(self):
+        with self.pool.connection() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM orders GROUP BY status").fetchall())
+
+    def orders_by_status(self, status, after, limit):
+        sql_query = "SELECT id, user_id, order_date, total_kobo, status_changed_at FROM orders WHERE status = %s"
+        params = (status,)
+        if after is not None:
+            sql_query += " AND (status_changed_at, id) > (%s, %s)"
+            params += tuple(after)
+        sql_query += " ORDER BY status_changed_at, id LIMIT %s"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            return conn.execute(sql_query, params).fetchall()
+
+    def order_events(self, order_id, user_id=None):
+        sql_query, params = "SELECT from_status, to_status, at FROM order_events WHERE order_id = %s", [order_id]
+        if user_id is not None:
+            sql_query += " AND EXISTS (SELECT 1 FROM orders WHERE id = %s AND user_id = %s)"
+            params += [order_id, user_id]
+        with self.pool.connection() as conn:
+            return conn.execute(sql_query + " ORDER BY id", params).fetchall()
+
+    def rate_product(self, user_id, product_id, rating, review):
+        with self.pool.connection() as conn:
+            conn.execute("""
+            INSERT INTO product_ratings (user_id, product_id, rating, review, date)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id, product_id) DO UPDATE SET
+                rating = excluded.rating, review = excluded.review, date = excluded.date
+            """, (user_id, product_id, rating, review, timestamp()))
+
+    def rating_summary(self, product_id):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            SELECT rating_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5
+            FROM product_rating_summary WHERE product_id = %s
+            """, (product_id,)).fetchone()
+
+    # The key is the rating's id
+    def product_reviews(self, product_id, after, limit):
+        sql_query = """
+            SELECT r.rating, r.review, r.date, u.username, r.id
+            FROM product_ratings r
+            JOIN users u ON r.user_id = u.id
+            WHERE r.product_id = %s"""
+        params = (product_id,)
+        if after is not None:
+            sql_query += " AND (r.date, r.id) < (%s, %s)"
+            params += tuple(after)
+        sql_query += " ORDER BY r.date DESC, r.id DESC LIMIT %s"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            return conn.execute(sql_query, params).fetchall()
+
+    def archivable_orders(self, cutoff, after_id, limit):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                SELECT id, user_id, order_date, status, total_kobo FROM orders
+                WHERE id > %s AND order_date < %s AND status = ANY(%s)
+                ORDER BY id LIMIT %s
+            """, (after_id, cutoff, list(ARCHIVABLE_STATUSES), limit)).fetchall()
+
+    def delete_orders(self, order_ids):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM order_items WHERE order_id = ANY(%s)", (list(order_ids),))
+            conn.execute("DELETE FROM orders WHERE id = ANY(%s)", (list(order_ids),))
+
+    def existing_orders(self, order_ids):
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM orders WHERE id = ANY(%s)", (list(order_ids),))]
+
+    def archivable_reviews(self, cutoff, after_key, limit):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                SELECT r.id, r.product_id, u.username, r.date, r.review
+                FROM product_ratings r
+                JOIN users u ON r.user_id = u.id
+                WHERE r.id > %s AND r.date < %s AND r.review != ''
+                ORDER BY r.id LIMIT %s
+            """, (after_key, cutoff, limit)).fetchall()
+
+    def clear_reviews(self, keys, cutoff):
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE product_ratings SET review = NULL WHERE id = ANY(%s) AND date < %s", (list(keys), cutoff))
+
+    def interaction_batches(self, purchase_weight, wishlist_weight, liked_weight, batch_size):
+        with self.pool.connection() as conn:
+            # A named cursor streams from the server instead of loading every row
+            with conn.cursor(name="interactions") as cursor:
+                cursor.execute(INTERACTIONS_QUERY.replace("?", "%s"), (purchase_weight, wishlist_weight, liked_weight))
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        return
+                    yield batch
+
+    def replace_recommendations(self, first_id, end_id, rows):
+        with self.pool.connection() as conn:
+            if end_id is None:
+                conn.execute("DELETE FROM product_recommendations WHERE product_id >= %s", (first_id,))
+            else:
+                conn.execute("DELETE FROM product_recommendations WHERE product_id >= %s AND product_id < %s",
+                             (first_id, end_id))
+            with conn.cursor() as cursor:
+                cursor.executemany("""
+                    INSERT INTO product_recommendations (product_id, rank, recommended_id, score) VALUES (%s, %s, %s, %s)
+                """, rows)
+
+    def recommendations(self, product_ids, limit):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            SELECT p.id, p.name, p.price_kobo
+            FROM product_recommendations r
+            JOIN products p ON p.id = r.recommended_id
+            WHERE r.product_id = ANY(%s) AND r.recommended_id <> ALL(%s) AND p.stock > 0
+            GROUP BY p.id, p.name, p.price_kobo
+            ORDER BY SUM(r.score) DESC, p.id
+            LIMIT %s
+            """, (list(product_ids), list(product_ids), limit)).fetchall()
+
+    def _queue_emails(self, cursor, messages):
+        now = time.time()
+        cursor.executemany("""
+            INSERT INTO email_outbox (recipient, subject, body, created_at, next_attempt_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(recipient, subject, body, now, now) for recipient, subject, body in messages])
+
+    def queue_emails(self, messages):
+        with self.pool.connection() as conn:
+            self._queue_emails(conn.cursor(), messages)
+
+    # SKIP LOCKED lets every node's worker claim a different batch at the same time
+    def claim_emails(self, now, max_attempts, limit, lease_seconds):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                UPDATE email_outbox SET next_attempt_at = %s
+                WHERE id IN (SELECT id FROM email_outbox
+                             WHERE sent_at IS NULL AND attempts < %s AND next_attempt_at <= %s
+                             ORDER BY next_attempt_at LIMIT %s
+                             FOR UPDATE SKIP LOCKED)
+                RETURNING id, recipient, subject, body, created_at, attempts
+            """, (now + lease_seconds, max_attempts, now, limit)).fetchall()
+
+    def record_emails(self, sent, failed, released=()):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE email_outbox SET sent_at = %s WHERE id = %s", sent)
+            cursor.executemany("""
+                UPDATE email_outbox SET attempts = attempts + 1, next_attempt_at = %s, last_error = %s
+                WHERE id = %s
+            """, failed)
+            cursor.executemany("UPDATE email_outbox SET next_attempt_at = %s WHERE id = %s", released)
+
+    def email_queue_counts(self, max_attempts):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FILTER (WHERE attempts < %s), COUNT(*) FILTER (WHERE attempts >= %s)
+                FROM email_outbox WHERE sent_at IS NULL
+            """, (max_attempts, max_attempts)).fetchone()
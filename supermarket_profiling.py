@@ -0,0 +1,227 @@
+# Per-query profiling for every pooled SQLite connection.
+#
+# Each statement is timed (execute plus fetch) and counted against the function that
+# issued it, with a latency histogram per function. Statements slower than the
+# threshold keep their SQL and parameters in a short ring buffer; their EXPLAIN QUERY
+# PLAN is captured when the log is read. The bookkeeping is a couple of perf_counter
+# calls and a dict update per statement.
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+PROFILE_QUERIES = os.environ.get("SUPERMARKET_PROFILE_QUERIES", "1") == "1"
+SLOW_QUERY_MS = float(os.environ.get("SUPERMARKET_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = 50
+# Histogram bucket upper bounds in milliseconds (Prometheus "le" labels)
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_function_names = {}
+
+# The first project frame outside this module, e.g. "supermarket_service.get_cart"
+def calling_function():
+    frame = sys._getframe(3)
+    fallback = None
+    while frame is not None:
+        code = frame.f_code
+        name = _function_names.get(code)
+        if name is not None:
+            return name
+        if code.co_filename != __file__:
+            if fallback is None:
+                fallback = frame
+            if code.co_filename.startswith(PROJECT_DIR):
+                break
+        frame = frame.f_back
+    if frame is None:
+        # Called from outside the project, e.g. a script in another directory
+        frame = fallback
+        return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}" if frame else "unknown"
+    name = _function_names[frame.f_code] = f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+    return name
+
+class QueryStats:
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._functions = {}
+            self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+            self.started = time.time()
+
+    def record(self, function, elapsed_ms, rows):
+        with self._lock:
+            stats = self._functions.get(function)
+            if stats is None:
+                stats = self._functions[function] = {"calls": 0, "rows": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                     "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            stats["calls"] += 1
+            stats["rows"] += rows
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    break
+            else:
+                i = len(LATENCY_BUCKETS_MS)
+            stats["buckets"][i] += 1
+
+    # No plan yet: a statement can finish after its connection went back to the pool, when
+    # another thread may be using that connection
+    def record_slow(self, function, sql, elapsed_ms, rows, params):
+        if isinstance(params, (list, dict)):
+            params = type(params)(params)
+        with self._lock:
+            self.slow_queries.append({"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "function": function,
+                                      "ms": elapsed_ms, "rows": rows, "sql": " ".join(sql.split()),
+                                      "params": params, "plan": None})
+
+    # The slow statements, oldest first, with plans captured on `conn`, a connection the
+    # caller holds; each plan is captured once
+    def slow_log(self, conn):
+        with self._lock:
+            queries = list(self.slow_queries)
+        for query in queries:
+            params = query["params"]
+            if query["plan"] is None:
+                plan = explain(conn, query["sql"], params)
+                with self._lock:
+                    if query["plan"] is None:
+                        query["plan"], query["params"] = plan, None
+        return queries
+
+    # Per-function rows: (function, calls, rows, total_ms, mean_ms, max_ms), slowest total first
+    def summary(self):
+        with self._lock:
+            rows = [(name, s["calls"], s["rows"], s["total_ms"], s["total_ms"] / s["calls"], s["max_ms"])
+                    for name, s in self._functions.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        with self._lock:
+            functions = {name: dict(s, buckets=list(s["buckets"])) for name, s in self._functions.items()}
+        lines = ["# HELP supermarket_query_seconds SQL time per calling function.",
+                 "# TYPE supermarket_query_seconds histogram"]
+        for name, stats in sorted(functions.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS_MS + ("+Inf",), stats["buckets"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound / 1000:g}"
+                lines.append(f'supermarket_query_seconds_bucket{{function="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'supermarket_query_seconds_sum{{function="{name}"}} {stats["total_ms"] / 1000:.6f}')
+            lines.append(f'supermarket_query_seconds_count{{function="{name}"}} {stats["calls"]}')
+        lines += ["# HELP supermarket_query_rows_total Rows returned or changed per calling function.",
+                  "# TYPE supermarket_query_rows_total counter"]
+        lines += [f'supermarket_query_rows_total{{function="{name}"}} {stats["rows"]}'
+                  for name, stats in sorted(functions.items())]
+        lines += ["# HELP supermarket_slow_queries Slow statements currently in the log.",
+                  "# TYPE supermarket_slow_queries gauge",
+                  f"supermarket_slow_queries {len(self.slow_queries)}"]
+        return "\n".join(lines) + "\n"
+
+query_stats = QueryStats()
+
+# A statement is reported once its results are consumed (fetchall/fetchmany exhausted,
+# fetchone hits the end), the cursor is reused, or it is garbage collected.
+class ProfiledCursor(sqlite3.Cursor):
+    _pending = None
+
+    def _finish(self):
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+        function, sql, params, elapsed, rows = pending
+        elapsed_ms = elapsed * 1000
+        if rows < 0:
+            rows = max(self.rowcount, 0)
+        query_stats.record(function, elapsed_ms, rows)
+        if elapsed_ms >= query_stats.slow_ms:
+            query_stats.record_slow(function, sql, elapsed_ms, rows, params)
+
+    def _run(self, method, sql, params, plan_params):
+        self._finish()
+        function = calling_function()
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            # -1 rows until something is fetched: DML falls back to rowcount
+            self._pending = [function, sql, plan_params, time.perf_counter() - started, -1]
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params, params)
+
+    # Batches are timed as one statement; their plans are not captured
+    def executemany(self, sql, seq_of_params):
+        return self._run(super().executemany, sql, seq_of_params, None)
+
+    def _fetched(self, started, rows, done):
+        pending = self._pending
+        if pending is not None:
+            pending[3] += time.perf_counter() - started
+            pending[4] = max(pending[4], 0) + rows
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+class ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute bypasses Cursor.execute, so route it through a profiled cursor
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+def explain(conn, sql, params):
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")):
+        return []
+    if not isinstance(params, (tuple, list, dict)):
+        return []
+    try:
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error:
+        return []
+    return [row[-1] for row in rows]
+
+def connection_factory():
+    return ProfiledConnection if PROFILE_QUERIES else sqlite3.Connection
@@ -0,0 +1,162 @@
+# Offline item-item recommendations ("customers also bought").
+#
+#   python supermarket_recommendations.py --top-k 20 --memory-mb 256
+#
+# Purchases, wishlist entries and good ratings are streamed from the store into a sparse
+# customer x product matrix held as NumPy arrays. Products are scored against each other by
+# cosine similarity, computed in blocks of consecutive product ids sized so that a block's
+# co-occurring pairs fit the memory budget. Each block keeps its top K neighbours per product
+# and replaces just that id range in product_recommendations, so the app keeps serving the
+# previous lists while a rebuild runs. Schedule it (e.g. nightly from cron); the app reads
+# the table with one indexed lookup per view.
+import argparse
+import time
+
+import numpy as np
+
+from supermarket_repository import repository
+
+# Signal strength per source; a customer-product pair counts once, at its strongest signal
+PURCHASE_WEIGHT = 1.0
+WISHLIST_WEIGHT = 0.5
+LIKED_WEIGHT = 1.0  # a rating of 4 or 5 stars
+TOP_K = 20
+# Products are only linked when at least this many customers share them
+MIN_SUPPORT = 2
+# Bigger baskets (resellers, test accounts) add pairs quadratically and carry little signal
+MAX_BASKET_SIZE = 500
+MEMORY_MB = 256
+# Peak working memory per co-occurring pair while a block is summed (measured with tracemalloc)
+BYTES_PER_PAIR = 40
+SCAN_BATCH_SIZE = 50_000
+
+# Returns (customer index, product id, weight) arrays sorted by customer then product,
+# one entry per pair, and the product id bound. Each batch is packed as it arrives into a
+# (user_id << 32 | product_id) key and a weight, 12 bytes per interaction, and the result
+# takes 12 bytes per pair.
+def load_interactions(repo, batch_size=SCAN_BATCH_SIZE):
+    key_chunks, weight_chunks = [], []
+    for batch in repo.interaction_batches(PURCHASE_WEIGHT, WISHLIST_WEIGHT, LIKED_WEIGHT, batch_size):
+        rows = np.array(batch, dtype=np.float64)
+        key_chunks.append((rows[:, 0].astype(np.int64) << 32) | rows[:, 1].astype(np.int64))
+        weight_chunks.append(rows[:, 2].astype(np.float32))
+    if not key_chunks:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32), 0
+    keys, weights = np.concatenate(key_chunks), np.concatenate(weight_chunks)
+    del key_chunks, weight_chunks
+    order = np.argsort(keys)
+    keys, weights = keys[order], weights[order]
+    del order
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    weights = np.maximum.reduceat(weights, starts)
+    keys = keys[starts]
+    del starts
+    users = keys >> 32
+    # Customer ids are sorted, so numbering their runs gives dense indexes
+    users = np.cumsum(np.r_[0, users[1:] != users[:-1]], dtype=np.int32)
+    products = keys & 0xFFFFFFFF
+    del keys
+    product_bound = int(products.max()) + 1
+    return users, products.astype(np.int32 if product_bound < 2 ** 31 else np.int64), weights, product_bound
+
+# The same matrix by rows (each customer's basket) and by columns (each product's customers)
+class InteractionMatrix:
+    def __init__(self, users, products, weights, product_bound):
+        basket_sizes = np.bincount(users)
+        if basket_sizes.max() > MAX_BASKET_SIZE:
+            keep = basket_sizes[users] <= MAX_BASKET_SIZE
+            users, products, weights = users[keep], products[keep], weights[keep]
+        self.product_bound = product_bound
+        self.row_products, self.row_weights = products, weights
+        self.row_lengths = np.bincount(users, minlength=len(basket_sizes))
+        self.row_starts = np.cumsum(self.row_lengths) - self.row_lengths
+        by_product = np.argsort(products, kind="stable")
+        self.column_users, self.column_weights = users[by_product], weights[by_product]
+        self.column_lengths = np.bincount(products, minlength=product_bound)
+        self.column_starts = np.cumsum(self.column_lengths) - self.column_lengths
+        self.norms = np.sqrt(np.bincount(products, weights=np.square(weights, dtype=np.float64), minlength=product_bound))
+        # Pairs a product expands into: the basket sizes of all its customers
+        self.pair_counts = np.bincount(products, weights=self.row_lengths[users], minlength=product_bound)
+
+    # Consecutive (first_id, end_id) blocks whose pairs fit max_pairs; a single product
+    # over the budget gets a block of its own
+    def blocks(self, max_pairs):
+        cumulative = np.cumsum(self.pair_counts)
+        first = 0
+        while first < self.product_bound:
+            done = cumulative[first - 1] if first else 0
+            end = max(int(np.searchsorted(cumulative, done + max_pairs, side="right")), first + 1)
+            yield first, min(end, self.product_bound)
+            first = end
+
+    # Top-K (product_id, rank, recommended_id, score) rows for products first_id <= id < end_id
+    def neighbours(self, first_id, end_id, top_k, min_support):
+        entries = slice(self.column_starts[first_id], self.column_starts[end_id - 1] + self.column_lengths[end_id - 1])
+        users = self.column_users[entries]
+        lengths = self.row_lengths[users]
+        total = int(lengths.sum())
+        if not total:
+            return []
+        # Every (product in block, product in the same basket) pair as an index into the row arrays
+        positions = np.repeat(self.row_starts[users] - (np.cumsum(lengths) - lengths), lengths)
+        positions += np.arange(total)
+        pair_weights = np.repeat(self.column_weights[entries], lengths) * self.row_weights[positions]
+        pair_keys = np.repeat(np.repeat(np.arange(end_id - first_id), self.column_lengths[first_id:end_id]), lengths)
+        pair_keys *= self.product_bound
+        pair_keys += self.row_products[positions]
+        del positions
+        # Sum each distinct pair with one sort, keeping only the key and weight arrays alive
+        order = np.argsort(pair_keys)
+        pair_keys, pair_weights = pair_keys[order], pair_weights[order]
+        del order
+        starts = np.flatnonzero(np.r_[True, pair_keys[1:] != pair_keys[:-1]])
+        keys = pair_keys[starts]
+        del pair_keys
+        dots = np.add.reduceat(pair_weights.astype(np.float64), starts)
+        support = np.diff(np.r_[starts, total])
+        del pair_weights, starts
+
+        products, recommended = keys // self.product_bound + first_id, keys % self.product_bound
+        keep = (products != recommended) & (support >= min_support)
+        products, recommended, dots = products[keep], recommended[keep], dots[keep]
+        scores = dots / (self.norms[products] * self.norms[recommended])
+        # Best first within each product; keys were sorted by product, and ties keep id order
+        order = np.lexsort((-scores, products))
+        products, recommended, scores = products[order], recommended[order], scores[order]
+        ranks = np.arange(len(products)) - np.searchsorted(products, products)
+        keep = ranks < top_k
+        return list(zip(products[keep].tolist(), ranks[keep].tolist(), recommended[keep].tolist(),
+                        np.round(scores[keep], 6).tolist()))
+
+# Rebuilds product_recommendations; returns (products with neighbours, rows written)
+def build_recommendations(top_k=TOP_K, memory_mb=MEMORY_MB, min_support=MIN_SUPPORT):
+    repo = repository()
+    users, products, weights, product_bound = load_interactions(repo)
+    if not product_bound:
+        repo.replace_recommendations(0, None, [])
+        return 0, 0
+    matrix = InteractionMatrix(users, products, weights, product_bound)
+    del users, products, weights
+    covered = written = 0
+    for first_id, end_id in matrix.blocks(max(memory_mb * 2 ** 20 // BYTES_PER_PAIR, 1)):
+        rows = matrix.neighbours(first_id, end_id, top_k, min_support)
+        # The last block also clears products added since, or left with no interactions
+        repo.replace_recommendations(first_id, end_id if end_id < product_bound else None, rows)
+        covered += sum(1 for row in rows if row[1] == 0)
+        written += len(rows)
+    return covered, written
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the item-item product recommendations.")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="neighbours kept per product")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_MB, help="working memory for one block of product pairs")
+    parser.add_argument("--min-support", type=int, default=MIN_SUPPORT, help="customers two products must share")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    covered, written = build_recommendations(args.top_k, args.memory_mb, args.min_support)
+    print(f"{written} recommendations for {covered} products in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
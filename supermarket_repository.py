@@ -0,0 +1,824 @@
+# Repository interface over the transactional data: users, products, cart, wishlist,
+# orders, ratings, login sessions and the email outbox. supermarket_service reaches those
+# tables only through it, so the same app runs on the local SQLite file or on a PostgreSQL
+# server shared by many nodes.
+#
+# SUPERMARKET_DB_BACKEND picks the implementation: "sqlite" (default, the database from
+# supermarket_db) or "postgres" (supermarket_postgres, needs psycopg). Every backend
+# returns rows of the same shape; dates are "YYYY-MM-DD HH:MM:SS" text and money is
+# integer kobo. Reporting (sales rollups, reorder queue, query profiling) stays on SQLite.
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+from supermarket_db import init_db, shared_resource
+
+DB_BACKEND = "sqlite"
+
+class CheckoutError(Exception):
+    pass
+
+# A write lost a lock or serialization race; the caller may retry it
+class StoreBusyError(Exception):
+    pass
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def search_terms(query):
+    return re.findall(r"\w+", query or "")
+
+# Turns free text into an FTS5 prefix query: "choc bar" -> "choc"* "bar"*
+def search_match_expression(query):
+    return " ".join(f'"{term}"*' for term in search_terms(query))
+
+class Repository:
+    backend = None
+
+    # Users
+    # New user id, or None if the username is taken
+    def create_user(self, username, password_hash, role):
+        raise NotImplementedError
+
+    # (id, role, password_hash) or None
+    def find_user(self, username):
+        raise NotImplementedError
+
+    # Compare-and-swap, so a password changed meanwhile is not overwritten
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        raise NotImplementedError
+
+    # Sessions are keyed by a hash of the token; times are epoch seconds
+    def create_session(self, token_hash, user_id, issued_at, expires_at):
+        raise NotImplementedError
+
+    # (user_id, role, issued_at, expires_at) or None; the role is read from users, so a
+    # changed role applies to live sessions
+    def find_session(self, token_hash):
+        raise NotImplementedError
+
+    # Replaces a session with a new one, leaving the old token valid until grace_until.
+    # Returns False when the old session was already rotated, expired or ended.
+    def rotate_session(self, old_hash, new_hash, user_id, issued_at, expires_at, grace_until):
+        raise NotImplementedError
+
+    def delete_session(self, token_hash):
+        raise NotImplementedError
+
+    # Deletes up to `limit` sessions that expired before `now`; returns how many
+    def sweep_sessions(self, now, limit):
+        raise NotImplementedError
+
+    # Products: rows are (id, name, category, iso_number, price_kobo, stock, rating_count, rating_sum)
+    def get_products(self, product_ids):
+        raise NotImplementedError
+
+    def add_product(self, name, category, iso_number, price_kobo, stock):
+        raise NotImplementedError
+
+    # Both return False when no product has this id
+    def update_product(self, product_id, name, category, iso_number, price_kobo, stock):
+        raise NotImplementedError
+
+    def remove_product(self, product_id):
+        raise NotImplementedError
+
+    # Up to `limit` product rows with the sort value appended as a ninth column, after the
+    # (sort value, id) keyset cursor `after`
+    def products_page(self, query, category, min_price, max_price, sort, descending, after, limit):
+        raise NotImplementedError
+
+    def count_products(self, query, category, min_price, max_price):
+        raise NotImplementedError
+
+    # Cart: lines are (product_id, name, price_kobo, quantity)
+    def add_to_cart(self, user_id, product_id, quantity):
+        raise NotImplementedError
+
+    def get_cart(self, user_id):
+        raise NotImplementedError
+
+    def get_cart_total(self, user_id):
+        raise NotImplementedError
+
+    def remove_from_cart(self, user_id, product_id):
+        raise NotImplementedError
+
+    # Wishlist: entries are (product_id, name, price_kobo); add returns False for duplicates
+    def add_to_wishlist(self, user_id, product_id):
+        raise NotImplementedError
+
+    def get_wishlist(self, user_id):
+        raise NotImplementedError
+
+    def remove_from_wishlist(self, user_id, product_id):
+        raise NotImplementedError
+
+    # Orders
+    # Turns the cart into an order in one transaction, never overselling stock. When the
+    # username is an email address, confirmation(order_id, total_kobo, items) gives the
+    # (subject, body) queued with the order. Returns (order_id, items, notified); raises
+    # CheckoutError for an empty cart or short stock and StoreBusyError on lock contention.
+    def checkout(self, user_id, confirmation):
+        raise NotImplementedError
+
+    # Up to `limit` orders (id, order_date, status, total_kobo), newest first, after `after`
+    def order_page(self, user_id, after, limit):
+        raise NotImplementedError
+
+    # {order_id: [(name, quantity, price_kobo), ...]}
+    def order_items(self, order_ids):
+        raise NotImplementedError
+
+    # Moves the orders that are in one of `sources` to `status` (only `user_id`'s own when
+    # given), logging events and restocking cancellations. notification(order_id) gives the
+    # (subject, body) queued for customers with email usernames.
+    # Returns (moved ids, restocked product ids, notified).
+    def transition_orders(self, order_ids, status, sources, user_id, notification):
+        raise NotImplementedError
+
+    # {status: count}
+    def count_orders_by_status(self):
+        raise NotImplementedError
+
+    # Up to `limit` orders (id, user_id, order_date, total_kobo, status_changed_at), oldest change first
+    def orders_by_status(self, status, after, limit):
+        raise NotImplementedError
+
+    # (from_status, to_status, at), oldest first; with user_id, only if that customer placed
+    # the order (archived orders then have none)
+    def order_events(self, order_id, user_id=None):
+        raise NotImplementedError
+
+    # Ratings: one per user per product, with a maintained per-product summary
+    def rate_product(self, user_id, product_id, rating, review):
+        raise NotImplementedError
+
+    # (rating_count, rating_sum, stars_1, ..., stars_5) or None
+    def rating_summary(self, product_id):
+        raise NotImplementedError
+
+    # Up to `limit` reviews (rating, review, date, username, key), newest first, after the
+    # (date, key) cursor `after`
+    def product_reviews(self, product_id, after, limit):
+        raise NotImplementedError
+
+    # Recommendations
+    # Yields lists of up to batch_size (user_id, product_id, weight) rows: a purchase (cancelled
+    # orders excluded), a wishlist entry or a rating of 4 stars or more, each with its weight
+    def interaction_batches(self, purchase_weight, wishlist_weight, liked_weight, batch_size):
+        raise NotImplementedError
+
+    # Replaces the neighbours of products first_id <= id < end_id (no upper bound when end_id
+    # is None) with rows of (product_id, rank, recommended_id, score) in one transaction
+    def replace_recommendations(self, first_id, end_id, rows):
+        raise NotImplementedError
+
+    # Up to `limit` in-stock products (id, name, price_kobo) recommended for the given ones,
+    # excluding those, highest combined score first
+    def recommendations(self, product_ids, limit):
+        raise NotImplementedError
+
+    # Archival
+    # Up to `limit` orders (id, user_id, order_date, status, total_kobo) placed before `cutoff`
+    # that can no longer change (Delivered or Cancelled), in id order after `after_id`
+    def archivable_orders(self, cutoff, after_id, limit):
+        raise NotImplementedError
+
+    # Deletes the orders and their lines; their events stay as the audit log
+    def delete_orders(self, order_ids):
+        raise NotImplementedError
+
+    # The ids among order_ids that are still stored
+    def existing_orders(self, order_ids):
+        raise NotImplementedError
+
+    # Up to `limit` reviews (key, product_id, username, date, review) with text, written before
+    # `cutoff`, in key order after `after_key`
+    def archivable_reviews(self, cutoff, after_key, limit):
+        raise NotImplementedError
+
+    # Drops the text of the given reviews unless they were rewritten since `cutoff`
+    def clear_reviews(self, keys, cutoff):
+        raise NotImplementedError
+
+    # Email outbox
+    # messages are (recipient, subject, body)
+    def queue_emails(self, messages):
+        raise NotImplementedError
+
+    # Leases up to `limit` due messages (id, recipient, subject, body, created_at, attempts)
+    # until now + lease_seconds, so workers on other nodes skip them meanwhile
+    def claim_emails(self, now, max_attempts, limit, lease_seconds):
+        raise NotImplementedError
+
+    # sent is [(sent_at, id)], failed is [(retry_at, error, id)]; released is [(due_at, id)],
+    # claimed messages never attempted, whose lease ends without counting an attempt
+    def record_emails(self, sent, failed, released=()):
+        raise NotImplementedError
+
+    # (queue depth, dead letters)
+    def email_queue_counts(self, max_attempts):
+        raise NotImplementedError
+
+# Product rows are (id, name, category, iso_number, price_kobo, stock, rating_count, rating_sum)
+PRODUCT_COLUMNS = """p.id, p.name, p.category, p.iso_number, p.price_kobo, p.stock,
+    COALESCE(rs.rating_count, 0), COALESCE(rs.rating_sum, 0)"""
+RATING_JOIN = "\n        LEFT JOIN product_rating_summary rs ON rs.product_id = p.id"
+PRODUCT_SORT_COLUMNS = {"relevance": "products_fts.rank", "id": "p.id", "name": "p.name", "price": "p.price_kobo"}
+TRANSITION_CHUNK = 500
+ARCHIVABLE_STATUSES = ("Delivered", "Cancelled")
+INTERACTIONS_QUERY = """
+    SELECT o.user_id, oi.product_id, ? FROM order_items oi JOIN orders o ON o.id = oi.order_id
+    WHERE o.status != 'Cancelled'
+    UNION ALL SELECT user_id, product_id, ? FROM wishlist
+    UNION ALL SELECT user_id, product_id, ? FROM product_ratings WHERE rating >= 4"""
+
+# Shared FROM/WHERE clause for searching, paging and counting products; price bounds are in kobo
+def build_product_search(query, category=None, min_price=None, max_price=None, joins=""):
+    match = search_match_expression(query)
+    if match:
+        sql_query = f"""
+        FROM products_fts
+        JOIN products p ON p.id = products_fts.rowid{joins}
+        WHERE products_fts MATCH ?"""
+        params = (match,)
+    else:
+        sql_query = f" FROM products p{joins} WHERE 1 = 1"
+        params = ()
+
+    if category and category != "All":
+        sql_query += " AND p.category = ?"
+        params += (category,)
+
+    if min_price:
+        sql_query += " AND p.price_kobo >= ?"
+        params += (min_price,)
+
+    if max_price:
+        sql_query += " AND p.price_kobo <= ?"
+        params += (max_price,)
+
+    return sql_query, params, bool(match)
+
+# Queue messages on an open cursor, so they commit (or roll back) with the caller's transaction
+def queue_emails(cursor, messages):
+    now = time.time()
+    cursor.executemany("""
+        INSERT INTO email_outbox (recipient, subject, body, created_at, next_attempt_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(recipient, subject, body, now, now) for recipient, subject, body in messages])
+
+# The local SQLite database; schema and triggers come from supermarket_db's migrations
+class SQLiteRepository(Repository):
+    backend = "sqlite"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def create_user(self, username, password_hash, role):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, password_hash, role))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                return None
+        return cursor.lastrowid
+
+    def find_user(self, username):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, role, password FROM users WHERE username = ?", (username,))
+            return cursor.fetchone()
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?", (new_hash, user_id, old_hash))
+            conn.commit()
+
+    def create_session(self, token_hash, user_id, issued_at, expires_at):
+        with self.pool.connection() as conn:
+            conn.execute("INSERT INTO sessions (token_hash, user_id, issued_at, expires_at) VALUES (?, ?, ?, ?)",
+                         (token_hash, user_id, issued_at, expires_at))
+            conn.commit()
+
+    def find_session(self, token_hash):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT s.user_id, u.role, s.issued_at, s.expires_at
+                FROM sessions s JOIN users u ON u.id = s.user_id
+                WHERE s.token_hash = ?
+            """, (token_hash,))
+            return cursor.fetchone()
+
+    def rotate_session(self, old_hash, new_hash, user_id, issued_at, expires_at, grace_until):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("UPDATE sessions SET expires_at = ? WHERE token_hash = ? AND expires_at > ?",
+                               (grace_until, old_hash, grace_until))
+                rotated = cursor.rowcount > 0
+                if rotated:
+                    cursor.execute("INSERT INTO sessions (token_hash, user_id, issued_at, expires_at) VALUES (?, ?, ?, ?)",
+                                   (new_hash, user_id, issued_at, expires_at))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return rotated
+
+    def delete_session(self, token_hash):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE token_hash = ?", (token_hash,))
+            conn.commit()
+
+    def sweep_sessions(self, now, limit):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM sessions WHERE token_hash IN (
+                    SELECT token_hash FROM sessions WHERE expires_at < ? LIMIT ?)
+            """, (now, limit))
+            conn.commit()
+        return cursor.rowcount
+
+    def get_products(self, product_ids):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+            SELECT {PRODUCT_COLUMNS}
+            FROM products p{RATING_JOIN}
+            WHERE p.id IN ({", ".join("?" * len(product_ids))})
+            """, tuple(product_ids))
+            return cursor.fetchall()
+
+    def add_product(self, name, category, iso_number, price_kobo, stock):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO products (name, category, iso_number, price_kobo, stock) VALUES (?, ?, ?, ?, ?)", (name, category, iso_number, price_kobo, stock))
+            conn.commit()
+        return cursor.lastrowid
+
+    def update_product(self, product_id, name, category, iso_number, price_kobo, stock):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE products SET name = ?, category = ?, iso_number = ?, price_kobo = ?, stock = ? WHERE id = ?", (name, category, iso_number, price_kobo, stock, product_id))
+            conn.commit()
+        return cursor.rowcount > 0
+
+    def remove_product(self, product_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            conn.commit()
+        return cursor.rowcount > 0
+
+    def products_page(self, query, category, min_price, max_price, sort, descending, after, limit):
+        sql_query, params, has_match = build_product_search(query, category, min_price, max_price, RATING_JOIN)
+        if sort == "relevance" and not has_match:
+            sort = "id"
+        sort_column = PRODUCT_SORT_COLUMNS[sort]
+        direction = "DESC" if descending else "ASC"
+
+        if after is not None:
+            sql_query += f" AND ({sort_column}, p.id) {'<' if descending else '>'} (?, ?)"
+            params += tuple(after)
+        sql_query = f"SELECT {PRODUCT_COLUMNS}, {sort_column}" + sql_query
+        sql_query += f" ORDER BY {sort_column} {direction}, p.id {direction} LIMIT ?"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, params)
+            return cursor.fetchall()
+
+    def count_products(self, query, category, min_price, max_price):
+        sql_query, params, _ = build_product_search(query, category, min_price, max_price)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*)" + sql_query, params)
+            return cursor.fetchone()[0]
+
+    def add_to_cart(self, user_id, product_id, quantity):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """, (user_id, product_id, quantity))
+            conn.commit()
+
+    def get_cart(self, user_id):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT p.id, p.name, p.price_kobo, c.quantity
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+            """, (user_id,))
+            return cursor.fetchall()
+
+    # Summed by SQLite in exact integer arithmetic
+    def get_cart_total(self, user_id):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT COALESCE(SUM(p.price_kobo * c.quantity), 0)
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+            """, (user_id,))
+            return cursor.fetchone()[0]
+
+    def remove_from_cart(self, user_id, product_id):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM cart WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+            conn.commit()
+
+    def add_to_wishlist(self, user_id, product_id):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # The primary key rejects duplicates, so nothing is inserted if it is already there
+            cursor.execute("INSERT OR IGNORE INTO wishlist (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
+            conn.commit()
+        return cursor.rowcount > 0
+
+    def get_wishlist(self, user_id):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT p.id, p.name, p.price_kobo
+            FROM wishlist w
+            JOIN products p ON w.product_id = p.id
+            WHERE w.user_id = ?
+            """, (user_id,))
+            return cursor.fetchall()
+
+    def remove_from_wishlist(self, user_id, product_id):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+            conn.commit()
+
+    # Runs in one BEGIN IMMEDIATE transaction; stock is only taken with conditional decrements
+    def checkout(self, user_id, confirmation):
+        try:
+            with self.pool.connection() as conn:
+                return self._checkout(conn, user_id, confirmation)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            raise StoreBusyError(str(e)) from e
+
+    def _checkout(self, conn, user_id, confirmation):
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Retrieve cart items; BEGIN IMMEDIATE holds the write lock, so the stock read
+            # here is what gets decremented below
+            cursor.execute("""
+            SELECT p.id, p.name, p.price_kobo, c.quantity, p.stock
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+            """, (user_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                raise CheckoutError("Your cart is empty.")
+            for _, name, _, quantity, available in rows:
+                if available < quantity:
+                    raise CheckoutError(f"Insufficient stock for {name}. Available: {available}, Requested: {quantity}.")
+            items = [row[:4] for row in rows]
+            cursor.executemany("UPDATE products SET stock = stock - ? WHERE id = ?",
+                               [(item[3], item[0]) for item in items])
+
+            # The order, its total and its lines are built from the cart inside SQLite
+            order_date = timestamp()
+            cursor.execute("""
+                INSERT INTO orders (user_id, order_date, status, total_kobo, status_changed_at)
+                SELECT ?, ?, 'Processing', SUM(p.price_kobo * c.quantity), ?
+                FROM cart c
+                JOIN products p ON c.product_id = p.id
+                WHERE c.user_id = ?
+                RETURNING id, total_kobo
+            """, (user_id, order_date, order_date, user_id))
+            order_id, total_kobo = cursor.fetchone()
+            cursor.execute("""
+                INSERT INTO order_items (order_id, product_id, quantity, price_kobo)
+                SELECT ?, p.id, c.quantity, p.price_kobo
+                FROM cart c
+                JOIN products p ON c.product_id = p.id
+                WHERE c.user_id = ?
+            """, (order_id, user_id))
+
+            # Clear cart
+            cursor.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
+
+            # Usernames that are email addresses get a confirmation, sent by the outbox worker
+            cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+            notified = bool(user and "@" in user[0])
+            if notified:
+                queue_emails(cursor, [(user[0], *confirmation(order_id, total_kobo, items))])
+
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return order_id, items, notified
+
+    def order_page(self, user_id, after, limit):
+        sql_query = "SELECT id, order_date, status, total_kobo FROM orders WHERE user_id = ?"
+        params = (user_id,)
+        if after is not None:
+            sql_query += " AND (order_date, id) < (?, ?)"
+            params += tuple(after)
+        sql_query += " ORDER BY order_date DESC, id DESC LIMIT ?"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, params)
+            return cursor.fetchall()
+
+    def order_items(self, order_ids):
+        items = {order_id: [] for order_id in order_ids}
+        if not items:
+            return items
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+            SELECT oi.order_id, p.name, oi.quantity, oi.price_kobo
+            FROM order_items oi
+            JOIN products p ON oi.product_id = p.id
+            WHERE oi.order_id IN ({", ".join("?" * len(items))})
+            """, tuple(items))
+            for row in cursor.fetchall():
+                items[row[0]].append(row[1:])
+        return items
+
+    # Triggers log the events and restock cancelled orders; ids go in chunks of TRANSITION_CHUNK
+    def transition_orders(self, order_ids, status, sources, user_id, notification):
+        changed_at = timestamp()
+        moved = []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for start in range(0, len(order_ids), TRANSITION_CHUNK):
+                    chunk = order_ids[start:start + TRANSITION_CHUNK]
+                    sql_query = f"""
+                        UPDATE orders SET status = ?, status_changed_at = ?
+                        WHERE id IN ({", ".join("?" * len(chunk))}) AND status IN ({", ".join("?" * len(sources))})"""
+                    params = (status, changed_at, *chunk, *sources)
+                    # Customers may only move their own orders
+                    if user_id is not None:
+                        sql_query += " AND user_id = ?"
+                        params += (user_id,)
+                    cursor.execute(sql_query + " RETURNING id", params)
+                    moved += [row[0] for row in cursor.fetchall()]
+
+                products = []
+                messages = []
+                for start in range(0, len(moved), TRANSITION_CHUNK):
+                    chunk = moved[start:start + TRANSITION_CHUNK]
+                    placeholders = ", ".join("?" * len(chunk))
+                    if status == "Cancelled":
+                        cursor.execute(f"SELECT DISTINCT product_id FROM order_items WHERE order_id IN ({placeholders})", chunk)
+                        products += [row[0] for row in cursor.fetchall()]
+                    cursor.execute(f"""
+                        SELECT o.id, u.username FROM orders o JOIN users u ON u.id = o.user_id
+                        WHERE o.id IN ({placeholders}) AND u.username LIKE '%@%'""", chunk)
+                    messages += [(username, *notification(order_id)) for order_id, username in cursor.fetchall()]
+                if messages:
+                    queue_emails(cursor, messages)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return moved, products, bool(messages)
+
+    # From the status index
+    def count_orders_by_status(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM orders GROUP BY status")
+            return dict(cursor.fetchall())
+
+    def orders_by_status(self, status, after, limit):
+        sql_query = "SELECT id, user_id, order_date, total_kobo, status_changed_at FROM orders WHERE status = ?"
+        params = (status,)
+        if after is not None:
+            sql_query += " AND (status_changed_at, id) > (?, ?)"
+            params += tuple(after)
+        sql_query += " ORDER BY status_changed_at, id LIMIT ?"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, params)
+            return cursor.fetchall()
+
+    def order_events(self, order_id, user_id=None):
+        sql_query, params = "SELECT from_status, to_status, at FROM order_events WHERE order_id = ?", [order_id]
+        if user_id is not None:
+            sql_query += " AND EXISTS (SELECT 1 FROM orders WHERE id = ? AND user_id = ?)"
+            params += [order_id, user_id]
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query + " ORDER BY id", params)
+            return cursor.fetchall()
+
+    # A second rating replaces the first; triggers keep the summary in step
+    def rate_product(self, user_id, product_id, rating, review):
+        with self.pool.connection() as conn:
+            conn.execute("""
+            INSERT INTO product_ratings (user_id, product_id, rating, review, date)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, product_id) DO UPDATE SET
+                rating = excluded.rating, review = excluded.review, date = excluded.date
+            """, (user_id, product_id, rating, review, timestamp()))
+            conn.commit()
+
+    def rating_summary(self, product_id):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT rating_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5
+            FROM product_rating_summary WHERE product_id = ?
+            """, (product_id,))
+            return cursor.fetchone()
+
+    # The key is the rating's rowid
+    def product_reviews(self, product_id, after, limit):
+        sql_query = """
+            SELECT r.rating, r.review, r.date, u.username, r.rowid
+            FROM product_ratings r
+            JOIN users u ON r.user_id = u.id
+            WHERE r.product_id = ?"""
+        params = (product_id,)
+        if after is not None:
+            sql_query += " AND (r.date, r.rowid) < (?, ?)"
+            params += tuple(after)
+        sql_query += " ORDER BY r.date DESC, r.rowid DESC LIMIT ?"
+        params += (limit,)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_query, params)
+            return cursor.fetchall()
+
+    # Only orders already folded into the sales rollups, which are built from this table
+    def archivable_orders(self, cutoff, after_id, limit):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, user_id, order_date, status, total_kobo FROM orders
+                WHERE id > ? AND order_date < ? AND status IN (?, ?)
+                  AND id <= (SELECT value FROM analytics_state WHERE name = 'rollup_order_id')
+                ORDER BY id LIMIT ?
+            """, (after_id, cutoff, *ARCHIVABLE_STATUSES, limit))
+            return cursor.fetchall()
+
+    def delete_orders(self, order_ids):
+        placeholders = ", ".join("?" * len(order_ids))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(f"DELETE FROM order_items WHERE order_id IN ({placeholders})", tuple(order_ids))
+                cursor.execute(f"DELETE FROM orders WHERE id IN ({placeholders})", tuple(order_ids))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def existing_orders(self, order_ids):
+        if not order_ids:
+            return []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT id FROM orders WHERE id IN ({', '.join('?' * len(order_ids))})", tuple(order_ids))
+            return [row[0] for row in cursor.fetchall()]
+
+    # The key is the rating's rowid, stable for the length of one archival run
+    def archivable_reviews(self, cutoff, after_key, limit):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT r.rowid, r.product_id, u.username, r.date, r.review
+                FROM product_ratings r
+                JOIN users u ON r.user_id = u.id
+                WHERE r.rowid > ? AND r.date < ? AND r.review != ''
+                ORDER BY r.rowid LIMIT ?
+            """, (after_key, cutoff, limit))
+            return cursor.fetchall()
+
+    def clear_reviews(self, keys, cutoff):
+        with self.pool.connection() as conn:
+            conn.execute(f"UPDATE product_ratings SET review = NULL WHERE rowid IN ({', '.join('?' * len(keys))}) AND date < ?",
+                         (*keys, cutoff))
+            conn.commit()
+
+    # Streams from one read transaction, so the scan sees a single snapshot
+    def interaction_batches(self, purchase_weight, wishlist_weight, liked_weight, batch_size):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(INTERACTIONS_QUERY, (purchase_weight, wishlist_weight, liked_weight))
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield batch
+
+    def replace_recommendations(self, first_id, end_id, rows):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if end_id is None:
+                    cursor.execute("DELETE FROM product_recommendations WHERE product_id >= ?", (first_id,))
+                else:
+                    cursor.execute("DELETE FROM product_recommendations WHERE product_id >= ? AND product_id < ?",
+                                   (first_id, end_id))
+                cursor.executemany("""
+                    INSERT INTO product_recommendations (product_id, rank, recommended_id, score) VALUES (?, ?, ?, ?)
+                """, rows)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    # One range read of the primary key per given product
+    def recommendations(self, product_ids, limit):
+        placeholders = ", ".join("?" * len(product_ids))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+            SELECT p.id, p.name, p.price_kobo
+            FROM product_recommendations r
+            JOIN products p ON p.id = r.recommended_id
+            WHERE r.product_id IN ({placeholders}) AND r.recommended_id NOT IN ({placeholders}) AND p.stock > 0
+            GROUP BY p.id
+            ORDER BY SUM(r.score) DESC, p.id
+            LIMIT ?
+            """, (*product_ids, *product_ids, limit))
+            return cursor.fetchall()
+
+    def queue_emails(self, messages):
+        with self.pool.connection() as conn:
+            queue_emails(conn.cursor(), messages)
+            conn.commit()
+
+    def claim_emails(self, now, max_attempts, limit, lease_seconds):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("""
+                    SELECT id, recipient, subject, body, created_at, attempts FROM email_outbox
+                    WHERE sent_at IS NULL AND attempts < ? AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT ?
+                """, (max_attempts, now, limit))
+                batch = cursor.fetchall()
+                cursor.executemany("UPDATE email_outbox SET next_attempt_at = ? WHERE id = ?",
+                                   [(now + lease_seconds, message[0]) for message in batch])
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return batch
+
+    def record_emails(self, sent, failed, released=()):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE email_outbox SET sent_at = ? WHERE id = ?", sent)
+            cursor.executemany("""
+                UPDATE email_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            """, failed)
+            cursor.executemany("UPDATE email_outbox SET next_attempt_at = ? WHERE id = ?", released)
+            conn.commit()
+
+    def email_queue_counts(self, max_attempts):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM email_outbox WHERE sent_at IS NULL AND attempts < ?", (max_attempts,))
+            queue_depth = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM email_outbox WHERE sent_at IS NULL AND attempts >= ?", (max_attempts,))
+            return queue_depth, cursor.fetchone()[0]
+
+# The configured backend's name, without connecting to it
+def configured_backend():
+    return os.environ.get("SUPERMARKET_DB_BACKEND", DB_BACKEND)
+
+# The configured backend, created once per process
+@shared_resource
+def repository():
+    backend = configured_backend()
+    if backend == "sqlite":
+        return SQLiteRepository(init_db())
+    if backend == "postgres":
+        # Imported here so psycopg is only needed when the server backend is used
+        from supermarket_postgres import PostgresRepository, postgres_config
+        return PostgresRepository(postgres_config())
+    raise ValueError(f"Unknown database backend: {backend}")
@@ -0,0 +1,801 @@
+# UI-free business logic shared by the Streamlit app, the HTTP API and the benchmarks.
+# Mutating operations return a Result; queries return plain rows.
+import base64
+import hashlib
+import hmac
+import logging
+import random
+import secrets
+import smtplib
+import threading
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+from supermarket_archive import archived_order_page, archived_review_texts, newest_archived_order
+from supermarket_db import categories, get_db, shared_resource
+from supermarket_repository import CheckoutError, StoreBusyError, configured_backend, repository, search_match_expression
+
+logger = logging.getLogger(__name__)
+
+# Outcome of an operation; status is "success", "warning" or "error"
+@dataclass
+class Result:
+    status: str
+    message: str
+    data: object = None
+
+    @property
+    def ok(self):
+        return self.status == "success"
+
+# Money is integer kobo (₦1 = 100 kobo) everywhere below the UI; these convert at the edges
+def to_kobo(naira):
+    return int((Decimal(str(naira)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+def from_kobo(kobo):
+    return Decimal(kobo).scaleb(-2)
+
+def format_naira(kobo):
+    sign = "-" if kobo < 0 else ""
+    return f"{sign}₦{abs(kobo) // 100:,}.{abs(kobo) % 100:02d}"
+
+# Email notifications go through a persistent outbox drained by a background worker
+SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+SENDER_EMAIL = os.environ.get("SMTP_SENDER", "your_email@gmail.com")  # Replace with your Gmail address
+SENDER_PASSWORD = os.environ.get("SMTP_PASSWORD", "your_email_password")  # Replace with your App Password for Gmail
+EMAIL_BATCH_SIZE = 50
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_RETRY_BASE_SECONDS = 5
+EMAIL_IDLE_SECONDS = 2
+# A claimed batch is hidden from other workers this long; unsent messages then come back
+EMAIL_CLAIM_SECONDS = 300
+# The server refused this one message; any other error means the connection is unusable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)
+
+# Function to send email notifications
+def send_email(recipient, subject, body):
+    repository().queue_emails([(recipient, subject, body)])
+    start_email_worker().wake()
+    return Result("success", "Email queued.")
+
+class EmailWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(name="email-outbox", daemon=True)
+        self._wakeup = threading.Event()
+        self._smtp = None
+        self.sent = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+
+    def wake(self):
+        self._wakeup.set()
+
+    # One SMTP session is reused across batches until the queue goes idle
+    def connection(self):
+        if self._smtp is None:
+            smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+            if SMTP_STARTTLS:
+                smtp.starttls()  # Upgrade the connection to secure
+            if SENDER_PASSWORD:
+                smtp.login(SENDER_EMAIL, SENDER_PASSWORD)
+            self._smtp = smtp
+        return self._smtp
+
+    def disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def send(self, recipient, subject, body):
+        msg = MIMEMultipart()
+        msg["From"] = SENDER_EMAIL
+        msg["To"] = recipient
+        msg["Subject"] = subject
+        msg.attach(MIMEText(body, "plain"))
+        try:
+            self.connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle session: reconnect once and retry
+            self._smtp = None
+            self.connection().send_message(msg)
+
+    def process_batch(self):
+        batch = repository().claim_emails(time.time(), EMAIL_MAX_ATTEMPTS, EMAIL_BATCH_SIZE, EMAIL_CLAIM_SECONDS)
+        sent, failed, released = [], [], []
+        for index, (message_id, recipient, subject, body, created_at, attempts) in enumerate(batch):
+            try:
+                self.send(recipient, subject, body)
+                sent_at = time.time()
+                sent.append((sent_at, message_id))
+                self.latencies.append(sent_at - created_at)
+            except (smtplib.SMTPException, OSError) as e:
+                retry_at = time.time() + EMAIL_RETRY_BASE_SECONDS * 2 ** attempts
+                failed.append((retry_at, str(e), message_id))
+                logger.warning("Failed to send email %s to %s: %s", message_id, recipient, e)
+                if isinstance(e, MESSAGE_ERRORS):
+                    continue
+                # Every further message would wait out the same timeout, long enough for the
+                # lease to lapse and another worker to send them too; hand them back unattempted
+                self.disconnect()
+                released = [(time.time(), message[0]) for message in batch[index + 1:]]
+                break
+
+        repository().record_emails(sent, failed, released)
+        self.sent += len(sent)
+        self.failed += len(failed)
+        return len(batch) - len(released)
+
+    def run(self):
+        while True:
+            try:
+                processed = self.process_batch()
+            except Exception:
+                logger.exception("Email worker error")
+                processed = 0
+            if processed < EMAIL_BATCH_SIZE:
+                if not self._wakeup.wait(EMAIL_IDLE_SECONDS):
+                    self.disconnect()
+                self._wakeup.clear()
+
+    def metrics(self):
+        queue_depth, dead = repository().email_queue_counts(EMAIL_MAX_ATTEMPTS)
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": queue_depth,
+            "dead_letters": dead,
+            "sent": self.sent,
+            "failed_attempts": self.failed,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+# One worker per process
+@shared_resource
+def start_email_worker():
+    worker = EmailWorker()
+    worker.start()
+    return worker
+
+# Inventory replenishment: the products_reorder trigger fills reorder_queue as stock
+# crosses a reorder point; this worker turns queued SKUs into one purchase order per supplier
+REORDER_BATCH_SIZE = 500
+REORDER_INTERVAL_SECONDS = 30
+
+# Replenishment and bulk catalog files work on the local SQLite database through get_db.
+# The PostgreSQL schema has no reorder tables, and writing to a local file there would go
+# unseen by the app, so these refuse instead.
+def require_sqlite(feature):
+    if configured_backend() != "sqlite":
+        raise RuntimeError(f"{feature} is only available with the SQLite backend.")
+
+def process_reorder_queue(batch_size=REORDER_BATCH_SIZE):
+    require_sqlite("The reorder queue")
+    created = []
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("""
+                SELECT q.product_id, p.supplier, p.reorder_quantity
+                FROM reorder_queue q
+                JOIN products p ON p.id = q.product_id
+                ORDER BY q.queued_at LIMIT ?
+            """, (batch_size,))
+            queued = cursor.fetchall()
+            by_supplier = {}
+            for product_id, supplier, quantity in queued:
+                by_supplier.setdefault(supplier, []).append((product_id, quantity))
+            
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for supplier, lines in by_supplier.items():
+                cursor.execute("INSERT INTO purchase_orders (supplier, status, created_at) VALUES (?, 'open', ?)",
+                               (supplier, now))
+                purchase_order_id = cursor.lastrowid
+                cursor.executemany("""
+                    INSERT INTO purchase_order_lines (purchase_order_id, product_id, quantity) VALUES (?, ?, ?)
+                """, [(purchase_order_id, product_id, quantity) for product_id, quantity in lines])
+                created.append(purchase_order_id)
+            cursor.executemany("DELETE FROM reorder_queue WHERE product_id = ?", [(row[0],) for row in queued])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return created
+
+# Books the delivered quantities into stock and closes the purchase order
+def receive_purchase_order(purchase_order_id):
+    require_sqlite("Purchase orders")
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("""
+                UPDATE purchase_orders SET status = 'received', received_at = ? WHERE id = ? AND status = 'open'
+            """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), purchase_order_id))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return Result("error", "No open purchase order with that ID.")
+            cursor.execute("SELECT product_id, quantity FROM purchase_order_lines WHERE purchase_order_id = ?",
+                           (purchase_order_id,))
+            lines = cursor.fetchall()
+            cursor.executemany("UPDATE products SET stock = stock + ? WHERE id = ?",
+                               [(quantity, product_id) for product_id, quantity in lines])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    invalidate_catalog([line[0] for line in lines])
+    return Result("success", f"Purchase order {purchase_order_id} received.")
+
+def set_reorder_policy(product_id, reorder_point, reorder_quantity, supplier):
+    require_sqlite("Reorder policies")
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE products SET reorder_point = ?, reorder_quantity = ?, supplier = ? WHERE id = ?
+        """, (reorder_point, reorder_quantity, supplier, product_id))
+        conn.commit()
+    if cursor.rowcount == 0:
+        return Result("error", "Product not found.")
+    return Result("success", "Reorder policy updated.")
+
+# Open purchase orders as (id, supplier, created_at, lines, units)
+def get_open_purchase_orders():
+    require_sqlite("Purchase orders")
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT po.id, po.supplier, po.created_at, COUNT(*), SUM(l.quantity)
+            FROM purchase_orders po
+            JOIN purchase_order_lines l ON l.purchase_order_id = po.id
+            WHERE po.status = 'open'
+            GROUP BY po.id ORDER BY po.id
+        """)
+        return cursor.fetchall()
+
+class ReorderWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(name="reorder-queue", daemon=True)
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run(self):
+        while True:
+            try:
+                process_reorder_queue()
+            except Exception:
+                logger.exception("Reorder worker error")
+            self._wakeup.wait(REORDER_INTERVAL_SECONDS)
+            self._wakeup.clear()
+
+# None with the PostgreSQL backend, which has no reorder queue to work through
+@shared_resource
+def start_reorder_worker():
+    if configured_backend() != "sqlite":
+        logger.info("Reorder worker not started: the reorder queue needs the SQLite backend")
+        return None
+    worker = ReorderWorker()
+    worker.start()
+    return worker
+
+# Password hashing: salted scrypt, encoded as scrypt$n$r$p$salt$hash.
+# Unsalted SHA-256 hashes from older accounts are upgraded on their next successful login.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+# The KDF is deliberately expensive, so it runs on a small bounded pool: a burst of
+# logins queues there (or is turned away) instead of taking every core from other sessions
+KDF_WORKERS = max(2, (os.cpu_count() or 2) // 2)
+KDF_MAX_PENDING = KDF_WORKERS * 8
+KDF_TIMEOUT_SECONDS = 10
+# Sessions live in the database so every node and every browser tab sees them. A token older
+# than the rotate interval is swapped for a new one on its next use; the old token keeps
+# working for a short grace period so a request already in flight is not logged out.
+SESSION_TTL_SECONDS = 8 * 60 * 60
+SESSION_ROTATE_SECONDS = 15 * 60
+SESSION_ROTATE_GRACE_SECONDS = 60
+SESSION_SWEEP_SECONDS = 5 * 60
+SESSION_SWEEP_BATCH = 5000
+
+class LoginBusyError(Exception):
+    pass
+
+@shared_resource
+def kdf_pool():
+    return ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf"), threading.BoundedSemaphore(KDF_MAX_PENDING)
+
+# Queues func on the KDF pool and returns its Future, waiting up to timeout for a free slot.
+# Async callers pass no timeout and await the Future, so no thread of theirs waits on scrypt.
+def submit_kdf(func, *args, timeout=0):
+    executor, pending = kdf_pool()
+    if not pending.acquire(timeout=timeout):
+        raise LoginBusyError("Too many logins in progress. Please try again.")
+    future = executor.submit(func, *args)
+    future.add_done_callback(lambda _: pending.release())
+    return future
+
+def run_kdf(func, *args):
+    return submit_kdf(func, *args, timeout=KDF_TIMEOUT_SECONDS).result()
+
+def scrypt_hash(password, salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+# Utility function for password hashing
+def hash_password(password):
+    salt = secrets.token_bytes(16)
+    digest = scrypt_hash(password, salt)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}"
+
+# Returns (matches, needs_rehash)
+def verify_password(password, stored):
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        matches = hmac.compare_digest(scrypt_hash(password, base64.b64decode(salt), n, r, p), base64.b64decode(digest))
+        return matches, matches and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    # Legacy unsalted SHA-256
+    matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    return matches, matches
+
+# User registration function
+def register_user(username, password, role):
+    try:
+        hashed_password = run_kdf(hash_password, password)
+    except LoginBusyError as e:
+        return Result("error", str(e))
+    return save_user(username, hashed_password, role)
+
+def save_user(username, hashed_password, role):
+    user_id = repository().create_user(username, hashed_password, role)
+    if user_id is None:
+        return Result("error", "Username already exists.")
+    return Result("success", "User registered successfully.", user_id)
+
+# Verified against when the username is unknown, so that costs the same KDF run as a wrong
+# password and response times do not reveal which usernames exist
+@shared_resource
+def dummy_password_hash():
+    return hash_password(secrets.token_urlsafe(16))
+
+# Returns (user_id, role) for valid credentials, otherwise None; raises LoginBusyError when overloaded
+def authenticate(username, password):
+    user = repository().find_user(username)
+    if not user:
+        run_kdf(verify_password, password, dummy_password_hash())
+        return None
+    matches, needs_rehash = run_kdf(verify_password, password, user[2])
+    if not matches:
+        return None
+    if needs_rehash:
+        # Only replace the hash we verified, in case the password changed meanwhile
+        repository().replace_password_hash(user[0], user[2], run_kdf(hash_password, password))
+    return user[0], user[1]
+
+# Only a truncated hash of the token is stored, so a copy of the table holds no usable tokens
+def session_key(token):
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+def create_session(user_id):
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    repository().create_session(session_key(token), user_id, now, now + SESSION_TTL_SECONDS)
+    return token
+
+# Checks credentials once and returns a session token in data
+def login(username, password):
+    try:
+        user = authenticate(username, password)
+    except LoginBusyError as e:
+        return Result("error", str(e))
+    if not user:
+        return Result("error", "Incorrect username or password.")
+    token = create_session(user[0])
+    return Result("success", "Logged in successfully.", {"token": token, "user_id": user[0], "role": user[1]})
+
+# (user_id, role, token) for a live session token, otherwise None. The returned token replaces
+# the caller's once the session is due for rotation; the role is the user's current one.
+def get_session(token):
+    if not token:
+        return None
+    key = session_key(token)
+    session = repository().find_session(key)
+    now = time.time()
+    if not session or session[3] <= now:
+        return None
+    user_id, role, issued_at, _ = session
+    if now - issued_at >= SESSION_ROTATE_SECONDS:
+        rotated = secrets.token_urlsafe(32)
+        # Another request may have rotated this token already; it then stays valid for the grace period
+        if repository().rotate_session(key, session_key(rotated), user_id, now, now + SESSION_TTL_SECONDS,
+                                       now + SESSION_ROTATE_GRACE_SECONDS):
+            token = rotated
+    return user_id, role, token
+
+def logout(token):
+    if token:
+        repository().delete_session(session_key(token))
+    return Result("success", "Logged out successfully.")
+
+# Deletes expired sessions in short batches so the sweep never holds the write lock for long
+def sweep_sessions(batch_size=SESSION_SWEEP_BATCH):
+    now = time.time()
+    swept = 0
+    while True:
+        deleted = repository().sweep_sessions(now, batch_size)
+        swept += deleted
+        if deleted < batch_size:
+            return swept
+
+class SessionSweeper(threading.Thread):
+    def __init__(self):
+        super().__init__(name="session-sweeper", daemon=True)
+
+    def run(self):
+        while True:
+            try:
+                sweep_sessions()
+            except Exception:
+                logger.exception("Session sweeper error")
+            time.sleep(SESSION_SWEEP_SECONDS)
+
+@shared_resource
+def start_session_sweeper():
+    sweeper = SessionSweeper()
+    sweeper.start()
+    return sweeper
+
+# Read-through catalog cache: product rows by id, search pages as lists of ids, and match counts
+CATALOG_CACHE_TTL = 60  # seconds; bounds staleness from writers in other processes
+CATALOG_CACHE_SIZE = 4096
+
+class CatalogCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a load that raced with a write is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Stock changes only touch product rows; search pages hold ids and stay valid
+    def invalidate_products(self, product_ids):
+        with self._lock:
+            self.generation += 1
+            for product_id in product_ids:
+                self._entries.pop(("product", product_id), None)
+
+    # Name, category, price and membership changes can move a product between searches
+    def invalidate_searches(self):
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._entries if key[0] in ("search", "count")]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+@shared_resource
+def catalog_cache():
+    return CatalogCache(CATALOG_CACHE_TTL, CATALOG_CACHE_SIZE)
+
+# Product rows are (id, name, category, iso_number, price_kobo, stock, rating_count, rating_sum)
+def get_products(product_ids):
+    cache = catalog_cache()
+    found = {}
+    for product_id in product_ids:
+        product = cache.get(("product", product_id))
+        if product is not None:
+            found[product_id] = product
+    missing = [product_id for product_id in product_ids if product_id not in found]
+    if missing:
+        generation = cache.generation
+        for product in repository().get_products(missing):
+            found[product[0]] = product
+            cache.put(("product", product[0]), product, generation)
+    return found
+
+def get_product(product_id):
+    return get_products([product_id]).get(product_id)
+
+def invalidate_catalog(product_ids=(), searches=False):
+    cache = catalog_cache()
+    if product_ids:
+        cache.invalidate_products(product_ids)
+    if searches:
+        cache.invalidate_searches()
+
+# Product management functions
+def add_product(name, category, price_kobo, stock):
+    iso_number = categories.get(category, None)
+    if not iso_number:
+        return Result("error", "Invalid category")
+    product_id = repository().add_product(name, category, iso_number, price_kobo, stock)
+    invalidate_catalog(searches=True)
+    return Result("success", "Product added successfully.", product_id)
+
+def update_product(product_id, name, category, price_kobo, stock):
+    iso_number = categories.get(category, None)
+    if not iso_number:
+        return Result("error", "Invalid category")
+    if not repository().update_product(product_id, name, category, iso_number, price_kobo, stock):
+        return Result("error", "Product not found.")
+    invalidate_catalog([product_id], searches=True)
+    return Result("success", "Product updated successfully.")
+
+def remove_product(product_id):
+    if not repository().remove_product(product_id):
+        return Result("error", "Product not found.")
+    invalidate_catalog([product_id], searches=True)
+    return Result("success", "Product removed successfully.")
+
+# Cart Management
+def add_to_cart(user_id, product_id, quantity):
+    # A negative line would lower the order total and raise stock at checkout
+    if quantity < 1:
+        return Result("error", "Quantity must be at least 1.")
+    product = get_product(product_id)
+    if not product or product[5] < quantity:
+        return Result("error", "Requested quantity is not available in stock.")
+    
+    repository().add_to_cart(user_id, product_id, quantity)
+    return Result("success", "Item added to cart.")
+
+# Cart lines as (product_id, name, price_kobo, quantity)
+def get_cart(user_id):
+    return repository().get_cart(user_id)
+
+# Cart total in kobo, summed by the database in exact integer arithmetic
+def get_cart_total(user_id):
+    return repository().get_cart_total(user_id)
+
+def remove_from_cart(user_id, product_id):
+    repository().remove_from_cart(user_id, product_id)
+    return Result("success", "Item removed from cart.")
+
+# Wishlist Management
+def add_to_wishlist(user_id, product_id):
+    if not repository().add_to_wishlist(user_id, product_id):
+        return Result("warning", "Product already in wishlist.")
+    return Result("success", "Product added to wishlist.")
+
+# Wishlist entries as (product_id, name, price_kobo)
+def get_wishlist(user_id):
+    return repository().get_wishlist(user_id)
+
+def remove_from_wishlist(user_id, product_id):
+    repository().remove_from_wishlist(user_id, product_id)
+    return Result("success", "Item removed from wishlist.")
+
+# "Customers also bought" for a product, cart or wishlist: (id, name, price_kobo) rows from the
+# neighbour lists precomputed by supermarket_recommendations.py
+RECOMMENDATION_LIMIT = 5
+
+def get_recommendations(product_ids, limit=RECOMMENDATION_LIMIT):
+    product_ids = list(product_ids)
+    return repository().recommendations(product_ids, limit) if product_ids else []
+
+# Order Management
+CHECKOUT_RETRIES = 5
+CHECKOUT_RETRY_BASE_SECONDS = 0.05
+
+def order_confirmation(order_id, total_kobo, items):
+    lines = "\n".join(f"- {item[1]} x {item[3]} @ {format_naira(item[2])}" for item in items)
+    return f"Order #{order_id} confirmation", f"Thank you for your order.\n\n{lines}\n\nTotal: {format_naira(total_kobo)}"
+
+# Turns the cart into an order; usernames that are email addresses get a confirmation,
+# queued in the same transaction and sent by the outbox worker
+def checkout(user_id):
+    order_id, items, notified = repository().checkout(user_id, order_confirmation)
+    invalidate_catalog([item[0] for item in items])
+    if notified:
+        start_email_worker().wake()
+    return order_id
+
+# Retries checkouts that lost a lock race, with jittered backoff
+def checkout_with_retry(user_id):
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            return checkout(user_id)
+        except StoreBusyError:
+            time.sleep(CHECKOUT_RETRY_BASE_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+    raise CheckoutError("The store is busy right now. Please try again.")
+
+def place_order(user_id):
+    try:
+        order_id = checkout_with_retry(user_id)
+    except CheckoutError as e:
+        return Result("error", str(e))
+    return Result("success", "Order placed successfully.", order_id)
+
+ORDER_PAGE_SIZE = 10
+
+# Pages hold at least one row; the next-page cursor is read from the last one
+def page_size(limit):
+    return max(1, int(limit))
+
+# One page of orders (newest first) plus all of their items in a second query.
+# `after` is the (order_date, id) cursor of the previous page's last order.
+def fetch_order_history(user_id, after=None, limit=ORDER_PAGE_SIZE):
+    limit = page_size(limit)
+    # One extra row tells us whether there is a next page
+    orders = repository().order_page(user_id, after, limit + 1)
+    items = {}
+    # Archived orders are all older than the newest archived one, so the archive is only
+    # read once a page reaches back that far
+    newest_archived = newest_archived_order()
+    if newest_archived and (len(orders) <= limit or orders[-1][1] <= newest_archived):
+        archived, items = archived_order_page(user_id, after, limit + 1)
+        orders = sorted(orders + archived, key=lambda order: (order[1], order[0]), reverse=True)[:limit + 1]
+    next_cursor = (orders[limit - 1][1], orders[limit - 1][0]) if len(orders) > limit else None
+    orders = orders[:limit]
+    items.update(repository().order_items([order[0] for order in orders if order[0] not in items]))
+    return orders, items, next_cursor
+
+# Order lifecycle. Moves are only allowed along ORDER_TRANSITIONS; the backend logs every
+# change to order_events and restores stock when an order is cancelled.
+ORDER_STATUSES = ("Processing", "Packed", "Shipped", "Delivered", "Cancelled")
+ORDER_TRANSITIONS = {
+    "Processing": ("Packed", "Cancelled"),
+    "Packed": ("Shipped", "Cancelled"),
+    "Shipped": ("Delivered",),
+    "Delivered": (),
+    "Cancelled": (),
+}
+# Moves every listed order that may go to `status` in one transaction and queues one email
+# per customer order as a single batch. Returns the moved ids in data; the rest are skipped.
+def transition_orders(order_ids, status, user_id=None):
+    if status not in ORDER_TRANSITIONS:
+        return Result("error", f"Unknown order status: {status}")
+    sources = [source for source, targets in ORDER_TRANSITIONS.items() if status in targets]
+    order_ids = list(dict.fromkeys(order_ids))
+    moved, products, notified = repository().transition_orders(
+        order_ids, status, sources, user_id,
+        lambda order_id: (f"Order #{order_id} is {status.lower()}", f"Your order #{order_id} is now {status.lower()}."))
+    if products:
+        invalidate_catalog(products)
+    if notified:
+        start_email_worker().wake()
+    skipped = len(order_ids) - len(moved)
+    message = f"Moved {len(moved)} orders to {status}." + (f" Skipped {skipped} that cannot move there." if skipped else "")
+    return Result("success" if moved else "warning", message, moved)
+
+def cancel_order(user_id, order_id):
+    result = transition_orders([order_id], "Cancelled", user_id)
+    if not result.data:
+        return Result("error", "This order can no longer be cancelled.")
+    return Result("success", "Order cancelled.", order_id)
+
+# Order count per status, from the status index
+def count_orders_by_status():
+    counts = repository().count_orders_by_status()
+    return {status: counts.get(status, 0) for status in ORDER_STATUSES}
+
+# Oldest orders first in one status, as (id, user_id, order_date, total_kobo, status_changed_at).
+# `after` is the (status_changed_at, id) cursor of the previous page's last order.
+def get_orders_by_status(status, after=None, limit=ORDER_PAGE_SIZE):
+    limit = page_size(limit)
+    orders = repository().orders_by_status(status, after, limit + 1)
+    next_cursor = (orders[limit - 1][4], orders[limit - 1][0]) if len(orders) > limit else None
+    return orders[:limit], next_cursor
+
+# Status changes of one order as (from_status, to_status, at), oldest first; user_id limits
+# them to that customer's own orders
+def get_order_events(order_id, user_id=None):
+    return repository().order_events(order_id, user_id)
+
+# Ratings and Reviews
+REVIEW_PAGE_SIZE = 10
+
+# A user's second rating of a product replaces the first; the backend keeps the summary in step
+def rate_product(user_id, product_id, rating, review):
+    if rating not in range(1, 6):
+        return Result("error", "Rating must be between 1 and 5.")
+    repository().rate_product(user_id, product_id, rating, review)
+    invalidate_catalog([product_id])
+    return Result("success", "Product rated successfully.")
+
+# (count, average, [1-star, ..., 5-star counts]) from the summary row
+def get_rating_summary(product_id):
+    row = repository().rating_summary(product_id)
+    if not row or not row[0]:
+        return 0, 0.0, [0] * 5
+    return row[0], row[1] / row[0], list(row[2:])
+
+# One page of reviews as (rating, review, date, username), newest first.
+# `after` is the (date, key) cursor of the previous page's last review.
+def get_product_reviews(product_id, after=None, limit=REVIEW_PAGE_SIZE):
+    limit = page_size(limit)
+    reviews = repository().product_reviews(product_id, after, limit + 1)
+    next_cursor = (reviews[limit - 1][2], reviews[limit - 1][4]) if len(reviews) > limit else None
+    reviews = [review[:4] for review in reviews[:limit]]
+    # Texts moved to the archive are read back only for pages that show one
+    if any(review[1] is None for review in reviews):
+        texts = archived_review_texts(product_id)
+        reviews = [(rating, texts.get((username, date)) if review is None else review, date, username)
+                   for rating, review, date, username in reviews]
+    return reviews, next_cursor
+
+# Search and Filter Functionality
+PRODUCT_PAGE_SIZE = 20
+PRODUCT_SORTS = ("relevance", "id", "name", "price")
+
+# Keyset pagination: `after` is the (sort value, id) cursor of the previous page's last row.
+# Returns the page and the cursor for the next one (None on the last page).
+def query_products_page(query, category=None, min_price=None, max_price=None,
+                        sort="id", descending=False, after=None, limit=PRODUCT_PAGE_SIZE):
+    limit = page_size(limit)
+    # One extra row tells us whether there is a next page
+    rows = repository().products_page(query, category, min_price, max_price, sort, descending, after, limit + 1)
+    next_cursor = (rows[limit - 1][8], rows[limit - 1][0]) if len(rows) > limit else None
+    return [row[:8] for row in rows[:limit]], next_cursor
+
+# Cached page of (id, name, category, price_kobo, stock, rating_count, average_rating) rows
+# plus the next-page cursor
+def search_products_page(query, category=None, min_price=None, max_price=None,
+                         sort="id", descending=False, after=None, limit=PRODUCT_PAGE_SIZE):
+    limit = page_size(limit)
+    cache = catalog_cache()
+    key = ("search", search_match_expression(query).lower(), category or None, min_price or None,
+           max_price or None, sort, descending, tuple(after) if after else None, limit)
+    cached = cache.get(key)
+    if cached is None:
+        generation = cache.generation
+        products, next_cursor = query_products_page(query, category, min_price, max_price,
+                                                    sort, descending, after, limit)
+        for product in products:
+            cache.put(("product", product[0]), product, generation)
+        cache.put(key, ([product[0] for product in products], next_cursor), generation)
+    else:
+        product_ids, next_cursor = cached
+        found = get_products(product_ids)
+        products = [found[product_id] for product_id in product_ids if product_id in found]
+    return [(p[0], p[1], p[2], p[4], p[5], p[6], p[7] / p[6] if p[6] else None) for p in products], next_cursor
+
+# Total matches, cached apart from the pages; catalog writes clear it
+def count_products(query, category=None, min_price=None, max_price=None):
+    cache = catalog_cache()
+    key = ("count", search_match_expression(query).lower(), category or None, min_price or None, max_price or None)
+    total = cache.get(key)
+    if total is None:
+        generation = cache.generation
+        total = repository().count_products(query, category, min_price, max_price)
+        cache.put(key, total, generation)
+    return total
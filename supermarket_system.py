@@ -1,472 +1,253 @@
+import itertools
+from datetime import date, timedelta
+
 import streamlit as st
-import sqlite3
-from datetime import datetime
-import hashlib
-import random
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-# Define categories with ISO numbers
-categories = {
-    'foods': 1, 'groceries': 2, 'electronics': 3, 'clothes': 4,
-    'accessories': 5, 'pets': 6, 'drinks': 7, 'shoes': 8,
-    'other': 9, 'stuff': 10
-}
+
+import supermarket_analytics as analytics
+import supermarket_service as service
+from supermarket_db import categories, get_db
+from supermarket_profiling import query_stats
+from supermarket_repository import repository
 
 # Initialize session state
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
     st.session_state.user_id = None
     st.session_state.role = None
+    # The token lives only in this browser session's state. In the URL it would end up in
+    # history, bookmarks, copied links and proxy logs, so a full reload means logging in again.
+    st.session_state.session_token = None
+    # Links from older versions carried the token; drop it from the address bar unused
+    if "session" in st.query_params:
+        del st.query_params["session"]
 
-# Function to send email notifications
-def send_email(recipient, subject, body):
-    sender_email = "your_email@gmail.com"  # Replace with your Gmail address
-    sender_password = "your_email_password"  # Replace with your App Password for Gmail
-    smtp_server = "smtp.gmail.com"
-    smtp_port = 587
-
-    try:
-        # Create the email content
-        msg = MIMEMultipart()
-        msg["From"] = sender_email
-        msg["To"] = recipient
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain"))
-
-        # Connect to the Gmail SMTP server
-        with smtplib.SMTP(smtp_server, smtp_port) as smtp:
-            smtp.starttls()  # Upgrade the connection to secure
-            smtp.login(sender_email, sender_password)
-            smtp.send_message(msg)
-
-        print(f"Email sent successfully to {recipient}!")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-
-# Utility function for password hashing
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# Database setup and product population
-def init_db():
-    conn = sqlite3.connect("supermarket.db")
-    cursor = conn.cursor()
-    
-    # Create tables if they don't exist
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE NOT NULL,
-                        password TEXT NOT NULL,
-                        role TEXT NOT NULL)''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS products (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT,
-                        category TEXT,
-                        iso_number INTEGER,
-                        price REAL,
-                        stock INTEGER)''')
-    
-    cursor.execute('SELECT COUNT(*) FROM products')
-    if cursor.fetchone()[0] == 0:
-        for i in range(1, 501):
-            category = random.choice(list(categories.keys()))
-            iso_number = categories[category]
-            price = random.randint(500, 100000)
-            stock = random.randint(5, 10)
-            cursor.execute('''
-                INSERT INTO products (name, category, iso_number, price, stock)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (f"Product {i}", category, iso_number, price, stock))
-        conn.commit()
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS cart (
-                        user_id INTEGER,
-                        product_id INTEGER,
-                        quantity INTEGER,
-                        FOREIGN KEY(user_id) REFERENCES users(id),
-                        FOREIGN KEY(product_id) REFERENCES products(id))''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS wishlist (
-                        user_id INTEGER,
-                        product_id INTEGER,
-                        FOREIGN KEY(user_id) REFERENCES users(id),
-                        FOREIGN KEY(product_id) REFERENCES products(id))''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        order_date TEXT,
-                        status TEXT,
-                        total_amount REAL,
-                        FOREIGN KEY(user_id) REFERENCES users(id))''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS order_items (
-                        order_id INTEGER,
-                        product_id INTEGER,
-                        quantity INTEGER,
-                        price REAL,
-                        FOREIGN KEY(order_id) REFERENCES orders(id),
-                        FOREIGN KEY(product_id) REFERENCES products(id))''')
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS product_ratings (
-                        user_id INTEGER,
-                        product_id INTEGER,
-                        rating INTEGER,
-                        review TEXT,
-                        date TEXT,
-                        FOREIGN KEY(user_id) REFERENCES users(id),
-                        FOREIGN KEY(product_id) REFERENCES products(id))''')
-    
-    conn.commit()
-    return conn
-
-# User registration function
-def register_user(username, password, role):
-    conn = init_db()
-    cursor = conn.cursor()
-    hashed_password = hash_password(password)
-    try:
-        cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, hashed_password, role))
-        conn.commit()
-        st.success("User registered successfully.")
-    except sqlite3.IntegrityError:
-        st.error("Username already exists.")
-    conn.close()
+# Render a service Result as a Streamlit message
+def show_result(result):
+    getattr(st, result.status)(result.message)
 
 # User login function
 def login_user(username, password):
-    conn = init_db()
-    cursor = conn.cursor()
-    hashed_password = hash_password(password)
-    cursor.execute("SELECT id, role FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-    user = cursor.fetchone()
-    conn.close()
-    if user:
-        st.session_state.logged_in = True
-        st.session_state.user_id = user[0]
-        st.session_state.role = user[1]
-        st.success("Logged in successfully.")
-    else:
-        st.error("Incorrect username or password.")
+    result = service.login(username, password)
+    if result.ok:
+        st.session_state.session_token = result.data["token"]
+        restore_session()
+    show_result(result)
+
+# Resolves the session token against the session store on every rerun, so the role used
+# below is always the stored one; expired or revoked sessions are logged out
+def restore_session():
+    session = service.get_session(st.session_state.session_token)
+    st.session_state.logged_in = session is not None
+    st.session_state.user_id, st.session_state.role, st.session_state.session_token = session or (None, None, None)
 
 # Logout function
 def logout():
-    st.session_state.logged_in = False
-    st.session_state.user_id = None
-    st.session_state.role = None
-    st.success("Logged out successfully.")
-
-# Product management functions
-def add_product(name, category, price, stock):
-    conn = init_db()
-    cursor = conn.cursor()
-    iso_number = categories.get(category, None)
-    if iso_number:
-        cursor.execute("INSERT INTO products (name, category, iso_number, price, stock) VALUES (?, ?, ?, ?, ?)", (name, category, iso_number, price, stock))
-        conn.commit()
-        st.success("Product added successfully.")
-    else:
-        st.error("Invalid category")
-    conn.close()
-
-def update_product(product_id, name, category, price, stock):
-    conn = init_db()
-    cursor = conn.cursor()
-    iso_number = categories.get(category, None)
-    if iso_number:
-        cursor.execute("UPDATE products SET name = ?, category = ?, iso_number = ?, price = ?, stock = ? WHERE id = ?", (name, category, iso_number, price, stock, product_id))
-        conn.commit()
-        st.success("Product updated successfully.")
-    else:
-        st.error("Invalid category")
-    conn.close()
-
-def remove_product(product_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
-    st.success("Product removed successfully.")
+    show_result(service.logout(st.session_state.session_token))
+    st.session_state.session_token = None
+    restore_session()
+
+# Per-user reads are cached across reruns. The version argument is the invalidation key:
+# a write in this session takes a fresh number from a process-wide counter, so the next
+# read misses the cache. Changes made elsewhere show up within USER_DATA_TTL.
+USER_DATA_TTL = 60
+
+@st.cache_resource
+def data_versions():
+    return itertools.count(1)
+
+def data_version(name):
+    versions = st.session_state.setdefault("data_versions", {})
+    if name not in versions:
+        versions[name] = next(data_versions())
+    return versions[name]
+
+def invalidate(*names):
+    versions = st.session_state.setdefault("data_versions", {})
+    for name in names:
+        versions[name] = next(data_versions())
+
+@st.cache_data(ttl=USER_DATA_TTL, max_entries=1000)
+def cached_cart(user_id, version):
+    return service.get_cart(user_id)
+
+@st.cache_data(ttl=USER_DATA_TTL, max_entries=1000)
+def cached_cart_total(user_id, version):
+    return service.get_cart_total(user_id)
+
+@st.cache_data(ttl=USER_DATA_TTL, max_entries=1000)
+def cached_wishlist(user_id, version):
+    return service.get_wishlist(user_id)
+
+@st.cache_data(ttl=USER_DATA_TTL, max_entries=1000)
+def cached_order_history(user_id, after, version):
+    return service.fetch_order_history(user_id, after)
+
+@st.cache_data(ttl=USER_DATA_TTL, max_entries=1000)
+def cached_product_reviews(product_id, after, version):
+    return service.get_rating_summary(product_id), service.get_product_reviews(product_id, after)
+
+# Shared by every user; the lists only change when the offline job rebuilds them
+@st.cache_data(ttl=USER_DATA_TTL, max_entries=1000)
+def cached_recommendations(product_ids):
+    return service.get_recommendations(product_ids)
+
+# Sections run as fragments, so their own widgets only rerun that section. A successful
+# write also changes what other sections show: drop the affected cached reads and rerun
+# the whole page, carrying the message over to it.
+def apply_write(result, *names):
+    if result.ok:
+        invalidate(*names)
+        st.session_state.flash = result
+        st.rerun()
+    show_result(result)
+
+def show_flash():
+    result = st.session_state.pop("flash", None)
+    if result:
+        show_result(result)
+
+def show_recommendations(product_ids):
+    products = cached_recommendations(tuple(sorted(product_ids)))
+    if products:
+        st.write("**Customers Also Bought:**")
+        for product in products:
+            st.write(f" - **Product ID:** {product[0]} | **Name:** {product[1]} | **Price:** {service.format_naira(product[2])}")
 
 # Cart Management
-def add_to_cart(user_id, product_id, quantity):
-    conn = init_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT stock FROM products WHERE id = ?", (product_id,))
-    stock = cursor.fetchone()
-    if not stock or stock[0] < quantity:
-        st.error("Requested quantity is not available in stock.")
-        conn.close()
-        return
-    
-    cursor.execute("SELECT quantity FROM cart WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-    existing = cursor.fetchone()
-    if existing:
-        new_quantity = existing[0] + quantity
-        cursor.execute("UPDATE cart SET quantity = ? WHERE user_id = ? AND product_id = ?", (new_quantity, user_id, product_id))
-    else:
-        cursor.execute("INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)", (user_id, product_id, quantity))
-    
-    conn.commit()
-    conn.close()
-    st.success("Item added to cart.")
-
 def view_cart(user_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    SELECT p.id, p.name, p.price, c.quantity 
-    FROM cart c
-    JOIN products p ON c.product_id = p.id
-    WHERE c.user_id = ?
-    """, (user_id,))
-    
-    items = cursor.fetchall()
-    conn.close()
+    items = cached_cart(user_id, data_version("cart"))
     if not items:
         st.write("Your cart is empty.")
     else:
         st.write("### Your Cart")
-        total = 0
         for item in items:
-            st.write(f"**Product ID:** {item[0]} | **Name:** {item[1]} | **Price:** ₦{item[2]:,.2f} | **Quantity:** {item[3]}")
-            total += item[2] * item[3]
-        st.write(f"**Total Amount:** ₦{total:,.2f}")
-
-def remove_from_cart(user_id, product_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM cart WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-    conn.commit()
-    conn.close()
-    st.success("Item removed from cart.")
+            st.write(f"**Product ID:** {item[0]} | **Name:** {item[1]} | **Price:** {service.format_naira(item[2])} | **Quantity:** {item[3]}")
+        total = cached_cart_total(user_id, data_version("cart"))
+        st.write(f"**Total Amount:** {service.format_naira(total)}")
+        show_recommendations(item[0] for item in items)
 
 # Wishlist Management
-def add_to_wishlist(user_id, product_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    # Check if already in wishlist
-    cursor.execute("SELECT * FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-    if cursor.fetchone():
-        st.warning("Product already in wishlist.")
-    else:
-        cursor.execute("INSERT INTO wishlist (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
-        conn.commit()
-        st.success("Product added to wishlist.")
-    conn.close()
-
 def view_wishlist(user_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT p.id, p.name, p.price 
-    FROM wishlist w
-    JOIN products p ON w.product_id = p.id
-    WHERE w.user_id = ?
-    """, (user_id,))
-    
-    items = cursor.fetchall()
-    conn.close()
+    items = cached_wishlist(user_id, data_version("wishlist"))
     if not items:
         st.write("Your wishlist is empty.")
     else:
         st.write("### Your Wishlist")
         for item in items:
-            st.write(f"**Product ID:** {item[0]} | **Name:** {item[1]} | **Price:** ₦{item[2]:,.2f}")
-
-def remove_from_wishlist(user_id, product_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-    conn.commit()
-    conn.close()
-    st.success("Item removed from wishlist.")
+            st.write(f"**Product ID:** {item[0]} | **Name:** {item[1]} | **Price:** {service.format_naira(item[2])}")
+        show_recommendations(item[0] for item in items)
 
 # Order Management
-def place_order(user_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    
-    # Retrieve cart items
-    cursor.execute("""
-    SELECT p.id, p.name, p.price, c.quantity, p.stock 
-    FROM cart c
-    JOIN products p ON c.product_id = p.id
-    WHERE c.user_id = ?
-    """, (user_id,))
-    
-    items = cursor.fetchall()
-    if not items:
-        st.error("Your cart is empty.")
-        conn.close()
-        return
-
-    # Calculate total and check stock
-    total_amount = 0
-    for item in items:
-        if item[4] < item[3]:
-            st.error(f"Insufficient stock for {item[1]}. Available: {item[4]}, Requested: {item[3]}.")
-            conn.close()
-            return
-        total_amount += item[2] * item[3]
-    
-    # Insert order
-    order_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-        INSERT INTO orders (user_id, order_date, status, total_amount)
-        VALUES (?, ?, ?, ?)
-    """, (user_id, order_date, "Processing", total_amount))
-    order_id = cursor.lastrowid
-    
-    # Insert order items and update stock
-    for item in items:
-        cursor.execute("""
-            INSERT INTO order_items (order_id, product_id, quantity, price)
-            VALUES (?, ?, ?, ?)
-        """, (order_id, item[0], item[3], item[2]))
-        cursor.execute("""
-            UPDATE products SET stock = stock - ? WHERE id = ?
-        """, (item[3], item[0]))
-    
-    # Clear cart
-    cursor.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
-    
-    conn.commit()
-    conn.close()
-    st.success("Order placed successfully.")
-
 def view_order_history(user_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT id, order_date, status, total_amount 
-    FROM orders 
-    WHERE user_id = ?
-    ORDER BY order_date DESC
-    """, (user_id,))
+    if st.session_state.get("order_cursors_user") != user_id:
+        st.session_state.order_cursors_user = user_id
+        st.session_state.order_cursors = [None]
+    cursors = st.session_state.order_cursors
     
-    orders = cursor.fetchall()
-    conn.close()
+    orders, items, next_cursor = cached_order_history(user_id, cursors[-1], data_version("orders"))
     if not orders:
         st.write("No orders found.")
     else:
         st.write("### Order History")
         for order in orders:
-            st.write(f"**Order ID:** {order[0]} | **Date:** {order[1]} | **Status:** {order[2]} | **Total:** ₦{order[3]:,.2f}")
-            # Optionally, show order items
-            conn = init_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-            SELECT p.name, oi.quantity, oi.price 
-            FROM order_items oi
-            JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = ?
-            """, (order[0],))
-            items = cursor.fetchall()
-            conn.close()
-            for item in items:
-                st.write(f" - **Product:** {item[0]} | **Quantity:** {item[1]} | **Price:** ₦{item[2]:,.2f}")
+            st.write(f"**Order ID:** {order[0]} | **Date:** {order[1]} | **Status:** {order[2]} | **Total:** {service.format_naira(order[3])}")
+            for item in items[order[0]]:
+                st.write(f" - **Product:** {item[0]} | **Quantity:** {item[1]} | **Price:** {service.format_naira(item[2])}")
+            if "Cancelled" in service.ORDER_TRANSITIONS[order[2]]:
+                if st.button(f"Cancel Order {order[0]}", key=f"cancel_{order[0]}"):
+                    apply_write(service.cancel_order(user_id, order[0]), "orders")
             st.write("---")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Newer Orders", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with col2:
+        st.button("Older Orders", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
 
 # Ratings and Reviews
-def rate_product(user_id, product_id, rating, review):
-    conn = init_db()
-    cursor = conn.cursor()
-    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-    INSERT INTO product_ratings (user_id, product_id, rating, review, date)
-    VALUES (?, ?, ?, ?, ?)
-    """, (user_id, product_id, rating, review, date))
-    conn.commit()
-    conn.close()
-    st.success("Product rated successfully.")
-
 def view_product_reviews(product_id):
-    conn = init_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT r.rating, r.review, r.date, u.username 
-    FROM product_ratings r
-    JOIN users u ON r.user_id = u.id
-    WHERE r.product_id = ?
-    ORDER BY r.date DESC
-    """, (product_id,))
+    if st.session_state.get("review_cursors_product") != product_id:
+        st.session_state.review_cursors_product = product_id
+        st.session_state.review_cursors = [None]
+    cursors = st.session_state.review_cursors
     
-    reviews = cursor.fetchall()
-    conn.close()
+    (count, average, stars), (reviews, next_cursor) = cached_product_reviews(product_id, cursors[-1],
+                                                                             data_version("reviews"))
     if not reviews:
         st.write("No reviews yet for this product.")
     else:
         st.write("### Product Reviews")
+        st.write(f"**Average Rating:** {average:.1f}/5 from {count} reviews")
+        for star in range(5, 0, -1):
+            st.write(f"{star}★: {stars[star - 1]}")
+        st.write("---")
         for review in reviews:
             st.write(f"**Username:** {review[3]} | **Rating:** {review[0]}/5 | **Date:** {review[2]}")
             st.write(f"**Review:** {review[1]}")
             st.write("---")
-
-# Search and Filter Functionality
-def search_products(query, category=None, min_price=None, max_price=None):
-    conn = init_db()
-    cursor = conn.cursor()
-    
-    sql_query = "SELECT id, name, category, price, stock FROM products WHERE name LIKE ?"
-    params = (f"%{query}%",)
-    
-    if category and category != "All":
-        sql_query += " AND category = ?"
-        params += (category,)
+    show_recommendations([product_id])
     
-    if min_price:
-        sql_query += " AND price >= ?"
-        params += (min_price,)
-    
-    if max_price:
-        sql_query += " AND price <= ?"
-        params += (max_price,)
-    
-    cursor.execute(sql_query, params)
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Newer Reviews", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with col2:
+        st.button("Older Reviews", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
 
-# Display products with search and filter
+# Display products with search and filter. Search pages come from the service's catalog cache.
+@st.fragment
 def display_products(user_id):
     st.write("### Available Products")
     
     query = st.text_input("Search Products")
     category = st.selectbox("Category", ["All"] + list(categories.keys()))
     min_price, max_price = st.slider("Price Range (₦)", 0, 100000, (0, 100000))
-    
-    products = search_products(query, category if category != "All" else None, min_price, max_price)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort = st.selectbox("Sort By", list(service.PRODUCT_SORTS) if query else ["id", "name", "price"])
+    with col2:
+        descending = st.checkbox("Descending")
+    with col3:
+        page_size = st.selectbox("Per Page", [10, service.PRODUCT_PAGE_SIZE, 50, 100], index=1)
+    
+    category = category if category != "All" else None
+    # Any change to the search starts again from the first page
+    search_key = (query, category, min_price, max_price, sort, descending, page_size)
+    if st.session_state.get("product_search_key") != search_key:
+        st.session_state.product_search_key = search_key
+        st.session_state.product_cursors = [None]
+    cursors = st.session_state.product_cursors
+    
+    price_range = (service.to_kobo(min_price) if min_price else None, service.to_kobo(max_price) if max_price else None)
+    products, next_cursor = service.search_products_page(query, category, *price_range,
+                                                         sort, descending, cursors[-1], page_size)
+    total = service.count_products(query, category, *price_range)
     
     if not products:
         st.write("No products found.")
     else:
+        st.write(f"Page {len(cursors)} of {max(-(-total // page_size), 1)} ({total} products)")
         for product in products:
-            st.write(f"**Product ID:** {product[0]} | **Name:** {product[1]} | **Category:** {product[2]} | **Price:** ₦{product[3]:,.2f} | **Stock:** {product[4]}")
+            rating = f"{product[6]:.1f}★ ({product[5]})" if product[5] else "No ratings"
+            st.write(f"**Product ID:** {product[0]} | **Name:** {product[1]} | **Category:** {product[2]} | **Price:** {service.format_naira(product[3])} | **Stock:** {product[4]} | **Rating:** {rating}")
             col1, col2, col3 = st.columns(3)
             with col1:
                 quantity = st.number_input(f"Quantity for Product {product[0]}", min_value=1, max_value=product[4], value=1, key=f"qty_{product[0]}")
             with col2:
                 if st.button(f"Add to Cart {product[0]}", key=f"cart_{product[0]}"):
-                    add_to_cart(user_id, product[0], quantity)
+                    apply_write(service.add_to_cart(user_id, product[0], quantity), "cart")
             with col3:
                 if st.button(f"Add to Wishlist {product[0]}", key=f"wishlist_{product[0]}"):
-                    add_to_wishlist(user_id, product[0])
+                    apply_write(service.add_to_wishlist(user_id, product[0]), "wishlist")
             st.write("---")
-
-# Customer Dashboard
-def customer_dashboard(user_id):
-    st.write("### Customer Dashboard")
-    
-    # Search and Display Products
-    display_products(user_id)
     
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Previous Page", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with col2:
+        st.button("Next Page", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
+
+@st.fragment
+def cart_section(user_id):
     # View Cart
     if st.checkbox("View Cart"):
         view_cart(user_id)
@@ -474,77 +255,82 @@ def customer_dashboard(user_id):
     
     # Remove items from cart
     if st.checkbox("Remove Items from Cart"):
-        conn = init_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT p.id, p.name, c.quantity 
-        FROM cart c
-        JOIN products p ON c.product_id = p.id
-        WHERE c.user_id = ?
-        """, (user_id,))
-        cart_items = cursor.fetchall()
-        conn.close()
+        cart_items = cached_cart(user_id, data_version("cart"))
         if not cart_items:
             st.write("Your cart is empty.")
         else:
-            product_ids = [str(item[0]) for item in cart_items]
-            product_id_to_remove = st.selectbox("Select Product ID to Remove", product_ids)
-            if st.button("Remove from Cart"):
-                remove_from_cart(user_id, int(product_id_to_remove))
+            with st.form("remove_from_cart"):
+                product_ids = [str(item[0]) for item in cart_items]
+                product_id_to_remove = st.selectbox("Select Product ID to Remove", product_ids)
+                if st.form_submit_button("Remove from Cart"):
+                    apply_write(service.remove_from_cart(user_id, int(product_id_to_remove)), "cart")
+        st.write("---")
+    
+    # Place Order
+    if st.button("Place Order"):
+        apply_write(service.place_order(user_id), "cart", "orders")
         st.write("---")
 
-         # Wishlist
+@st.fragment
+def wishlist_section(user_id):
     if st.checkbox("View Wishlist"):
         view_wishlist(user_id)
         st.write("---")
     
     # Remove items from wishlist
     if st.checkbox("Remove Items from Wishlist"):
-        conn = init_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT p.id, p.name 
-        FROM wishlist w
-        JOIN products p ON w.product_id = p.id
-        WHERE w.user_id = ?
-        """, (user_id,))
-        wishlist_items = cursor.fetchall()
-        conn.close()
+        wishlist_items = cached_wishlist(user_id, data_version("wishlist"))
         if not wishlist_items:
             st.write("Your wishlist is empty.")
         else:
-            product_ids = [str(item[0]) for item in wishlist_items]
-            product_id_to_remove = st.selectbox("Select Product ID to Remove from Wishlist", product_ids)
-            if st.button("Remove from Wishlist"):
-                remove_from_wishlist(user_id, int(product_id_to_remove))
-        st.write("---")
-    
-    # Place Order
-    if st.button("Place Order"):
-        place_order(user_id)
+            with st.form("remove_from_wishlist"):
+                product_ids = [str(item[0]) for item in wishlist_items]
+                product_id_to_remove = st.selectbox("Select Product ID to Remove from Wishlist", product_ids)
+                if st.form_submit_button("Remove from Wishlist"):
+                    apply_write(service.remove_from_wishlist(user_id, int(product_id_to_remove)), "wishlist")
         st.write("---")
-    
-    # View Order History
+
+@st.fragment
+def orders_section(user_id):
     if st.checkbox("View Order History"):
         view_order_history(user_id)
         st.write("---")
-    
-    # Rate a Product
+
+# The review inputs live in a form, so moving the slider or typing reruns nothing
+def rate_product_form(user_id):
     st.write("### Rate a Product")
-    product_id = st.number_input("Enter Product ID to Rate", min_value=1, step=1)
-    rating = st.slider("Rating (1-5)", 1, 5, 3)
-    review = st.text_area("Write a Review")
-    if st.button("Submit Review"):
-        rate_product(user_id, product_id, rating, review)
+    with st.form("rate_product", clear_on_submit=True):
+        product_id = st.number_input("Enter Product ID to Rate", min_value=1, step=1)
+        rating = st.slider("Rating (1-5)", 1, 5, 3)
+        review = st.text_area("Write a Review")
+        if st.form_submit_button("Submit Review"):
+            apply_write(service.rate_product(user_id, product_id, rating, review), "reviews")
     st.write("---")
-    
-    # Display Product Reviews
+
+@st.fragment
+def reviews_section():
     st.write("### View Product Reviews")
     product_id_view = st.number_input("Enter Product ID to View Reviews", min_value=1, step=1)
     if st.button("View Reviews"):
-        view_product_reviews(product_id_view)
+        st.session_state.review_product_id = product_id_view
+    # Stays open across reruns so the review pager keeps working
+    if st.session_state.get("review_product_id"):
+        view_product_reviews(st.session_state.review_product_id)
     st.write("---")
 
+# Customer Dashboard
+def customer_dashboard(user_id):
+    st.write("### Customer Dashboard")
+    show_flash()
+    
+    # Search and Display Products
+    display_products(user_id)
+    cart_section(user_id)
+    wishlist_section(user_id)
+    orders_section(user_id)
+    rate_product_form(user_id)
+    reviews_section()
+
 # Supermarket Dashboard (Admin or Store Management)
 def supermarket_dashboard(user_id):
     if st.session_state.role != 'admin':
@@ -557,38 +343,169 @@ def supermarket_dashboard(user_id):
     st.subheader("Add New Product")
     product_name = st.text_input("Product Name")
     category = st.selectbox("Category", list(categories.keys()))
-    price = st.number_input("Price", min_value=1, value=1000)
+    price = st.number_input("Price (₦)", min_value=0.01, value=1000.00, format="%.2f")
     stock = st.number_input("Stock", min_value=1, value=10)
     
     if st.button("Add Product"):
-        add_product(product_name, category, price, stock)
+        show_result(service.add_product(product_name, category, service.to_kobo(price), stock))
 
     # Update Product
     st.subheader("Update Product")
     product_id = st.number_input("Product ID to Update", min_value=1, step=1)
     if product_id:
-        cursor = init_db().cursor()
-        cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-        product = cursor.fetchone()
-        conn = sqlite3.connect("supermarket.db")
+        product = service.get_product(product_id)
         if product:
             updated_name = st.text_input("New Name", value=product[1])
             updated_category = st.selectbox("New Category", list(categories.keys()), index=list(categories.keys()).index(product[2]))
-            updated_price = st.number_input("New Price", min_value=1, value=product[4])
+            updated_price = st.number_input("New Price (₦)", min_value=0.01, value=float(service.from_kobo(product[4])), format="%.2f")
             updated_stock = st.number_input("New Stock", min_value=1, value=product[5])
 
             if st.button("Update Product"):
-                update_product(product_id, updated_name, updated_category, updated_price, updated_stock)
-        conn.close()
+                show_result(service.update_product(product_id, updated_name, updated_category, service.to_kobo(updated_price), updated_stock))
 
     # Remove Product
     st.subheader("Remove Product")
     product_id_remove = st.number_input("Product ID to Remove", min_value=1, step=1)
     if st.button("Remove Product"):
-        remove_product(product_id_remove)
+        show_result(service.remove_product(product_id_remove))
+
+    # Email outbox health
+    st.subheader("Email Notifications")
+    metrics = service.start_email_worker().metrics()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Queued", metrics["queue_depth"])
+    col2.metric("Sent", metrics["sent"])
+    col3.metric("Failed Attempts", metrics["failed_attempts"])
+    col4.metric("Median Latency (s)", f"{metrics['latency_p50']:.2f}")
+
+    # Catalog cache effectiveness
+    st.subheader("Catalog Cache")
+    cache_stats = service.catalog_cache().stats()
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Entries", cache_stats["entries"])
+    col2.metric("Hits", cache_stats["hits"])
+    col3.metric("Misses", cache_stats["misses"])
+    col4.metric("Hit Rate", f"{cache_stats['hits'] / lookups:.0%}" if lookups else "n/a")
+
+    order_fulfilment()
+    # Replenishment and reporting are built from SQLite triggers on the local database
+    if repository().backend == "sqlite":
+        reorder_queue()
+        sales_analytics()
+    else:
+        st.info("Reorder queue and sales analytics are only available with the SQLite backend.")
+    query_profile()
+
+# Replenishment
+def reorder_queue():
+    st.subheader("Reorder Queue")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        reorder_product_id = st.number_input("Product ID", min_value=1, step=1, key="reorder_product_id")
+    with col2:
+        reorder_point = st.number_input("Reorder Point", min_value=0, value=3)
+    with col3:
+        reorder_quantity = st.number_input("Reorder Quantity", min_value=1, value=20)
+    with col4:
+        supplier = st.text_input("Supplier", value="default")
+    if st.button("Save Reorder Policy"):
+        show_result(service.set_reorder_policy(reorder_product_id, reorder_point, reorder_quantity, supplier))
+    if st.button("Create Purchase Orders Now"):
+        created = service.process_reorder_queue()
+        st.success(f"Created {len(created)} purchase orders.")
+    purchase_orders = service.get_open_purchase_orders()
+    if not purchase_orders:
+        st.write("No open purchase orders.")
+    else:
+        for po in purchase_orders:
+            st.write(f"**PO:** {po[0]} | **Supplier:** {po[1]} | **Created:** {po[2]} | **Lines:** {po[3]} | **Units:** {po[4]}")
+        po_to_receive = st.selectbox("Purchase Order to Receive", [po[0] for po in purchase_orders])
+        if st.button("Mark as Received"):
+            show_result(service.receive_purchase_order(po_to_receive))
+
+# Fulfilment queue: oldest orders in a status first, moved in bulk
+def order_fulfilment():
+    st.subheader("Order Fulfilment")
+    counts = service.count_orders_by_status()
+    for column, (status, count) in zip(st.columns(len(counts)), counts.items()):
+        column.metric(status, count)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        from_status = st.selectbox("Orders In", [status for status, targets in service.ORDER_TRANSITIONS.items() if targets])
+    with col2:
+        to_status = st.selectbox("Move To", service.ORDER_TRANSITIONS[from_status])
+    with col3:
+        batch_size = st.number_input("Oldest N Orders", min_value=1, max_value=10000, value=100)
+    orders, _ = service.get_orders_by_status(from_status, limit=batch_size)
+    if not orders:
+        st.write(f"No orders in {from_status}.")
+        return
+    st.dataframe([{"Order ID": o[0], "User ID": o[1], "Date": o[2], "Total": service.format_naira(o[3]), "Since": o[4]}
+                  for o in orders[:50]],
+                 hide_index=True)
+    if st.button(f"Move {len(orders)} Orders to {to_status}"):
+        show_result(service.transition_orders([order[0] for order in orders], to_status))
+
+# Sales charts over the daily rollups
+def sales_analytics():
+    st.subheader("Sales Analytics")
+    analytics.refresh_sales_rollups()
+    selected = st.date_input("Date Range", value=(date.today() - timedelta(days=30), date.today()))
+    # The picker returns a single date while the range is being chosen
+    if len(selected) != 2:
+        st.info("Select an end date.")
+        return
+    start, end = (day.isoformat() for day in selected)
+    
+    daily = analytics.daily_sales(start, end)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Revenue", service.format_naira(int(daily["revenue_kobo"].sum())))
+    col2.metric("Orders", int(daily["orders"].sum()))
+    col3.metric("Units Sold", int(daily["units"].sum()))
+    if not daily.empty:
+        st.line_chart(daily["revenue_kobo"] / 100)
+    
+    by_category = analytics.sales_by_category(start, end)
+    if not by_category.empty:
+        st.write("**Revenue by Category**")
+        st.bar_chart(by_category.set_index("category")["revenue_kobo"] / 100)
+    
+    st.write("**Top Sellers**")
+    top = analytics.top_products(start, end)
+    st.dataframe(top.assign(revenue=top.pop("revenue_kobo").map(service.format_naira)), hide_index=True)
+    
+    st.write(f"**Low Stock (≤ {analytics.LOW_STOCK_THRESHOLD})**")
+    st.dataframe(analytics.low_stock(), hide_index=True)
+
+# Where SQL time goes, per calling function, plus the latest slow statements with their plans
+def query_profile():
+    st.subheader("Query Profile")
+    summary = query_stats.summary()
+    if not summary:
+        st.write("No queries recorded yet.")
+        return
+    st.dataframe([{"Function": row[0], "Calls": row[1], "Rows": row[2], "Total (ms)": round(row[3], 1),
+                   "Mean (ms)": round(row[4], 2), "Max (ms)": round(row[5], 1)} for row in summary], hide_index=True)
+    st.write(f"**Slow Queries (≥ {query_stats.slow_ms:g} ms)**")
+    with get_db() as conn:
+        slow_queries = query_stats.slow_log(conn)
+    for query in reversed(slow_queries):
+        with st.expander(f"{query['time']} | {query['function']} | {query['ms']:.1f} ms | {query['rows']} rows"):
+            st.code(query["sql"], language="sql")
+            st.code("\n".join(query["plan"]) or "(no plan)")
+    if st.button("Reset Query Stats"):
+        query_stats.reset()
 
 # Main Streamlit UI 
 def main():
+    repository()
+    service.start_email_worker()
+    service.start_reorder_worker()
+    service.start_session_sweeper()
+    restore_session()
+
     if st.session_state.logged_in:
         if st.session_state.role == "admin":
             supermarket_dashboard(st.session_state.user_id)
@@ -603,7 +520,7 @@ def main():
             password = st.text_input("Password", type="password")
             role = st.selectbox("Role", ["customer", "admin"])
             if st.button("Register"):
-                register_user(username, password, role)
+                show_result(service.register_user(username, password, role))
         else:
             username = st.text_input("Username")
             password = st.text_input("Password", type="password")
@@ -616,4 +533,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-